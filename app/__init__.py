@@ -1,5 +1,4 @@
 from flask import Flask
-from app.models import Admin, Users, UserCallData, Calls, Credits
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
@@ -11,15 +10,19 @@ load_dotenv()
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
 CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
 
-with app.app_context():
-    Admin.create_table()
-    Users.create_table()
-    UserCallData.create_table()
-    Calls.create_table()
-    Credits.create_table()
-        
-from app.routes import admin_routes, user_routes, credit_routes
+from app import metrics, models
+from app.routes import admin_routes, user_routes, credit_routes, media_routes, metrics_routes, telephony_routes, voice_routes
+
+if metrics.enabled():
+    metrics.instrument_models(models)
+    for blueprint in (admin_routes.bp, user_routes.bp, credit_routes.bp, telephony_routes.bp):
+        metrics.instrument_blueprint(blueprint)
 
 app.register_blueprint(admin_routes.bp)
 app.register_blueprint(user_routes.bp)
 app.register_blueprint(credit_routes.bp)
+app.register_blueprint(media_routes.bp)
+app.register_blueprint(metrics_routes.bp)
+app.register_blueprint(telephony_routes.bp)
+app.register_blueprint(voice_routes.bp)
+voice_routes.sock.init_app(app)
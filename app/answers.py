@@ -0,0 +1,183 @@
+import os
+import threading
+from collections import OrderedDict
+
+from app import metrics, retrieval
+
+ANSWER_LOOKUPS = metrics.registry.counter(
+    'answer_cache_lookups_total', 'Answer cache lookups by outcome.', ('outcome',))
+
+
+def question_terms(question):
+    # Lexical normalization: lower-case, drop stopwords and plural s, so
+    # "What are your opening hours?" and "opening hour" share a key.
+    terms = []
+    for token in retrieval.tokenize(question or ''):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+class _TenantAnswers:
+    __slots__ = ('version', 'entries', 'postings', 'stats')
+
+    def __init__(self, version):
+        self.version = version
+        # key -> (term set, answer), least recently used first
+        self.entries = OrderedDict()
+        self.postings = {}
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    def clear(self):
+        self.entries.clear()
+        self.postings.clear()
+        self.stats['invalidations'] += 1
+
+    def remove(self, key):
+        terms, _ = self.entries.pop(key)
+        for term in terms:
+            keys = self.postings[term]
+            keys.discard(key)
+            if not keys:
+                del self.postings[term]
+
+    def nearest(self, terms, threshold):
+        # Jaccard similarity over term sets, scored only against entries that
+        # share at least one term with the question.
+        overlaps = {}
+        for term in terms:
+            for key in self.postings.get(term, ()):
+                overlaps[key] = overlaps.get(key, 0) + 1
+        best_key, best_score = None, threshold
+        for key, overlap in overlaps.items():
+            score = overlap / float(len(terms) + len(self.entries[key][0]) - overlap)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+
+class AnswerCache:
+    # Generated answers per tenant, keyed by the dataset version and the
+    # normalized question. A version change (dataset edited) empties the
+    # tenant's entries; both tenants and entries per tenant are LRU-bounded.
+    def __init__(self, max_tenants=256, max_entries=256, threshold=0.8, max_answer_chars=2000):
+        self.max_tenants = max_tenants
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_answer_chars = max_answer_chars
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tenant(self, user_id, version):
+        tenant = self._tenants.get(user_id)
+        if tenant is None:
+            tenant = self._tenants[user_id] = _TenantAnswers(version)
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        elif tenant.version != version:
+            tenant.clear()
+            tenant.version = version
+        self._tenants.move_to_end(user_id)
+        return tenant
+
+    def lookup(self, user_id, version, question):
+        terms = question_terms(question)
+        if not terms:
+            return None
+        key = ' '.join(terms)
+        with self._lock:
+            tenant = self._tenant(user_id, version)
+            outcome = 'hits'
+            if key not in tenant.entries:
+                outcome = 'near_hits'
+                key = tenant.nearest(set(terms), self.threshold)
+            if key is None:
+                tenant.stats['misses'] += 1
+                answer = None
+                outcome = 'misses'
+            else:
+                tenant.entries.move_to_end(key)
+                tenant.stats[outcome] += 1
+                answer = tenant.entries[key][1]
+        ANSWER_LOOKUPS.inc((outcome,))
+        return answer
+
+    def store(self, user_id, version, question, answer):
+        terms = question_terms(question)
+        if not terms or not answer or not answer.strip() or len(answer) > self.max_answer_chars:
+            return
+        key = ' '.join(terms)
+        with self._lock:
+            tenant = self._tenant(user_id, version)
+            if key in tenant.entries:
+                tenant.remove(key)
+            term_set = frozenset(terms)
+            tenant.entries[key] = (term_set, answer)
+            for term in term_set:
+                tenant.postings.setdefault(term, set()).add(key)
+            tenant.stats['stores'] += 1
+            while len(tenant.entries) > self.max_entries:
+                tenant.remove(next(iter(tenant.entries)))
+                tenant.stats['evictions'] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            tenant = self._tenants.get(user_id)
+            if tenant is not None:
+                tenant.clear()
+
+    def tenant_stats(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                items = list(self._tenants.items())
+            else:
+                items = [(user_id, self._tenants[user_id])] if user_id in self._tenants else []
+            report = {}
+            for tenant_id, tenant in items:
+                stats = dict(tenant.stats)
+                lookups = stats['hits'] + stats['near_hits'] + stats['misses']
+                stats['hit_rate'] = round((stats['hits'] + stats['near_hits']) / float(lookups), 4) if lookups else 0.0
+                stats['entries'] = len(tenant.entries)
+                report[tenant_id] = stats
+        return report
+
+
+class TenantAnswers:
+    # The view a live call uses: the dataset version comes from the tenant's
+    # retrieval index, which already hashes the dataset once per change.
+    def __init__(self, cache, user_id):
+        self.cache = cache
+        self.user_id = int(user_id)
+
+    def version(self):
+        return retrieval.get_index(self.user_id).version
+
+    def get(self, question):
+        # Returns (answer, version). The caller hands the version back to put,
+        # so an answer is filed under the dataset read before generating it
+        # and an edit made meanwhile empties it on the next lookup.
+        version = self.version()
+        return self.cache.lookup(self.user_id, version, question), version
+
+    def put(self, question, answer, version):
+        self.cache.store(self.user_id, version, question, answer)
+
+
+def enabled():
+    return os.getenv('ANSWER_CACHE', '1') != '0'
+
+
+cache = AnswerCache(
+    max_tenants=int(os.getenv('ANSWER_CACHE_MAX_TENANTS', 256)),
+    max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 256)),
+    threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.8)),
+)
+
+
+def for_tenant(user_id):
+    return TenantAnswers(cache, user_id) if enabled() else None
+
+
+def invalidate(user_id):
+    cache.invalidate(int(user_id))
@@ -0,0 +1,199 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from app.db import transaction
+from app.export import _json_default
+from app.models import CallArchives, Calls
+from app.partitions import drop_empty_partitions
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 50000))
+# Smaller files keep a paged read from decompressing more than it needs
+ARCHIVE_FILE_ROWS = int(os.getenv('ARCHIVE_FILE_ROWS', 5000))
+ARCHIVE_DELETE_CHUNK = int(os.getenv('ARCHIVE_DELETE_CHUNK', 1000))
+
+
+def archive_root():
+    return os.getenv('ARCHIVE_DIR') or os.path.join(tempfile.gettempdir(), 'telecalling-archive')
+
+
+def write_archive(user_id, rows):
+    # Gzipped NDJSON, one call per line; written to a temp name and renamed so
+    # an indexed path always points at a complete file.
+    relative = os.path.join(str(user_id), '%s-%s.ndjson.gz' % (
+        rows[0]['call_timestamp'].strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:12]))
+    path = os.path.join(archive_root(), relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(handle, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as compressed:
+            for row in rows:
+                compressed.write((json.dumps(row, default=_json_default, separators=(',', ':')) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return relative
+
+
+def read_archive(relative):
+    with gzip.open(os.path.join(archive_root(), relative), 'rt', encoding='utf-8') as handle:
+        for line in handle:
+            row = json.loads(line)
+            row['call_timestamp'] = datetime.fromisoformat(row['call_timestamp'])
+            yield row
+
+
+def _sort_key(row):
+    return row['call_timestamp'], row['id']
+
+
+def archived_page(user_id, filter_type='all', after=None, limit=50, include_text=False):
+    # Newest-first rows from the tenant's archive files, continuing from the
+    # same (call_timestamp, id) keyset cursor the live table uses. Only files
+    # whose range starts before the cursor are listed; they are visited newest
+    # first and scanning stops once no older file can contribute. Rows inside
+    # a file are in ascending key order, so reading stops at the cursor.
+    columns = Calls.LIST_COLUMNS + (Calls.TEXT_COLUMNS if include_text else ())
+    cursor_key = tuple(after) if after is not None else None
+    rows = {}
+    # A call archived twice (it changed after its first snapshot) is taken
+    # from the newest file that holds it.
+    newest = {}
+    for entry in CallArchives.list_for_user(user_id, before=after):
+        if len(rows) >= limit:
+            oldest_kept = sorted(rows.values(), key=_sort_key, reverse=True)[limit - 1]
+            if entry['max_ts'] < oldest_kept['call_timestamp']:
+                break
+        for row in read_archive(entry['path']):
+            if cursor_key is not None and _sort_key(row) >= cursor_key:
+                break
+            if newest.get(row['id'], -1) > entry['id']:
+                continue
+            newest[row['id']] = entry['id']
+            if filter_type != 'all' and row['callback_status'] != filter_type:
+                rows.pop(row['id'], None)
+                continue
+            rows[row['id']] = {column: row.get(column) for column in columns}
+        if len(rows) > limit:
+            rows = {row['id']: row for row in sorted(rows.values(), key=_sort_key, reverse=True)[:limit]}
+    return sorted(rows.values(), key=_sort_key, reverse=True)
+
+
+def merge_pages(live, archived, limit):
+    # Live rows win over archived copies of the same call
+    live_ids = {row['id'] for row in live}
+    rows = sorted(live + [row for row in archived if row['id'] not in live_ids], key=_sort_key, reverse=True)
+    return rows[:limit + 1]
+
+
+def _snapshot(user_id, cutoff, batch_size):
+    # Plain consistent read; no row locks are held while the files are written
+    with transaction() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute('''
+            SELECT * FROM calls
+            WHERE user_id = %s AND call_done = 1 AND call_timestamp < %s
+            ORDER BY call_timestamp, id
+            LIMIT %s
+        ''', (user_id, cutoff, batch_size))
+        rows = cursor.fetchall()
+        if rows:
+            call_ids = [row['id'] for row in rows]
+            placeholders = ', '.join(['%s'] * len(call_ids))
+            cursor.execute('SELECT call_id, transcript FROM call_transcripts WHERE call_id IN (%s)' % placeholders, call_ids)
+            transcripts = {item['call_id']: json.loads(zlib.decompress(item['transcript'])) for item in cursor.fetchall()}
+            for row in rows:
+                row['transcript'] = transcripts.get(row['id'])
+        cursor.close()
+    return rows
+
+
+def _delete_archived(user_id, rows, chunk_size):
+    # Short transactions over chunks of the archived ids. A row that changed
+    # since the snapshot stays live (and is archived again by a later run).
+    deleted = 0
+    for start in range(0, len(rows), chunk_size):
+        snapshot = {row['id']: row for row in rows[start:start + chunk_size]}
+        placeholders = ', '.join(['%s'] * len(snapshot))
+        with transaction() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                'SELECT * FROM calls WHERE user_id = %%s AND id IN (%s) FOR UPDATE' % placeholders,
+                [user_id] + list(snapshot)
+            )
+            unchanged = [
+                current['id'] for current in cursor.fetchall()
+                if all(snapshot[current['id']].get(column) == value for column, value in current.items())
+            ]
+            if unchanged:
+                placeholders = ', '.join(['%s'] * len(unchanged))
+                cursor.execute('DELETE FROM call_turns WHERE call_id IN (%s)' % placeholders, unchanged)
+                cursor.execute('DELETE FROM call_transcripts WHERE call_id IN (%s)' % placeholders, unchanged)
+                cursor.execute('DELETE FROM calls WHERE user_id = %%s AND id IN (%s)' % placeholders, [user_id] + unchanged)
+            cursor.close()
+        deleted += len(unchanged)
+    return deleted
+
+
+def archive_user(user_id, cutoff, batch_size=ARCHIVE_BATCH_SIZE, file_rows=ARCHIVE_FILE_ROWS,
+                 delete_chunk=ARCHIVE_DELETE_CHUNK):
+    # Moves one batch of finished calls older than cutoff into archive files
+    # of at most file_rows calls each. Files are written and indexed before
+    # any live row is deleted: a crash leaves calls in both places (readers
+    # prefer the live row) but never in neither.
+    rows = _snapshot(user_id, cutoff, batch_size)
+    if not rows:
+        return 0
+    segments = []
+    for start in range(0, len(rows), file_rows):
+        segment = rows[start:start + file_rows]
+        segments.append((write_archive(user_id, segment), segment))
+    with transaction() as conn:
+        for relative, segment in segments:
+            ids = [row['id'] for row in segment]
+            CallArchives.add_archive(
+                user_id, relative,
+                segment[0]['call_timestamp'], segment[-1]['call_timestamp'],
+                min(ids), max(ids), len(segment),
+                conn=conn
+            )
+    deleted = _delete_archived(user_id, rows, delete_chunk)
+    if deleted < len(rows):
+        logger.info('%d calls of user %s changed while archiving and stay live', len(rows) - deleted, user_id)
+    return len(rows)
+
+
+def run_archive(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, user_id=None):
+    # Daily counters in call_stats_daily are left alone: archived calls still
+    # count towards a tenant's history.
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    with transaction() as conn:
+        cursor = conn.cursor()
+        if user_id is None:
+            cursor.execute('SELECT DISTINCT user_id FROM calls WHERE call_done = 1 AND call_timestamp < %s', (cutoff,))
+            user_ids = [row[0] for row in cursor.fetchall()]
+        else:
+            user_ids = [user_id]
+        cursor.close()
+
+    archived = {}
+    for tenant in user_ids:
+        total = 0
+        while True:
+            moved = archive_user(tenant, cutoff, batch_size)
+            total += moved
+            if moved < batch_size:
+                break
+        if total:
+            archived[tenant] = total
+            logger.info('Archived %d calls for user %s', total, tenant)
+    dropped = drop_empty_partitions(cutoff)
+    return {'archived': archived, 'dropped_partitions': dropped, 'cutoff': cutoff}
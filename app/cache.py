@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    # In-process LRU with a per-entry time to live
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.stats['misses'] += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data.update(size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
+        return data
+
+
+class RedisBackend:
+    # Optional shared tier so gunicorn workers and the dispatcher share loads;
+    # requires the `redis` package.
+    def __init__(self, url, prefix='telecalling:', ttl=300):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_REDIS_URL is set but the redis package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class ReadThroughCache:
+    # Local LRU in front of an optional shared backend in front of a loader.
+    # Invalidation clears both tiers; other processes' local copies age out
+    # within the local TTL.
+    def __init__(self, name, maxsize=1024, ttl=60.0, backend=None):
+        self.name = name
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.stats = {'loads': 0, 'shared_hits': 0}
+
+    def _shared_key(self, key):
+        return '%s:%s' % (self.name, key)
+
+    def get(self, key, loader):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.backend is not None:
+            value = self.backend.get(self._shared_key(key))
+            if value is not _MISSING:
+                with self._lock:
+                    self.stats['shared_hits'] += 1
+                self.local.set(key, value)
+                return value
+        value = loader()
+        with self._lock:
+            self.stats['loads'] += 1
+        self.local.set(key, value)
+        if self.backend is not None:
+            self.backend.set(self._shared_key(key), value)
+        return value
+
+    def invalidate(self, key):
+        self.local.delete(key)
+        if self.backend is not None:
+            self.backend.delete(self._shared_key(key))
+
+    def snapshot(self):
+        data = self.local.snapshot()
+        with self._lock:
+            data.update(self.stats)
+        data['shared_backend'] = self.backend is not None
+        return data
+
+
+def _shared_backend():
+    url = os.getenv('CACHE_REDIS_URL')
+    return RedisBackend(url, ttl=int(os.getenv('CACHE_SHARED_TTL', 300))) if url else None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name):
+    cache = _caches.get(name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                cache = ReadThroughCache(
+                    name,
+                    maxsize=int(os.getenv('CACHE_MAXSIZE', 4096)),
+                    ttl=float(os.getenv('CACHE_TTL', 30)),
+                    backend=_shared_backend(),
+                )
+                _caches[name] = cache
+    return cache
+
+
+def cache_stats():
+    with _caches_lock:
+        caches = dict(_caches)
+    return {name: cache.snapshot() for name, cache in caches.items()}
@@ -0,0 +1,52 @@
+import threading
+import time
+from datetime import datetime
+
+from app.models import CallTurns
+
+
+class TurnRecorder:
+    # Buffers a live call's turns in memory and writes them in batches, so a
+    # turn costs an append to a list rather than a round-trip. append never
+    # touches the database; the caller runs maybe_flush once it has released
+    # its own locks.
+    def __init__(self, call_id, start_seq=None, flush_every=8, flush_interval=2.0):
+        self.call_id = call_id
+        self.seq = CallTurns.next_seq(call_id) if start_seq is None else start_seq
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        # One writer at a time so batches reach the table in order
+        self._flush_lock = threading.Lock()
+
+    def append(self, speaker, text, started_at=None, ended_at=None):
+        if speaker not in CallTurns.SPEAKERS:
+            raise ValueError('Unknown speaker %r' % speaker)
+        ended_at = ended_at or datetime.now()
+        with self._lock:
+            self.pending.append((self.seq, speaker, text, started_at or ended_at, ended_at))
+            self.seq += 1
+
+    def maybe_flush(self):
+        if len(self.pending) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                turns, self.pending = self.pending, []
+            if turns:
+                try:
+                    CallTurns.append_turns(self.call_id, turns)
+                except Exception:
+                    with self._lock:
+                        self.pending = turns + self.pending
+                    raise
+            self.last_flush = time.monotonic()
+
+    def close(self, compact=True):
+        self.flush()
+        if compact:
+            CallTurns.compact(self.call_id)
@@ -0,0 +1,334 @@
+import logging
+import mysql.connector
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+def get_db_config():
+    # Read lazily so values from .env (loaded in app/__init__.py) are picked up
+    return {
+        'host': os.getenv('HOST'),
+        'user': os.getenv('USER'),
+        'password': os.getenv('PASSWORD'),
+        'database': os.getenv('DATABASE')
+    }
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class _PoolEntry:
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PooledConnection:
+    # Thin proxy handed out to callers. close() returns the socket to the pool
+    # instead of tearing it down; everything else is delegated to the driver.
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+        # If a caller raises before close(), the proxy is garbage collected and
+        # the slot is released; the connection is discarded since its state is unknown.
+        self._finalizer = weakref.finalize(self, pool._discard, entry, 'leaked')
+        self._after_commit = []
+
+    def __getattr__(self, name):
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise mysql.connector.errors.OperationalError('Connection already returned to pool')
+        return getattr(entry.raw, name)
+
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+    def commit(self):
+        self.__getattr__('commit')()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception('after-commit callback failed')
+
+    def rollback(self):
+        self._after_commit = []
+        self.__getattr__('rollback')()
+
+    def close(self):
+        self._after_commit = []
+        entry = self._entry
+        if entry is None:
+            return
+        self._entry = None
+        self._finalizer.detach()
+        self._pool._release(entry)
+
+    def discard(self):
+        # Close the underlying socket instead of pooling it, e.g. when an
+        # unbuffered result set was abandoned half-read.
+        entry = self._entry
+        if entry is None:
+            return
+        self._entry = None
+        self._finalizer.detach()
+        self._pool._discard(entry, 'discarded')
+
+
+class ConnectionPool:
+    def __init__(self, db_config, pool_size=10, min_idle=0, wait_timeout=10.0,
+                 idle_timeout=300.0, max_lifetime=1800.0, ping_interval=30.0):
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.min_idle = min_idle
+        self.wait_timeout = wait_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._reset_state()
+        self.stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_timeouts': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'closed_idle': 0,
+            'closed_lifetime': 0,
+            'closed_unhealthy': 0,
+            'closed_leaked': 0,
+            'closed_discarded': 0,
+            'connect_time_total': 0.0,
+        }
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+
+    def _check_fork(self):
+        # Connections inherited from a parent (e.g. the gunicorn master) share
+        # sockets with it; drop them without sending COM_QUIT and start over.
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _connect(self):
+        started = time.monotonic()
+        raw = mysql.connector.connect(**self.db_config)
+        elapsed = time.monotonic() - started
+        metrics.DB_CONNECT_SECONDS.observe(elapsed)
+        with self._lock:
+            self.stats['connections_created'] += 1
+            self.stats['connect_time_total'] += elapsed
+        return _PoolEntry(raw)
+
+    def _close_entry(self, entry, reason):
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self.stats['connections_closed'] += 1
+            self.stats['closed_' + reason] += 1
+
+    def _expired(self, entry, now):
+        return self.max_lifetime and now - entry.created_at > self.max_lifetime
+
+    def _healthy(self, entry, now):
+        if now - entry.last_used < self.ping_interval:
+            return True
+        try:
+            entry.raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _reap_idle_locked(self, now):
+        # Oldest idle connections sit at the left end of the deque
+        reaped = []
+        while len(self._idle) > self.min_idle:
+            entry = self._idle[0]
+            if now - entry.last_used <= self.idle_timeout and not self._expired(entry, now):
+                break
+            self._idle.popleft()
+            self._size -= 1
+            reaped.append(entry)
+        return reaped
+
+    def acquire(self, timeout=None):
+        self._check_fork()
+        timeout = self.wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited = False
+        wait_started = None
+        with self._available:
+            self.stats['checkouts'] += 1
+            while True:
+                now = time.monotonic()
+                reaped = self._reap_idle_locked(now)
+                if self._idle:
+                    entry = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._size < self.pool_size:
+                    entry = None
+                    self._size += 1
+                    self._in_use += 1
+                    break
+                if not waited:
+                    waited = True
+                    wait_started = now
+                    self.stats['waits'] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.stats['wait_timeouts'] += 1
+                    self.stats['wait_time_total'] += now - wait_started
+                    metrics.DB_POOL_TIMEOUTS.inc()
+                    metrics.DB_POOL_WAIT_SECONDS.observe(now - wait_started)
+                    raise PoolTimeoutError('Timed out waiting for a database connection')
+                self._available.wait(remaining)
+            if waited:
+                waited_for = time.monotonic() - wait_started
+                self.stats['wait_time_total'] += waited_for
+                metrics.DB_POOL_WAIT_SECONDS.observe(waited_for)
+
+        for stale in reaped:
+            self._close_entry(stale, 'idle')
+
+        try:
+            if entry is not None:
+                now = time.monotonic()
+                if self._expired(entry, now):
+                    self._close_entry(entry, 'lifetime')
+                    entry = None
+                elif not self._healthy(entry, now):
+                    self._close_entry(entry, 'unhealthy')
+                    entry = None
+            if entry is None:
+                entry = self._connect()
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._in_use -= 1
+                self._available.notify()
+            raise
+        return PooledConnection(self, entry)
+
+    def _release(self, entry):
+        if self._pid != os.getpid():
+            return
+        now = time.monotonic()
+        recycle = None
+        try:
+            if entry.raw.in_transaction:
+                entry.raw.rollback()
+        except Exception:
+            recycle = 'unhealthy'
+        if recycle is None and self._expired(entry, now):
+            recycle = 'lifetime'
+        with self._available:
+            self._in_use -= 1
+            if recycle is None:
+                entry.last_used = now
+                self._idle.append(entry)
+            else:
+                self._size -= 1
+            self._available.notify()
+        if recycle is not None:
+            self._close_entry(entry, recycle)
+
+    def _discard(self, entry, reason):
+        if self._pid != os.getpid():
+            return
+        with self._available:
+            self._in_use -= 1
+            self._size -= 1
+            self._available.notify()
+        self._close_entry(entry, reason)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data.update(
+                pool_size=self.pool_size,
+                open_connections=self._size,
+                in_use=self._in_use,
+                idle=len(self._idle),
+            )
+        return data
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_db_config(),
+                    pool_size=_env_int('DB_POOL_SIZE', 10),
+                    min_idle=_env_int('DB_POOL_MIN_IDLE', 0),
+                    wait_timeout=_env_float('DB_POOL_TIMEOUT', 10),
+                    idle_timeout=_env_float('DB_POOL_IDLE_TIMEOUT', 300),
+                    max_lifetime=_env_float('DB_POOL_MAX_LIFETIME', 1800),
+                    ping_interval=_env_float('DB_POOL_PING_INTERVAL', 30),
+                )
+    return _pool
+
+
+def get_db_connection():
+    return get_pool().acquire()
+
+
+def pool_stats():
+    return get_pool().snapshot()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: _pool is not None and _pool._check_fork())
+
+
+@contextmanager
+def transaction(conn=None):
+    # Unit of work: a caller that already holds a connection passes it in and
+    # keeps ownership of commit/rollback; otherwise this block owns one.
+    if conn is not None:
+        yield conn
+        return
+    conn = get_db_connection()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
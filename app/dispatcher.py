@@ -0,0 +1,442 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app.db import transaction
+from app.models import Calls, CreditReservations, DispatchNumbers
+from app.scheduler import FairScheduler
+from app.telephony import TelephonyError, TransientTelephonyError, get_telephony_client
+
+logger = logging.getLogger(__name__)
+
+
+class NumberLimiter:
+    # Token bucket (calls per second) plus an in-flight cap for one caller ID,
+    # local to this process. With shared limits it only pre-filters; the
+    # DispatchNumbers rows enforce the limit across all dispatchers.
+    def __init__(self, calls_per_second, concurrency, burst=None):
+        self.calls_per_second = calls_per_second
+        self.concurrency = concurrency
+        self.burst = burst or max(1.0, calls_per_second)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.held_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.calls_per_second)
+        self.updated = now
+
+    def try_acquire(self, now):
+        self._refill(now)
+        if now < self.held_until or self.in_flight >= self.concurrency or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def refund(self, now, wait):
+        # The shared limit refused the call: undo try_acquire and hold the
+        # number for as long as the shared bucket asked.
+        self.tokens = min(self.burst, self.tokens + 1)
+        self.in_flight -= 1
+        self.held_until = now + wait
+
+    def wait_time(self, now):
+        self._refill(now)
+        if now < self.held_until:
+            return self.held_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.calls_per_second
+
+
+class Dispatcher:
+    def __init__(self, client, calls_per_second=1.0, concurrency_per_number=1, number_limits=None,
+                 max_workers=16, batch_size=200, poll_interval=2.0, retry_delay=30.0,
+                 lease_seconds=300, owner=None, credits_per_call=1, credit_retry_delay=300.0,
+                 settle_interval=2.0, scheduler=None, scheduler_refresh=10.0, record_attempts=3,
+                 record_backoff=0.2, shared_limits=False):
+        self.client = client
+        self.calls_per_second = calls_per_second
+        self.concurrency_per_number = concurrency_per_number
+        self.number_limits = number_limits or {}
+        # Enforce the per-number limits in the database, so they are totals
+        # over every dispatcher process instead of per-process allowances.
+        self.shared_limits = shared_limits
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.credits_per_call = credits_per_call
+        self.credit_retry_delay = credit_retry_delay
+        self.settle_interval = settle_interval
+        # With a scheduler, claims follow its weighted fair plan across tenants
+        # instead of global id order.
+        self.scheduler = scheduler
+        self.scheduler_refresh = scheduler_refresh
+        self.record_attempts = record_attempts
+        self.record_backoff = record_backoff
+        self._last_refresh = None
+        self.owner = owner or '%s:%d:%s' % (socket.gethostname()[:40], os.getpid(), uuid.uuid4().hex[:8])
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._limiters = {}
+        self._queues = {}
+        self._leased = set()
+        self._queued = 0
+        # reservation_id -> {'outstanding': calls not finished, 'used': credits
+        # used since the last flush}; finished reservations wait in _closing.
+        self._reservations = {}
+        self._closing = set()
+        # Calls that were dialed but whose lease could not be marked
+        # dispatched yet; their leases are kept alive until it sticks.
+        self._unrecorded = set()
+        self.stats = {'claimed': 0, 'placed': 0, 'failed': 0, 'retried': 0, 'lost_leases': 0, 'credit_deferred': 0,
+                      'unrecorded': 0}
+
+    @classmethod
+    def from_env(cls, client=None):
+        return cls(
+            client or get_telephony_client(),
+            calls_per_second=float(os.getenv('DISPATCH_CALLS_PER_SECOND', 1)),
+            concurrency_per_number=int(os.getenv('DISPATCH_CONCURRENCY_PER_NUMBER', 1)),
+            number_limits=json.loads(os.getenv('DISPATCH_NUMBER_LIMITS', '{}')),
+            max_workers=int(os.getenv('DISPATCH_WORKERS', 16)),
+            batch_size=int(os.getenv('DISPATCH_BATCH_SIZE', 200)),
+            poll_interval=float(os.getenv('DISPATCH_POLL_INTERVAL', 2)),
+            lease_seconds=int(os.getenv('DISPATCH_LEASE_SECONDS', 300)),
+            credits_per_call=int(os.getenv('DISPATCH_CREDITS_PER_CALL', 1)),
+            credit_retry_delay=float(os.getenv('DISPATCH_CREDIT_RETRY_SECONDS', 300)),
+            settle_interval=float(os.getenv('DISPATCH_SETTLE_INTERVAL', 2)),
+            scheduler=FairScheduler(
+                credits_per_call=int(os.getenv('DISPATCH_CREDITS_PER_CALL', 1)),
+                default_concurrency=int(os.getenv('DISPATCH_TENANT_CONCURRENCY', 0)) or None,
+            ) if os.getenv('DISPATCH_SCHEDULER', 'fair') == 'fair' else None,
+            scheduler_refresh=float(os.getenv('DISPATCH_SCHEDULER_REFRESH', 10)),
+            shared_limits=os.getenv('DISPATCH_SHARED_LIMITS', '1') != '0',
+        )
+
+    def limiter_for(self, number):
+        limiter = self._limiters.get(number)
+        if limiter is None:
+            # DISPATCH_NUMBER_LIMITS = {"+15550001": {"calls_per_second": 2, "concurrency": 4}}
+            override = self.number_limits.get(number, {})
+            limiter = NumberLimiter(
+                float(override.get('calls_per_second', self.calls_per_second)),
+                int(override.get('concurrency', self.concurrency_per_number))
+            )
+            self._limiters[number] = limiter
+        return limiter
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def refresh_scheduler(self):
+        backlog = Calls.get_dispatch_backlog()
+        with self._lock:
+            self.scheduler.refresh(backlog)
+        self._last_refresh = time.monotonic()
+
+    def claim_fair(self):
+        if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.scheduler_refresh:
+            self.refresh_scheduler()
+        with self._lock:
+            plan = self.scheduler.next_batch(self.batch_size)
+        if not plan:
+            return []
+        calls = Calls.claim_tenant_calls(self.owner, plan, lease_seconds=self.lease_seconds)
+        claimed = {}
+        for call in calls:
+            claimed[call['user_id']] = claimed.get(call['user_id'], 0) + 1
+        with self._lock:
+            for user_id, count in plan.items():
+                if claimed.get(user_id, 0) < count:
+                    self.scheduler.shortfall(user_id, count - claimed.get(user_id, 0))
+        return calls
+
+    def claim(self):
+        if self.scheduler is not None:
+            calls = self.claim_fair()
+        else:
+            calls = Calls.claim_calls(self.owner, limit=self.batch_size, lease_seconds=self.lease_seconds)
+        with self._lock:
+            self._leased.update(call['id'] for call in calls)
+            self.stats['claimed'] += len(calls)
+        if self.credits_per_call:
+            calls = self.reserve_credits(calls)
+        return calls
+
+    def reserve_credits(self, calls):
+        # One reservation per tenant per claimed batch. Calls the tenant cannot
+        # pay for stay leased but ownerless until credit_retry_delay passes.
+        by_user = {}
+        for call in calls:
+            by_user.setdefault(call['user_id'], []).append(call)
+        allowed = []
+        unpaid = []
+        for user_id, tenant_calls in by_user.items():
+            reservation_id, granted = CreditReservations.reserve(
+                user_id, len(tenant_calls) * self.credits_per_call, owner=self.owner,
+                ttl_seconds=self.lease_seconds * 2, partial=True
+            )
+            count = granted // self.credits_per_call
+            for call in tenant_calls[:count]:
+                call['reservation_id'] = reservation_id
+            allowed.extend(tenant_calls[:count])
+            unpaid.extend(tenant_calls[count:])
+            if reservation_id is not None:
+                with self._lock:
+                    self._reservations[reservation_id] = {'outstanding': count, 'used': 0}
+                    if not count:
+                        self._closing.add(reservation_id)
+        if unpaid:
+            call_ids = [call['id'] for call in unpaid]
+            Calls.defer_calls(call_ids, self.owner, int(self.credit_retry_delay))
+            with self._lock:
+                self._leased.difference_update(call_ids)
+                self.stats['credit_deferred'] += len(unpaid)
+                if self.scheduler is not None:
+                    for call in unpaid:
+                        self.scheduler.release(call['user_id'])
+                        self.scheduler.exhaust_credits(call['user_id'])
+        return allowed
+
+    def _settle_call(self, call, used):
+        reservation_id = call.get('reservation_id')
+        if reservation_id is None:
+            return
+        with self._lock:
+            entry = self._reservations.get(reservation_id)
+            if entry is None:
+                return
+            entry['used'] += used
+            entry['outstanding'] -= 1
+            if entry['outstanding'] <= 0:
+                self._closing.add(reservation_id)
+
+    def flush_credits(self):
+        # Per-call usage is only accumulated in memory; this writes it for all
+        # reservations in one statement and closes the finished ones, so the
+        # credits rows are touched once per batch rather than once per call.
+        with self._lock:
+            usage = {}
+            for reservation_id, entry in self._reservations.items():
+                if entry['used']:
+                    usage[reservation_id] = entry['used']
+                    entry['used'] = 0
+            closing = list(self._closing)
+            self._closing.clear()
+            finished = {reservation_id: self._reservations.pop(reservation_id) for reservation_id in closing}
+        if not usage and not closing:
+            return
+        try:
+            with transaction() as conn:
+                CreditReservations.settle(usage, conn=conn)
+                CreditReservations.release(closing, conn=conn)
+        except Exception:
+            logger.exception('Credit settlement failed; will retry')
+            with self._lock:
+                for reservation_id, entry in finished.items():
+                    self._reservations[reservation_id] = entry
+                for reservation_id, used in usage.items():
+                    self._reservations[reservation_id]['used'] += used
+                self._closing.update(closing)
+
+    def renew_leases(self):
+        # Calls waiting behind a number's rate limit must not lose their lease
+        self.finish_unrecorded()
+        with self._lock:
+            call_ids = list(self._leased | self._unrecorded)
+            reservation_ids = list(self._reservations)
+        Calls.extend_leases(self.owner, call_ids, lease_seconds=self.lease_seconds)
+        CreditReservations.extend(reservation_ids, ttl_seconds=self.lease_seconds * 2)
+        # Any dispatcher refunds reservations left open by one that died
+        CreditReservations.release_expired()
+        if self.shared_limits:
+            DispatchNumbers.purge_expired()
+
+    def release_queued(self):
+        with self._lock:
+            calls = [call for queue in self._queues.values() for call in queue]
+            call_ids = [call['id'] for call in calls]
+            self._queues.clear()
+            self._queued = 0
+            self._leased.difference_update(call_ids)
+            if self.scheduler is not None:
+                for call in calls:
+                    self.scheduler.release(call['user_id'], refund=True)
+        Calls.release_leases(self.owner, call_ids)
+        for call in calls:
+            self._settle_call(call, 0)
+
+    def enqueue(self, calls):
+        with self._lock:
+            for call in calls:
+                self._queues.setdefault(call['twilio_phone_number'], deque()).append(call)
+                self._queued += 1
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _finish(self, call, limiter, used):
+        with self._lock:
+            limiter.release()
+            self._leased.discard(call['id'])
+            if self.scheduler is not None:
+                self.scheduler.release(call['user_id'], refund=not used)
+        if self.shared_limits:
+            try:
+                DispatchNumbers.release(call['id'])
+            except Exception:
+                # The slot expires after lease_seconds anyway
+                logger.warning('Could not release the number slot of call %s', call['id'], exc_info=True)
+        self._settle_call(call, used)
+        self._wakeup.set()
+
+    def record_outcome(self, call, callback_status, call_done):
+        with transaction() as conn:
+            if not Calls.finish_dispatch(call['id'], self.owner, conn=conn):
+                # Lease expired and another worker took the row over
+                self._count('lost_leases')
+            # A fast busy/failed callback may already have set the outcome
+            Calls.update_call_status(call['id'], callback_status, call_done, keep_provider_outcome=True, conn=conn)
+
+    def record_placed(self, call):
+        # The call has been dialed; from here on the row must never be leased
+        # again, whatever happens to the status write.
+        for attempt in range(self.record_attempts):
+            try:
+                self.record_outcome(call, 'no', 1)
+                return
+            except Exception:
+                logger.warning('Recording call %s failed (attempt %d)', call['id'], attempt + 1, exc_info=True)
+                time.sleep(self.record_backoff * 2 ** attempt)
+        self._count('unrecorded')
+        with self._lock:
+            self._unrecorded.add(call['id'])
+        self.finish_unrecorded()
+
+    def finish_unrecorded(self):
+        # Only closes the lease, in its own small transaction; the status
+        # stays as it was and is left to the provider callbacks.
+        with self._lock:
+            call_ids = list(self._unrecorded)
+        for call_id in call_ids:
+            try:
+                Calls.finish_dispatch(call_id, self.owner)
+            except Exception:
+                logger.exception('Could not mark call %s dispatched; will retry', call_id)
+                continue
+            with self._lock:
+                self._unrecorded.discard(call_id)
+
+    def place(self, call, limiter):
+        used = 0
+        try:
+            self.client.place_call(call)
+        except TransientTelephonyError as e:
+            logger.warning('Call %s deferred: %s', call['id'], e)
+            Calls.defer_call(call['id'], self.owner, int(self.retry_delay))
+            self._count('retried')
+        except TelephonyError as e:
+            logger.warning('Call %s failed: %s', call['id'], e)
+            self.record_outcome(call, 'callback_needed', 1)
+            self._count('failed')
+        except Exception:
+            logger.exception('Call %s could not be dispatched', call['id'])
+        else:
+            used = self.credits_per_call
+            self._count('placed')
+            self.record_placed(call)
+        finally:
+            self._finish(call, limiter, used)
+
+    def acquire_shared(self, call, limiter):
+        # Returns 0.0 when the shared limit admits the call, else seconds to wait
+        try:
+            return DispatchNumbers.acquire(
+                call['twilio_phone_number'], call['id'], limiter.calls_per_second, limiter.concurrency,
+                burst=limiter.burst, slot_seconds=self.lease_seconds
+            )
+        except Exception:
+            logger.exception('Shared limit check for %s failed', call['twilio_phone_number'])
+            return self.poll_interval
+
+    def schedule(self, executor):
+        # Start every call whose caller ID has a token and a free slot; returns
+        # how long to sleep before some blocked number can make progress.
+        now = time.monotonic()
+        next_wake = self.poll_interval
+        ready = []
+        with self._lock:
+            for number in list(self._queues):
+                queue = self._queues[number]
+                limiter = self.limiter_for(number)
+                while queue and limiter.try_acquire(now):
+                    ready.append((number, queue.popleft(), limiter))
+                    self._queued -= 1
+                if not queue:
+                    del self._queues[number]
+                elif limiter.in_flight < limiter.concurrency:
+                    next_wake = min(next_wake, limiter.wait_time(now))
+        # The shared check is a database round-trip, so it runs without the lock
+        held = {}
+        for number, call, limiter in ready:
+            if self.shared_limits and number not in held:
+                wait = self.acquire_shared(call, limiter)
+                if wait:
+                    held[number] = (wait, [])
+            if number in held:
+                held[number][1].append((call, limiter))
+                continue
+            executor.submit(self.place, call, limiter)
+        if held:
+            with self._lock:
+                for number, (wait, calls) in held.items():
+                    queue = self._queues.setdefault(number, deque())
+                    for call, limiter in reversed(calls):
+                        limiter.refund(now, wait)
+                        queue.appendleft(call)
+                        self._queued += 1
+                    next_wake = min(next_wake, wait)
+        return max(next_wake, 0.001)
+
+    def run(self, until_idle=False):
+        last_claim = 0.0
+        last_renewal = time.monotonic()
+        last_settle = last_renewal
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dispatch') as executor:
+            while not self._stopping.is_set():
+                now = time.monotonic()
+                if self._queued < self.batch_size and now - last_claim >= self.poll_interval:
+                    calls = self.claim()
+                    self.enqueue(calls)
+                    last_claim = now if not calls else 0.0
+                    if until_idle and not calls and not self._queued and not self._leased:
+                        break
+                if now - last_renewal >= self.lease_seconds / 3.0:
+                    self.renew_leases()
+                    last_renewal = now
+                if now - last_settle >= self.settle_interval:
+                    self.flush_credits()
+                    last_settle = now
+                delay = self.schedule(executor)
+                self._wakeup.wait(min(delay, self.poll_interval))
+                self._wakeup.clear()
+            self.release_queued()
+        self.finish_unrecorded()
+        self.flush_credits()
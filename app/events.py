@@ -0,0 +1,86 @@
+import queue
+import threading
+
+# In-process publish/subscribe used to push call changes to open dashboards.
+# queue.Queue is cooperative under gevent's monkey patching, so a blocked
+# subscriber only parks its own greenlet.
+
+
+class Subscription:
+    def __init__(self, bus, user_id, maxsize):
+        self.bus = bus
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Set when events were dropped; the consumer must resynchronise
+        self.overflowed = False
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self, limit):
+        events = []
+        while len(events) < limit:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        # Stamped on every event as 'seq', in publish order
+        self._sequence = 0
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, self.maxsize)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def sequence(self):
+        # Events are published after their commit, so every event stamped with
+        # a seq up to this value is visible to a query started afterwards.
+        with self._lock:
+            return self._sequence
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self.stats['published'] += 1
+            self._sequence += 1
+            event = dict(event, seq=self._sequence)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+                delivered = True
+            except queue.Full:
+                subscription.overflowed = True
+                delivered = False
+            with self._lock:
+                self.stats['delivered' if delivered else 'dropped'] += 1
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+bus = EventBus()
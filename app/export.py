@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# Rows are coalesced into chunks of roughly this size before being written
+CHUNK_SIZE = 64 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, default=_json_default, separators=(',', ':')) + '\n'
+
+
+def csv_lines(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if isinstance(value, (datetime, date)) else value
+            for value in (row.get(column) for column in columns)
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def chunked(lines, chunk_size=CHUNK_SIZE):
+    parts = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzipped(chunks, level=6):
+    # wbits=31 emits a gzip container rather than a raw zlib stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_rows(rows, export_format, columns, compress=False):
+    if export_format == 'csv':
+        lines = csv_lines(rows, columns)
+    else:
+        lines = ndjson_lines(rows)
+    chunks = chunked(lines)
+    return gzipped(chunks) if compress else chunks
@@ -0,0 +1,204 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import uuid
+
+from mysql.connector import errors as db_errors
+
+from app import jobs
+from app.db import transaction
+from app.models import Calls, Jobs
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE = 'client_upload'
+UPLOAD_FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', 1000))
+# A running upload that saved no progress for this long lost its web worker
+STALE_SECONDS = int(os.getenv('UPLOAD_STALE_SECONDS', 300))
+PHONE_PATTERN = re.compile(r'^\+?\d{7,15}$')
+PHONE_STRIP = re.compile(r'[\s\-().]')
+
+
+class RowError(ValueError):
+    pass
+
+
+def upload_dir():
+    # The worker resumes uploads from here, so it must see the same directory
+    # as the web tier (a shared volume when they run on different hosts).
+    path = os.getenv('UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'telecalling-uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def spool_upload(file_storage):
+    # The request stream is gone once the handler returns, so the upload is
+    # copied to disk and parsed from there by the background job. Returns the
+    # file name, which the job resolves against upload_dir().
+    name = uuid.uuid4().hex
+    file_storage.save(os.path.join(upload_dir(), name))
+    return name
+
+
+def detect_format(filename, requested=None):
+    if requested:
+        return requested if requested in UPLOAD_FORMATS else None
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if extension in ('csv', 'txt', ''):
+        return 'csv'
+    return None
+
+
+def iter_records(handle, upload_format):
+    # Yields (line_number, record) lazily; a malformed line yields its error
+    # instead of a record so the rest of the file still goes through.
+    if upload_format == 'ndjson':
+        for line_number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, RowError('Invalid JSON')
+                continue
+            yield line_number, record
+        return
+
+    reader = csv.reader(handle)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+
+def validate_record(record):
+    if not isinstance(record, dict):
+        raise RowError('Row must be an object with name and phone')
+    name = str(record.get('name') or '').strip()
+    phone = PHONE_STRIP.sub('', str(record.get('phone') or ''))
+    if not name:
+        raise RowError('Missing name')
+    if len(name) > 255:
+        raise RowError('Name is longer than 255 characters')
+    if not PHONE_PATTERN.match(phone):
+        raise RowError('Invalid phone number')
+    return name, phone
+
+
+def _insert_batch(batch, errors, save_progress):
+    # save_progress(inserted, conn) records the job's row offset. On the fast
+    # path it shares the rows' transaction, so a resumed job never inserts a
+    # committed batch twice; a crash during the row-by-row retry below can
+    # repeat the rows of that one batch.
+    rows = [call for _, call in batch]
+    try:
+        with transaction() as conn:
+            Calls.add_bulk_calls(rows, conn=conn)
+            save_progress(len(rows), conn)
+        return len(rows)
+    except (db_errors.DataError, db_errors.IntegrityError):
+        pass
+    # A row was rejected; retry row by row so one bad row only costs itself.
+    # Anything else (lost connection, lock timeout) fails the job instead.
+    inserted = 0
+    for line_number, call in batch:
+        try:
+            with transaction() as conn:
+                Calls.add_bulk_calls([call], conn=conn)
+            inserted += 1
+        except (db_errors.DataError, db_errors.IntegrityError) as e:
+            errors.append({'line': line_number, 'error': str(e)})
+    save_progress(inserted, None)
+    return inserted
+
+
+def run_upload_job(job_id, user_id, state, processed=0, succeeded=0, failed=0, errors=None, batch_size=BATCH_SIZE):
+    # state holds the spooled file name and the upload options. processed is
+    # the number of records already accounted for, so a job resumed after its
+    # process died skips them and continues with the next batch.
+    if not Jobs.claim_job(job_id):
+        return
+    path = os.path.join(upload_dir(), state['file'])
+    skip = processed
+    errors = list(errors or [])
+    batch = []
+
+    def flush():
+        nonlocal succeeded, failed
+        batch_errors = []
+
+        def save_progress(inserted, conn):
+            Jobs.update_progress(
+                job_id, processed, succeeded + inserted, failed + len(batch) - inserted,
+                errors + batch_errors[:Jobs.MAX_ERRORS - len(errors)], conn=conn
+            )
+
+        inserted = _insert_batch(batch, batch_errors, save_progress)
+        succeeded += inserted
+        failed += len(batch) - inserted
+        errors.extend(batch_errors[:Jobs.MAX_ERRORS - len(errors)])
+        del batch[:]
+
+    try:
+        with io.open(path, 'r', encoding='utf-8-sig', errors='replace', newline='') as handle:
+            for line_number, record in iter_records(handle, state['format']):
+                if skip:
+                    skip -= 1
+                    continue
+                processed += 1
+                try:
+                    if isinstance(record, RowError):
+                        raise record
+                    name, phone = validate_record(record)
+                except RowError as e:
+                    failed += 1
+                    if len(errors) < Jobs.MAX_ERRORS:
+                        errors.append({'line': line_number, 'error': str(e)})
+                    continue
+                batch.append((line_number, (user_id, name, phone, state.get('call_type', '1way'), '', state.get('ai_transmission_message', ''), 'no', 0)))
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        Jobs.update_progress(job_id, processed, succeeded, failed, errors, status='done')
+    except Exception as e:
+        Jobs.update_progress(job_id, processed, succeeded, failed, errors, status='failed')
+        Jobs.finish_job(job_id, 'failed', str(e))
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def resume_stalled(stale_seconds=STALE_SECONDS, wait=False):
+    # Uploads are started by the web workers; a restart there leaves the job
+    # running with no thread behind it, so the worker process picks it up.
+    resumed = []
+    for job in Jobs.claim_stalled(JOB_TYPE, stale_seconds):
+        logger.info('Resuming upload job %s for user %s at row %s', job['id'], job['user_id'], job['processed_rows'])
+        args = (
+            job['id'], job['user_id'], job['state'],
+            job['processed_rows'] or 0, job['succeeded_rows'] or 0, job['failed_rows'] or 0, job['errors']
+        )
+        if wait:
+            run_upload_job(*args)
+        else:
+            jobs.submit(run_upload_job, *args)
+        resumed.append(job['id'])
+    return resumed
+
+
+def start_resumer(interval=60.0, stop_event=None):
+    return jobs.run_periodically(resume_stalled, interval, 'upload-resumer', stop_event)
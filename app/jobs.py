@@ -0,0 +1,46 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    # One executor per process; a forked worker must not reuse the parent's threads
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('JOB_WORKERS', 2)),
+                    thread_name_prefix='job'
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    return get_executor().submit(fn, *args, **kwargs)
+
+
+def run_periodically(fn, interval, name, stop_event=None):
+    # Background thread for long-running processes (the dispatcher worker);
+    # set the returned event to stop it.
+    stop_event = stop_event or threading.Event()
+
+    def loop():
+        while not stop_event.is_set():
+            try:
+                fn()
+            except Exception:
+                logger.exception('%s failed', name)
+            stop_event.wait(interval)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return stop_event
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+PROMPT_TEMPLATE = '''You are a friendly phone assistant for a business, talking to a caller.
+Answer in one to three short spoken sentences, using only the facts below.
+If the facts do not cover the question, say you will arrange a callback.
+
+Facts:
+{context}
+
+Conversation so far:
+{history}
+
+Caller: {question}
+Assistant:'''
+
+
+def build_prompt(question, context='', history=()):
+    lines = ['%s: %s' % ('Caller' if speaker == 'caller' else 'Assistant', text) for speaker, text in history]
+    return PROMPT_TEMPLATE.format(context=context or '(none)', history='\n'.join(lines) or '(start of call)', question=question)
+
+
+class LanguageModel:
+    def stream(self, prompt):
+        # Yields text chunks as the model produces them
+        raise NotImplementedError
+
+    def complete(self, prompt):
+        return ''.join(self.stream(prompt))
+
+
+class GeminiLanguageModel(LanguageModel):
+    def __init__(self, api_key, model_name='gemini-1.5-flash'):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            text = getattr(chunk, 'text', '')
+            if text:
+                yield text
+
+
+class StubLanguageModel(LanguageModel):
+    # Offline stand-in: answers from a fixed table (or echoes the question)
+    # with a configurable time to first token and per-chunk delay.
+    def __init__(self, answers=None, first_token_delay=0.0, chunk_delay=0.0, chunk_words=3):
+        self.answers = answers or {}
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def answer_for(self, prompt):
+        question = prompt.rsplit('Caller:', 1)[-1].split('\n', 1)[0].strip().lower()
+        for key, answer in self.answers.items():
+            if key in question:
+                return answer
+        return 'You asked about %s. Let me arrange a callback with the details.' % (question or 'that')
+
+    def stream(self, prompt):
+        with self._lock:
+            self.calls += 1
+        if self.first_token_delay:
+            time.sleep(self.first_token_delay)
+        words = self.answer_for(prompt).split(' ')
+        for start in range(0, len(words), self.chunk_words):
+            if start and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield ' '.join(words[start:start + self.chunk_words]) + (' ' if start + self.chunk_words < len(words) else '')
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_llm():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if os.getenv('LLM_BACKEND', 'gemini') == 'stub':
+                    _model = StubLanguageModel()
+                else:
+                    _model = GeminiLanguageModel(os.getenv('GEMINI_API_KEY'), os.getenv('GEMINI_MODEL', 'gemini-1.5-flash'))
+    return _model
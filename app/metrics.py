@@ -0,0 +1,242 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Prometheus text exposition without a client library. Every metric keeps its
+# series in a dict keyed by the label values tuple; an observation is one dict
+# lookup, one bisect and a few additions under the metric's own lock.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        # Per-bucket (non-cumulative) counts; cumulated only when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, labels=()):
+        with self._lock:
+            series = self._series.get(labels)
+            return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series[0]), series[1], series[2]) for labels, series in self._series.items()]
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', _format_labels(self.labelnames, labels, ('le', _format_value(float(bound)))), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, labels), total
+            yield self.name + '_count', _format_labels(self.labelnames, labels), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ('blueprint', 'route', 'method', 'status'))
+MODEL_CALL_SECONDS = registry.histogram(
+    'model_call_duration_seconds', 'Time spent in app.models methods, connection checkout included.',
+    ('method', 'status'))
+MODEL_ROWS = registry.histogram(
+    'model_rows_returned', 'Rows returned by app.models methods that return rows.',
+    ('method',), buckets=ROW_BUCKETS)
+DB_CONNECT_SECONDS = registry.histogram(
+    'db_connect_seconds', 'Time to open a new MySQL connection.')
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    'db_pool_wait_seconds', 'Time callers waited for a pooled connection when the pool was exhausted.')
+DB_POOL_TIMEOUTS = registry.counter(
+    'db_pool_timeouts_total', 'Connection checkouts that gave up waiting.')
+
+
+def enabled():
+    return os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, dict):
+        return 1
+    return None
+
+
+def timed_method(name, fn):
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            # Streaming readers are timed until exhausted or closed
+            started = time.perf_counter()
+            status = 'ok'
+            rows = 0
+            try:
+                for row in fn(*args, **kwargs):
+                    rows += 1
+                    yield row
+            except BaseException as e:
+                if not isinstance(e, GeneratorExit):
+                    status = 'error'
+                raise
+            finally:
+                MODEL_CALL_SECONDS.observe(time.perf_counter() - started, (name, status))
+                MODEL_ROWS.observe(rows, (name,))
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            MODEL_CALL_SECONDS.observe(time.perf_counter() - started, (name, 'error'))
+            raise
+        MODEL_CALL_SECONDS.observe(time.perf_counter() - started, (name, 'ok'))
+        rows = _row_count(result)
+        if rows is not None:
+            MODEL_ROWS.observe(rows, (name,))
+        return result
+    return wrapper
+
+
+def instrument_models(module):
+    # Wraps every public staticmethod of every class defined in the module
+    wrapped = 0
+    for cls in list(vars(module).values()):
+        if not inspect.isclass(cls) or cls.__module__ != module.__name__:
+            continue
+        for attribute, value in list(vars(cls).items()):
+            if attribute.startswith('_') or not isinstance(value, staticmethod):
+                continue
+            fn = value.__func__
+            if getattr(fn, '__wrapped__', None) is not None:
+                continue
+            setattr(cls, attribute, staticmethod(timed_method('%s.%s' % (cls.__name__, attribute), fn)))
+            wrapped += 1
+    return wrapped
+
+
+def instrument_blueprint(bp):
+    from flask import g, request
+
+    def start_timer():
+        g._metrics_started = time.perf_counter()
+
+    def record(status):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, (bp.name, rule, request.method, str(status)))
+
+    def after(response):
+        record(response.status_code)
+        return response
+
+    def teardown(error):
+        # Only reached with the timer still set when the view raised
+        if error is not None:
+            record(500)
+
+    bp.before_request(start_timer)
+    bp.after_request(after)
+    bp.teardown_request(teardown)
+    return bp
@@ -0,0 +1,56 @@
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admins (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            admin_name VARCHAR(255) NOT NULL,
+            admin_email VARCHAR(255) NOT NULL UNIQUE,
+            admin_password VARCHAR(255) NOT NULL,
+            whatsapp_number VARCHAR(20),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_name VARCHAR(255) NOT NULL UNIQUE,
+            email VARCHAR(255) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            registered_on DATETIME DEFAULT CURRENT_TIMESTAMP,
+            company_name VARCHAR(255),
+            whatsapp_number VARCHAR(20),
+            calls_made INT DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_call_data (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            twilio_phone_number VARCHAR(20),
+            dataset TEXT,
+            greeting_message TEXT DEFAULT 'Hello! This is an AI Assistant. How may I help you?',
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calls (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            receiver_name VARCHAR(255),
+            receiver_phone VARCHAR(20) NOT NULL,
+            call_type ENUM('1way', '2way') NOT NULL,
+            conversation_history TEXT,
+            ai_transmission_message TEXT,
+            callback_status ENUM('yes', 'no', 'callback_done', 'callback_needed') DEFAULT 'no',
+            call_done BOOLEAN DEFAULT FALSE,
+            call_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS credits (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            credits INT DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
@@ -0,0 +1,43 @@
+from app.migrations import index_exists
+
+
+def upgrade(cursor):
+    # Calls.get_calls / filter_calls: equality on user_id (+ callback_status),
+    # newest first. InnoDB appends the primary key, so (call_timestamp, id)
+    # ordering is served straight from these indexes.
+    if not index_exists(cursor, 'calls', 'idx_calls_user_status_ts'):
+        cursor.execute('''
+            ALTER TABLE calls
+            ADD INDEX idx_calls_user_status_ts (user_id, callback_status, call_timestamp)
+        ''')
+    if not index_exists(cursor, 'calls', 'idx_calls_user_ts'):
+        cursor.execute('ALTER TABLE calls ADD INDEX idx_calls_user_ts (user_id, call_timestamp)')
+    # The implicit foreign-key index on calls.user_id is now a redundant prefix
+    if index_exists(cursor, 'calls', 'user_id'):
+        cursor.execute('ALTER TABLE calls DROP INDEX user_id')
+
+    # Credits.add_credits relies on ON DUPLICATE KEY UPDATE; fold any duplicate
+    # rows into the oldest one before adding the key.
+    cursor.execute('''
+        UPDATE credits c
+        JOIN (
+            SELECT user_id, MIN(id) AS keep_id, SUM(credits) AS total
+            FROM credits
+            GROUP BY user_id
+            HAVING COUNT(*) > 1
+        ) d ON c.id = d.keep_id
+        SET c.credits = d.total
+    ''')
+    cursor.execute('''
+        DELETE c FROM credits c
+        JOIN credits keep ON keep.user_id = c.user_id AND keep.id < c.id
+    ''')
+    if not index_exists(cursor, 'credits', 'uq_credits_user'):
+        cursor.execute('ALTER TABLE credits ADD UNIQUE KEY uq_credits_user (user_id)')
+
+    cursor.execute('''
+        DELETE u FROM user_call_data u
+        JOIN user_call_data keep ON keep.user_id = u.user_id AND keep.id < u.id
+    ''')
+    if not index_exists(cursor, 'user_call_data', 'uq_user_call_data_user'):
+        cursor.execute('ALTER TABLE user_call_data ADD UNIQUE KEY uq_user_call_data_user (user_id)')
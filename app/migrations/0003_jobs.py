@@ -0,0 +1,21 @@
+def upgrade(cursor):
+    # Background jobs outlive the tenant they act on (e.g. deletion), so there
+    # is deliberately no foreign key to users.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            job_type VARCHAR(32) NOT NULL,
+            status ENUM('queued', 'running', 'done', 'failed') DEFAULT 'queued',
+            processed_rows INT DEFAULT 0,
+            succeeded_rows INT DEFAULT 0,
+            failed_rows INT DEFAULT 0,
+            errors TEXT,
+            state TEXT,
+            message VARCHAR(255),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_jobs_user (user_id, created_at),
+            INDEX idx_jobs_type_status (job_type, status, updated_at)
+        )
+    ''')
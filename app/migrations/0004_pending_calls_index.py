@@ -0,0 +1,7 @@
+from app.migrations import index_exists
+
+
+def upgrade(cursor):
+    # Dispatcher scans undone calls in id order
+    if not index_exists(cursor, 'calls', 'idx_calls_pending'):
+        cursor.execute('ALTER TABLE calls ADD INDEX idx_calls_pending (call_done, id)')
@@ -0,0 +1,21 @@
+from app.migrations import column_exists, index_exists
+
+
+def upgrade(cursor):
+    # Dispatcher leases: a worker owns a call row until lease_expires_at, after
+    # which any worker may reclaim it.
+    if not column_exists(cursor, 'calls', 'dispatch_status'):
+        cursor.execute('''
+            ALTER TABLE calls
+            ADD COLUMN dispatch_status ENUM('pending', 'leased', 'dispatched') NOT NULL DEFAULT 'pending',
+            ADD COLUMN lease_owner VARCHAR(64) NULL,
+            ADD COLUMN lease_expires_at DATETIME NULL,
+            ADD COLUMN dispatch_attempts INT NOT NULL DEFAULT 0
+        ''')
+        cursor.execute("UPDATE calls SET dispatch_status = 'dispatched' WHERE call_done = 1")
+    if not index_exists(cursor, 'calls', 'idx_calls_dispatch'):
+        cursor.execute('ALTER TABLE calls ADD INDEX idx_calls_dispatch (dispatch_status, id)')
+    if not index_exists(cursor, 'calls', 'idx_calls_lease_expiry'):
+        cursor.execute('ALTER TABLE calls ADD INDEX idx_calls_lease_expiry (dispatch_status, lease_expires_at)')
+    if index_exists(cursor, 'calls', 'idx_calls_pending'):
+        cursor.execute('ALTER TABLE calls DROP INDEX idx_calls_pending')
@@ -0,0 +1,21 @@
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_stats_daily (
+            user_id INT NOT NULL,
+            stat_date DATE NOT NULL,
+            call_type ENUM('1way', '2way') NOT NULL,
+            callback_status ENUM('yes', 'no', 'callback_done', 'callback_needed') NOT NULL,
+            call_done BOOLEAN NOT NULL,
+            call_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, stat_date, call_type, callback_status, call_done),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('DELETE FROM call_stats_daily')
+    cursor.execute('''
+        INSERT INTO call_stats_daily (user_id, stat_date, call_type, callback_status, call_done, call_count)
+        SELECT user_id, DATE(call_timestamp), call_type, callback_status, call_done, COUNT(*)
+        FROM calls
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id, DATE(call_timestamp), call_type, callback_status, call_done
+    ''')
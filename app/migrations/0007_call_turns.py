@@ -0,0 +1,22 @@
+def upgrade(cursor):
+    # Live turns are appended here one row each; once a call finishes they are
+    # folded into a single compressed call_transcripts row.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_turns (
+            call_id INT NOT NULL,
+            seq INT NOT NULL,
+            speaker ENUM('caller', 'assistant', 'system') NOT NULL,
+            text TEXT NOT NULL,
+            started_at DATETIME(3),
+            ended_at DATETIME(3),
+            PRIMARY KEY (call_id, seq)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_transcripts (
+            call_id INT PRIMARY KEY,
+            turn_count INT NOT NULL,
+            transcript MEDIUMBLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
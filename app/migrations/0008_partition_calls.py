@@ -0,0 +1,34 @@
+from datetime import date
+
+from app.partitions import FUTURE_PARTITION, add_months, month_start, partition_clause
+
+
+def upgrade(cursor):
+    # MySQL cannot partition a table that has foreign keys, and every unique
+    # key must contain the partitioning column. Tenant deletion already removes
+    # calls explicitly, so the cascade is not relied upon.
+    cursor.execute('''
+        SELECT constraint_name FROM information_schema.referential_constraints
+        WHERE constraint_schema = DATABASE() AND table_name = 'calls'
+    ''')
+    for (constraint_name,) in cursor.fetchall():
+        cursor.execute('ALTER TABLE calls DROP FOREIGN KEY `%s`' % constraint_name)
+
+    cursor.execute('UPDATE calls SET call_timestamp = CURRENT_TIMESTAMP WHERE call_timestamp IS NULL')
+    cursor.execute('''
+        ALTER TABLE calls
+        MODIFY call_timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (id, call_timestamp)
+    ''')
+
+    cursor.execute('SELECT MIN(call_timestamp) FROM calls')
+    oldest = cursor.fetchone()[0]
+    current = month_start(date.today())
+    month = month_start(oldest.date()) if oldest else current
+    clauses = []
+    while month <= add_months(current, 3):
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append('PARTITION %s VALUES LESS THAN MAXVALUE' % FUTURE_PARTITION)
+    cursor.execute('ALTER TABLE calls PARTITION BY RANGE (TO_DAYS(call_timestamp)) (%s)' % ', '.join(clauses))
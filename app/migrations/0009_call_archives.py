@@ -0,0 +1,16 @@
+def upgrade(cursor):
+    # One row per compressed NDJSON archive file of finished calls
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS call_archives (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            path VARCHAR(512) NOT NULL,
+            min_ts DATETIME NOT NULL,
+            max_ts DATETIME NOT NULL,
+            min_id INT NOT NULL,
+            max_id INT NOT NULL,
+            row_count INT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_call_archives_user_ts (user_id, max_ts)
+        )
+    ''')
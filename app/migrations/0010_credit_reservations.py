@@ -0,0 +1,19 @@
+def upgrade(cursor):
+    # Credits held for a dispatch batch: `reserved` was taken from credits up
+    # front, `settled` is what finished calls actually used, and closing the
+    # reservation refunds the difference.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS credit_reservations (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            owner VARCHAR(64),
+            reserved INT NOT NULL,
+            settled INT NOT NULL DEFAULT 0,
+            status ENUM('open', 'closed') NOT NULL DEFAULT 'open',
+            expires_at DATETIME NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            closed_at DATETIME,
+            INDEX idx_credit_reservations_user (user_id, status),
+            INDEX idx_credit_reservations_expiry (status, expires_at)
+        )
+    ''')
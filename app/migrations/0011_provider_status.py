@@ -0,0 +1,13 @@
+from app.migrations import column_exists
+
+
+def upgrade(cursor):
+    # Latest provider-reported call state. status_seq is the provider's
+    # per-call callback sequence number; late or replayed callbacks with a
+    # lower number are ignored.
+    if not column_exists(cursor, 'calls', 'provider_status'):
+        cursor.execute('''
+            ALTER TABLE calls
+            ADD COLUMN provider_status VARCHAR(20) NULL,
+            ADD COLUMN status_seq INT NOT NULL DEFAULT -1
+        ''')
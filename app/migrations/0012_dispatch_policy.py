@@ -0,0 +1,19 @@
+from app.migrations import column_exists, index_exists
+
+
+def upgrade(cursor):
+    # Per-tenant dispatch policy for the fair scheduler: share weight,
+    # concurrency cap and the local calling-hour window. NULL window or cap
+    # means unrestricted.
+    if not column_exists(cursor, 'user_call_data', 'call_weight'):
+        cursor.execute('''
+            ALTER TABLE user_call_data
+            ADD COLUMN call_weight INT NOT NULL DEFAULT 1,
+            ADD COLUMN max_concurrent_calls INT NULL,
+            ADD COLUMN call_window_start TIME NULL,
+            ADD COLUMN call_window_end TIME NULL,
+            ADD COLUMN timezone VARCHAR(64) NOT NULL DEFAULT 'UTC'
+        ''')
+    # The scheduler claims pending rows one tenant at a time
+    if not index_exists(cursor, 'calls', 'idx_calls_tenant_dispatch'):
+        cursor.execute('ALTER TABLE calls ADD INDEX idx_calls_tenant_dispatch (dispatch_status, user_id, id)')
@@ -0,0 +1,19 @@
+def upgrade(cursor):
+    # Per caller ID limits shared by every dispatcher process: a token bucket
+    # row per number, and one slot row per call being dialed. Slots expire so
+    # a dispatcher that dies cannot hold a number's concurrency forever.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dispatch_numbers (
+            twilio_phone_number VARCHAR(20) PRIMARY KEY,
+            tokens DOUBLE NOT NULL,
+            refilled_at DATETIME(6) NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dispatch_number_slots (
+            call_id INT PRIMARY KEY,
+            twilio_phone_number VARCHAR(20) NOT NULL,
+            expires_at DATETIME(6) NOT NULL,
+            INDEX idx_dispatch_slots_number (twilio_phone_number, expires_at)
+        )
+    ''')
@@ -0,0 +1,91 @@
+import importlib
+import pkgutil
+from app.db import transaction
+
+LOCK_NAME = 'telecalling_schema_migrations'
+
+
+def discover():
+    # Migration modules are named NNNN_description.py and applied in name order
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        version, _, name = module_info.name.partition('_')
+        if not version.isdigit():
+            continue
+        module = importlib.import_module(__name__ + '.' + module_info.name)
+        migrations.append((version, name, module))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+
+def index_exists(cursor, table, index):
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    ''', (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def column_exists(cursor, table, column):
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    ''', (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def _ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(16) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def applied_versions(conn=None):
+    with transaction(conn) as conn:
+        cursor = conn.cursor()
+        _ensure_version_table(cursor)
+        cursor.execute('SELECT version FROM schema_migrations')
+        versions = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    return versions
+
+
+def status(conn=None):
+    applied = applied_versions(conn)
+    return [(version, name, version in applied) for version, name, _ in discover()]
+
+
+def migrate(target=None, conn=None):
+    applied_now = []
+    with transaction(conn) as conn:
+        cursor = conn.cursor()
+        # Serialise concurrent deploys; MySQL DDL commits implicitly so each
+        # migration is recorded right after it runs.
+        cursor.execute('SELECT GET_LOCK(%s, 60)', (LOCK_NAME,))
+        if cursor.fetchone()[0] != 1:
+            cursor.close()
+            raise RuntimeError('Could not acquire the schema migration lock')
+        try:
+            _ensure_version_table(cursor)
+            cursor.execute('SELECT version FROM schema_migrations')
+            applied = {row[0] for row in cursor.fetchall()}
+            for version, name, module in discover():
+                if target is not None and version > target:
+                    break
+                if version in applied:
+                    continue
+                module.upgrade(cursor)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                    (version, name)
+                )
+                conn.commit()
+                applied_now.append(version + '_' + name)
+        finally:
+            cursor.execute('SELECT RELEASE_LOCK(%s)', (LOCK_NAME,))
+            cursor.fetchall()
+            cursor.close()
+    return applied_now
@@ -1,18 +1,11 @@
-import mysql.connector
+import json
+import zlib
 from datetime import datetime
-import os
-from dotenv import load_dotenv
-
-# MySQL connection configuration
-db_config = {
-    'host': os.getenv('HOST'),
-    'user': os.getenv('USER'),
-    'password': os.getenv('PASSWORD'),
-    'database': os.getenv('DATABASE')
-}
-
-def get_db_connection():
-    return mysql.connector.connect(**db_config)
+from app import answers, retrieval
+from app.cache import get_cache
+from app.db import get_db_connection, transaction
+from app.events import bus
+from app.tts import get_tts
 
 class Admin:
     def __init__(self, admin_name, admin_email, admin_password, whatsapp_number=None,id=None, created_at=None):
@@ -24,82 +17,58 @@ class Admin:
         self.created_at = created_at or datetime.now()
         
     @staticmethod
-    def create_table():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                admin_name VARCHAR(255) NOT NULL,
-                admin_email VARCHAR(255) NOT NULL UNIQUE,
-                admin_password VARCHAR(255) NOT NULL,
-                whatsapp_number VARCHAR(20),
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def add_admin(admin_name, admin_email, admin_password, whatsapp_number=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO admins (admin_name, admin_email, admin_password, whatsapp_number)
+                VALUES (%s, %s, %s, %s)
+            ''', (admin_name, admin_email, admin_password, whatsapp_number))
+            admin_id = cursor.lastrowid
+            cursor.close()
+        return admin_id
         
     @staticmethod
-    def add_admin(admin_name, admin_email, admin_password, whatsapp_number=None):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO admins (admin_name, admin_email, admin_password, whatsapp_number)
-            VALUES (%s, %s, %s, %s)
-        ''', (admin_name, admin_email, admin_password, whatsapp_number))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-    @staticmethod
-    def get_admins():
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT admin_name, admin_email, whatsapp_number, created_at FROM admins')
-        admins = cursor.fetchall()
-        cursor.close()
-        conn.close()
+    def get_admins(conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT admin_name, admin_email, whatsapp_number, created_at FROM admins')
+            admins = cursor.fetchall()
+            cursor.close()
         return admins
     
     @staticmethod
-    def get_by_id(admin_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM admins WHERE id = %s', (admin_id,))
-        admin = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def get_by_id(admin_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM admins WHERE id = %s', (admin_id,))
+            admin = cursor.fetchone()
+            cursor.close()
         return admin
     
     @staticmethod
-    def delete_admin(admin_id):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM admins WHERE id = %s', (admin_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def delete_admin(admin_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM admins WHERE id = %s', (admin_id,))
+            cursor.close()
         
     @staticmethod
-    def view_info(admin_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM admins WHERE id = %s', (admin_id,))
-        admin_info = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def view_info(admin_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM admins WHERE id = %s', (admin_id,))
+            admin_info = cursor.fetchone()
+            cursor.close()
         return admin_info
     
     @staticmethod
-    def get_by_username(username):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM admins WHERE admin_email = %s', (username,))
-        admin = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def get_by_username(username, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM admins WHERE admin_email = %s', (username,))
+            admin = cursor.fetchone()
+            cursor.close()
         return admin
     
     
@@ -115,117 +84,95 @@ class Users:
         self.calls_made = calls_made
         
     @staticmethod
-    def create_table():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_name VARCHAR(255) NOT NULL UNIQUE,
-                email VARCHAR(255) NOT NULL UNIQUE,
-                password VARCHAR(255) NOT NULL,
-                registered_on DATETIME DEFAULT CURRENT_TIMESTAMP,
-                company_name VARCHAR(255),
-                whatsapp_number VARCHAR(20),
-                calls_made INT DEFAULT 0
-            )
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
+    def add_user(user_name, email, password, company_name=None, whatsapp_number=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO users (user_name, email, password, company_name, whatsapp_number)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', (user_name, email, password, company_name, whatsapp_number))
+            user_id = cursor.lastrowid
+            cursor.close()
+        return user_id
+
     @staticmethod
-    def add_user(user_name, email, password, company_name=None, whatsapp_number=None):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO users (user_name, email, password, company_name, whatsapp_number)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (user_name, email, password, company_name, whatsapp_number))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def get_by_username(username, conn=None):
+        # Tenants sign in with either their user name or their email
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT id, user_name, email, password FROM users WHERE user_name = %s OR email = %s', (username, username))
+            user = cursor.fetchone()
+            cursor.close()
+        return user
     
     @staticmethod
-    def get_users():
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM users')
-        users = cursor.fetchall()
-        cursor.close()
-        conn.close()
+    def get_users(conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM users')
+            users = cursor.fetchall()
+            cursor.close()
         return users
     
     @staticmethod
-    def get_user_by_email(email):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM users WHERE email = %s', (email,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def get_user_by_email(email, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM users WHERE email = %s', (email,))
+            user = cursor.fetchone()
+            cursor.close()
         return user
     
     @staticmethod
-    def get_by_id(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('''
-            SELECT 
-                users.id,
-                users.user_name,
-                users.email,
-                users.registered_on,
-                users.company_name,
-                users.whatsapp_number,
-                users.calls_made,
-                credits.credits
-            FROM users
-            JOIN credits ON users.id = credits.user_id
-            WHERE users.id = %s
-        ''', (user_id,))
-
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def get_by_id(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT
+                    users.id,
+                    users.user_name,
+                    users.email,
+                    users.registered_on,
+                    users.company_name,
+                    users.whatsapp_number,
+                    users.calls_made,
+                    credits.credits
+                FROM users
+                JOIN credits ON users.id = credits.user_id
+                WHERE users.id = %s
+            ''', (user_id,))
+
+            user = cursor.fetchone()
+            cursor.close()
         return user
     
     @staticmethod
-    def delete_user(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE users, user_call_data, calls
-            FROM users
-            LEFT JOIN user_call_data ON users.id = user_call_data.user_id
-            LEFT JOIN calls ON users.id = calls.user_id
-            WHERE users.id = %s
-        ''', (user_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def delete_user(user_id, conn=None):
+        # Last step of app.tenant_deletion, once the tenant's large tables have
+        # been emptied in batches; the remaining cascades only touch a few rows.
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+            cursor.close()
         
     @staticmethod
-    def update_user_info(user_id, user_name, email, company_name=None, whatsapp_number=None):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users
-            SET user_name = %s, email = %s, company_name = %s, whatsapp_number = %s
-            WHERE id = %s
-        ''', (user_name, email, company_name, whatsapp_number, user_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def update_user_info(user_id, user_name, email, company_name=None, whatsapp_number=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE users
+                SET user_name = %s, email = %s, company_name = %s, whatsapp_number = %s
+                WHERE id = %s
+            ''', (user_name, email, company_name, whatsapp_number, user_id))
+            cursor.close()
         
     @staticmethod
-    def get_user_info(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-        user_info = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def get_user_info(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
+            user_info = cursor.fetchone()
+            cursor.close()
         return user_info
     
 class UserCallData:
@@ -237,91 +184,137 @@ class UserCallData:
         self.greeting_message = greeting_message
         
     @staticmethod
-    def create_table():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_call_data (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT,
-                twilio_phone_number VARCHAR(20),
-                dataset TEXT,
-                greeting_message TEXT DEFAULT 'Hello! This is an AI Assistant. How may I help you?',
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
+    def add_user_call_data(user_id, twilio_phone_number, dataset, greeting_message='Hello! This is an AI Assistant. How may I help you?', conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO user_call_data (user_id, twilio_phone_number, dataset, greeting_message)
+                VALUES (%s, %s, %s, %s)
+            ''', (user_id, twilio_phone_number, dataset, greeting_message))
+            call_data_id = cursor.lastrowid
+            cursor.close()
+            conn.after_commit(lambda: UserCallData.invalidate_call_config(user_id))
+            conn.after_commit(lambda: get_tts().presynthesize_async([greeting_message]))
+        return call_data_id
+
     @staticmethod
-    def add_user_call_data(user_id, twilio_phone_number, dataset, greeting_message='Hello! This is an AI Assistant. How may I help you?'):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO user_call_data (user_id, twilio_phone_number, dataset, greeting_message)
-            VALUES (%s, %s, %s, %s)
-        ''', (user_id, twilio_phone_number, dataset, greeting_message))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    @staticmethod
-    def get_user_call_data(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM user_call_data WHERE user_id = %s', (user_id,))
-        call_data = cursor.fetchall()
-        cursor.close()
-        conn.close()
+    def delete_user_call_data(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM user_call_data WHERE user_id = %s', (user_id,))
+            deleted = cursor.rowcount
+            cursor.close()
+            conn.after_commit(lambda: UserCallData.invalidate_call_config(user_id))
+            conn.after_commit(lambda: retrieval.registry.forget(int(user_id)))
+        return deleted
+
+    @staticmethod
+    def get_user_call_data(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM user_call_data WHERE user_id = %s', (user_id,))
+            call_data = cursor.fetchall()
+            cursor.close()
         return call_data
+
+    @staticmethod
+    def get_call_config(user_id, conn=None):
+        # Everything a live call needs from the tenant, served from the
+        # read-through cache; invalidated after commit by the update methods.
+        # The dataset itself can be large, so only its hash is cached; the
+        # retrieval index reloads the text when the hash changes.
+        def load():
+            with transaction(conn) as db:
+                cursor = db.cursor(dictionary=True)
+                cursor.execute('''
+                    SELECT twilio_phone_number, greeting_message, SHA1(COALESCE(dataset, '')) AS dataset_version
+                    FROM user_call_data
+                    WHERE user_id = %s
+                ''', (user_id,))
+                config = cursor.fetchone()
+                cursor.close()
+            return config
+
+        return get_cache('call_config').get(int(user_id), load)
+
+    @staticmethod
+    def invalidate_call_config(user_id):
+        get_cache('call_config').invalidate(int(user_id))
     
     @staticmethod
-    def update_dataset(user_id, dataset):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE user_call_data
-            SET dataset = %s
-            WHERE user_id = %s
-        ''', (dataset, user_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def update_dataset(user_id, dataset, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_call_data
+                SET dataset = %s
+                WHERE user_id = %s
+            ''', (dataset, user_id))
+            cursor.close()
+            conn.after_commit(lambda: UserCallData.invalidate_call_config(user_id))
+            conn.after_commit(lambda: retrieval.refresh_async(user_id, dataset))
+            conn.after_commit(lambda: answers.invalidate(user_id))
         
     @staticmethod
-    def get_user_dataset(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT dataset FROM user_call_data WHERE user_id = %s', (user_id,))
-        dataset = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return dataset['dataset'] if dataset else None
+    def get_user_dataset(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT dataset FROM user_call_data WHERE user_id = %s', (user_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        return row[0] if row else None
+
+    @staticmethod
+    def update_calling_hours(user_id, window_start, window_end, timezone, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_call_data
+                SET call_window_start = %s, call_window_end = %s, timezone = %s
+                WHERE user_id = %s
+            ''', (window_start, window_end, timezone, user_id))
+            cursor.close()
+
+    @staticmethod
+    def update_dispatch_limits(user_id, call_weight, max_concurrent_calls, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_call_data
+                SET call_weight = %s, max_concurrent_calls = %s
+                WHERE user_id = %s
+            ''', (call_weight, max_concurrent_calls, user_id))
+            cursor.close()
     
     @staticmethod
-    def update_greeting_message(user_id, greeting_message):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE user_call_data
-            SET greeting_message = %s
-            WHERE user_id = %s
-        ''', (greeting_message, user_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def update_greeting_message(user_id, greeting_message, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_call_data
+                SET greeting_message = %s
+                WHERE user_id = %s
+            ''', (greeting_message, user_id))
+            cursor.close()
+            conn.after_commit(lambda: UserCallData.invalidate_call_config(user_id))
+            conn.after_commit(lambda: get_tts().presynthesize_async([greeting_message]))
         
     @staticmethod
-    def get_user_greeting_message(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT greeting_message FROM user_call_data WHERE user_id = %s', (user_id,))
-        greeting_message = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return greeting_message['greeting_message'] if greeting_message else None
+    def get_user_greeting_message(user_id, conn=None):
+        config = UserCallData.get_call_config(user_id, conn=conn)
+        return config['greeting_message'] if config else None
     
 class Calls:
+    CALLBACK_STATUSES = ('yes', 'no', 'callback_done', 'callback_needed')
+    # Columns returned by listings; the large TEXT columns are opt-in
+    LIST_COLUMNS = ('id', 'user_id', 'receiver_name', 'receiver_phone', 'call_type', 'callback_status', 'call_done', 'call_timestamp')
+    TEXT_COLUMNS = ('conversation_history', 'ai_transmission_message')
+    # Provider call states; terminal ones finish the call and the failures
+    # among them flag it for a callback.
+    PROVIDER_STATUSES = ('queued', 'initiated', 'ringing', 'in-progress', 'completed', 'busy', 'failed', 'no-answer', 'canceled')
+    PROVIDER_FAILURES = ('busy', 'failed', 'no-answer')
+    PROVIDER_TERMINAL = ('completed', 'canceled') + PROVIDER_FAILURES
+
     def __init__(self, user_id, receiver_phone, call_type, conversation_history=None, ai_transmission_message=None, callback_status='no', call_done=False, call_timestamp=None, id=None, receiver_name=None):
         self.id = id
         self.user_id = user_id
@@ -335,91 +328,857 @@ class Calls:
         self.call_timestamp = call_timestamp or datetime.now()
         
     @staticmethod
-    def create_table():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS calls (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT,
-                receiver_name VARCHAR(255),
-                receiver_phone VARCHAR(20) NOT NULL,
-                call_type ENUM('1way', '2way') NOT NULL,
-                conversation_history TEXT,
-                ai_transmission_message TEXT,
-                callback_status ENUM('yes', 'no', 'callback_done', 'callback_needed') DEFAULT 'no',
-                call_done BOOLEAN DEFAULT FALSE,
-                call_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def add_call(user_id, receiver_phone, call_type, conversation_history=None, ai_transmission_message=None, callback_status='no', call_done=False, receiver_name=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO calls (user_id, receiver_phone, call_type, conversation_history, ai_transmission_message, callback_status, call_done, receiver_name)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (user_id, receiver_phone, call_type, conversation_history, ai_transmission_message, callback_status, call_done, receiver_name))
+            call_id = cursor.lastrowid
+            cursor.close()
+            CallStats.apply_deltas({(user_id, None, call_type, callback_status, int(bool(call_done))): 1}, conn=conn)
+            conn.after_commit(lambda: bus.publish(user_id, {
+                'type': 'calls_added',
+                'call_ids': [call_id],
+                'counts': {callback_status: 1},
+                'done': 1 if call_done else 0,
+            }))
+        return call_id
         
     @staticmethod
-    def add_call(user_id, receiver_phone, call_type, conversation_history=None, ai_transmission_message=None, callback_status='no', call_done=False, receiver_name=None):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO calls (user_id, receiver_phone, call_type, conversation_history, ai_transmission_message, callback_status, call_done, receiver_name)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (user_id, receiver_phone, call_type, conversation_history, ai_transmission_message, callback_status, call_done, receiver_name))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
+    def get_calls(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM calls WHERE user_id = %s ORDER BY call_timestamp DESC, id DESC', (user_id,))
+            calls = cursor.fetchall()
+            cursor.close()
+        return calls
+
+    @staticmethod
+    def get_call(call_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                'SELECT id, user_id, receiver_name, call_type, call_done FROM calls WHERE id = %s',
+                (call_id,)
+            )
+            call = cursor.fetchone()
+            cursor.close()
+        return call
+
     @staticmethod
-    def get_calls(user_id):
+    def get_calls_page(user_id, filter_type='all', after=None, limit=50, include_text=False, include_archived=False, conn=None):
+        # Keyset pagination on (call_timestamp, id) descending; `after` is the
+        # (call_timestamp, id) of the last row of the previous page. With
+        # include_archived the archive files are merged in under the same cursor.
+        columns = Calls.LIST_COLUMNS + (Calls.TEXT_COLUMNS if include_text else ())
+        query = 'SELECT ' + ', '.join(columns) + ' FROM calls WHERE user_id = %s'
+        params = [user_id]
+        if filter_type != 'all':
+            query += ' AND callback_status = %s'
+            params.append(filter_type)
+        if after is not None:
+            query += ' AND (call_timestamp < %s OR (call_timestamp = %s AND id < %s))'
+            params.extend((after[0], after[0], after[1]))
+        query += ' ORDER BY call_timestamp DESC, id DESC LIMIT %s'
+        params.append(limit + 1)
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, params)
+            calls = cursor.fetchall()
+            cursor.close()
+        if include_archived:
+            from app import archive
+            calls = archive.merge_pages(calls, archive.archived_page(user_id, filter_type, after, limit + 1, include_text), limit)
+        has_more = len(calls) > limit
+        calls = calls[:limit]
+        next_after = (calls[-1]['call_timestamp'], calls[-1]['id']) if has_more else None
+        return calls, next_after
+
+    @staticmethod
+    def iter_calls(user_id, filter_type='all', include_text=True, batch_size=1000):
+        # Streams rows from an unbuffered cursor so memory stays bounded no
+        # matter how many calls the tenant has. Holds its connection until the
+        # generator is exhausted or closed.
+        columns = Calls.LIST_COLUMNS + (Calls.TEXT_COLUMNS if include_text else ())
+        query = 'SELECT ' + ', '.join(columns) + ' FROM calls WHERE user_id = %s'
+        params = [user_id]
+        if filter_type != 'all':
+            query += ' AND callback_status = %s'
+            params.append(filter_type)
+        query += ' ORDER BY call_timestamp DESC, id DESC'
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM calls WHERE user_id = %s', (user_id,))
-        calls = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        exhausted = False
+        try:
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            exhausted = True
+            cursor.close()
+        finally:
+            if exhausted:
+                conn.close()
+            else:
+                conn.discard()
+
+    @staticmethod
+    def delete_batch(user_id, limit=1000, conn=None):
+        # Deletes up to `limit` of the tenant's calls with their transcripts;
+        # returns how many calls went so the caller can loop until 0.
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM calls WHERE user_id = %s ORDER BY id LIMIT %s FOR UPDATE', (user_id, limit))
+            call_ids = [row[0] for row in cursor.fetchall()]
+            if call_ids:
+                placeholders = ', '.join(['%s'] * len(call_ids))
+                cursor.execute('DELETE FROM call_turns WHERE call_id IN (%s)' % placeholders, call_ids)
+                cursor.execute('DELETE FROM call_transcripts WHERE call_id IN (%s)' % placeholders, call_ids)
+                cursor.execute('DELETE FROM calls WHERE user_id = %%s AND id IN (%s)' % placeholders, [user_id] + call_ids)
+            cursor.close()
+        return len(call_ids)
+
+    @staticmethod
+    def claim_calls(owner, limit=100, lease_seconds=300, conn=None):
+        # Batch-claims undone calls for one dispatcher. SKIP LOCKED lets
+        # concurrent workers claim disjoint rows without waiting on each other;
+        # leases that expired (crashed or deferring worker) are picked up too.
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT id FROM calls
+                WHERE dispatch_status = 'pending' AND call_done = 0
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (limit,))
+            call_ids = [row['id'] for row in cursor.fetchall()]
+            if len(call_ids) < limit:
+                cursor.execute('''
+                    SELECT id FROM calls
+                    WHERE dispatch_status = 'leased' AND lease_expires_at < NOW() AND call_done = 0
+                    ORDER BY lease_expires_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ''', (limit - len(call_ids),))
+                call_ids.extend(row['id'] for row in cursor.fetchall())
+            calls = Calls._lease_calls(cursor, owner, call_ids, lease_seconds)
+            cursor.close()
         return calls
-    
+
     @staticmethod
-    def update_call_status(call_id, callback_status, call_done):
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    def claim_tenant_calls(owner, plan, lease_seconds=300, conn=None):
+        # Claims the scheduler's plan ({user_id: count}): each tenant's oldest
+        # pending rows, then its expired leases, via idx_calls_tenant_dispatch.
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            call_ids = []
+            for user_id, count in plan.items():
+                cursor.execute('''
+                    SELECT id FROM calls
+                    WHERE dispatch_status = 'pending' AND user_id = %s AND call_done = 0
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ''', (user_id, count))
+                tenant_ids = [row['id'] for row in cursor.fetchall()]
+                if len(tenant_ids) < count:
+                    cursor.execute('''
+                        SELECT id FROM calls
+                        WHERE dispatch_status = 'leased' AND user_id = %s
+                        AND lease_expires_at < NOW() AND call_done = 0
+                        ORDER BY lease_expires_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    ''', (user_id, count - len(tenant_ids)))
+                    tenant_ids.extend(row['id'] for row in cursor.fetchall())
+                call_ids.extend(tenant_ids)
+            calls = Calls._lease_calls(cursor, owner, call_ids, lease_seconds)
+            cursor.close()
+        return calls
+
+    @staticmethod
+    def _lease_calls(cursor, owner, call_ids, lease_seconds):
+        if not call_ids:
+            return []
+        placeholders = ', '.join(['%s'] * len(call_ids))
         cursor.execute('''
             UPDATE calls
-            SET callback_status = %s, call_done = %s
-            WHERE id = %s
-        ''', (callback_status, call_done, call_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+            SET dispatch_status = 'leased', lease_owner = %s,
+                lease_expires_at = NOW() + INTERVAL %s SECOND,
+                dispatch_attempts = dispatch_attempts + 1
+            WHERE id IN (''' + placeholders + ')', [owner, lease_seconds] + call_ids)
+        cursor.execute('''
+            SELECT
+                calls.id,
+                calls.user_id,
+                calls.receiver_name,
+                calls.receiver_phone,
+                calls.call_type,
+                calls.ai_transmission_message,
+                calls.dispatch_attempts,
+                user_call_data.twilio_phone_number
+            FROM calls
+            JOIN user_call_data ON calls.user_id = user_call_data.user_id
+            WHERE calls.id IN (''' + placeholders + ''')
+            ORDER BY calls.id
+        ''', call_ids)
+        return cursor.fetchall()
+
+    @staticmethod
+    def get_dispatch_backlog(conn=None):
+        # One row per tenant with undispatched calls, with everything the fair
+        # scheduler needs: claimable rows, calls held by dispatchers, credit
+        # balance and dispatch policy.
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT
+                    backlog.user_id,
+                    backlog.pending,
+                    backlog.in_flight,
+                    COALESCE(credits.credits, 0) AS credits,
+                    COALESCE(user_call_data.call_weight, 1) AS call_weight,
+                    user_call_data.max_concurrent_calls,
+                    user_call_data.call_window_start,
+                    user_call_data.call_window_end,
+                    COALESCE(user_call_data.timezone, 'UTC') AS timezone
+                FROM (
+                    SELECT
+                        user_id,
+                        CAST(SUM(dispatch_status = 'pending' OR lease_expires_at < NOW()) AS SIGNED) AS pending,
+                        CAST(SUM(dispatch_status = 'leased' AND lease_owner IS NOT NULL
+                                 AND lease_expires_at >= NOW()) AS SIGNED) AS in_flight
+                    FROM calls
+                    WHERE dispatch_status IN ('pending', 'leased') AND call_done = 0
+                    GROUP BY user_id
+                ) AS backlog
+                JOIN user_call_data ON user_call_data.user_id = backlog.user_id
+                LEFT JOIN credits ON credits.user_id = backlog.user_id
+                WHERE backlog.pending > 0
+            ''')
+            rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+    @staticmethod
+    def extend_leases(owner, call_ids, lease_seconds=300, conn=None):
+        if not call_ids:
+            return 0
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE calls
+                SET lease_expires_at = NOW() + INTERVAL %s SECOND
+                WHERE lease_owner = %s AND dispatch_status = 'leased'
+                AND id IN (''' + ', '.join(['%s'] * len(call_ids)) + ')',
+                [lease_seconds, owner] + list(call_ids))
+            extended = cursor.rowcount
+            cursor.close()
+        return extended
+
+    @staticmethod
+    def finish_dispatch(call_id, owner, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE calls
+                SET dispatch_status = 'dispatched', lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = %s AND lease_owner = %s
+            ''', (call_id, owner))
+            finished = cursor.rowcount
+            cursor.close()
+        return finished == 1
+
+    @staticmethod
+    def defer_call(call_id, owner, delay_seconds, conn=None):
+        # Keep the row leased but ownerless until the delay passes, at which
+        # point it is reclaimed like any other expired lease.
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE calls
+                SET lease_owner = NULL, lease_expires_at = NOW() + INTERVAL %s SECOND
+                WHERE id = %s AND lease_owner = %s
+            ''', (delay_seconds, call_id, owner))
+            cursor.close()
+
+    @staticmethod
+    def defer_calls(call_ids, owner, delay_seconds, conn=None):
+        if not call_ids:
+            return
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE calls
+                SET lease_owner = NULL, lease_expires_at = NOW() + INTERVAL %s SECOND
+                WHERE lease_owner = %s AND id IN (''' + ', '.join(['%s'] * len(call_ids)) + ')',
+                [delay_seconds, owner] + list(call_ids))
+            cursor.close()
+
+    @staticmethod
+    def release_leases(owner, call_ids, conn=None):
+        if not call_ids:
+            return
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE calls
+                SET dispatch_status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+                WHERE lease_owner = %s AND id IN (''' + ', '.join(['%s'] * len(call_ids)) + ')',
+                [owner] + list(call_ids))
+            cursor.close()
+    
+    @staticmethod
+    def update_call_status(call_id, callback_status, call_done, keep_provider_outcome=False, conn=None):
+        # keep_provider_outcome: a terminal provider callback that already
+        # committed wins over this write (the dispatcher's own outcome).
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT user_id, call_type, callback_status, call_done, provider_status, DATE(call_timestamp) AS stat_date
+                FROM calls
+                WHERE id = %s
+                FOR UPDATE
+            ''', (call_id,))
+            previous = cursor.fetchone()
+            if keep_provider_outcome and previous and previous['provider_status'] in Calls.PROVIDER_TERMINAL:
+                cursor.close()
+                return False
+            cursor.execute('''
+                UPDATE calls
+                SET callback_status = %s, call_done = %s
+                WHERE id = %s
+            ''', (callback_status, call_done, call_id))
+            cursor.close()
+            if previous:
+                bucket = (previous['user_id'], previous['stat_date'], previous['call_type'])
+                old_key = bucket + (previous['callback_status'], int(previous['call_done']))
+                new_key = bucket + (callback_status, int(bool(call_done)))
+                if old_key != new_key:
+                    CallStats.apply_deltas({old_key: -1, new_key: 1}, conn=conn)
+                conn.after_commit(lambda: bus.publish(previous['user_id'], {
+                    'type': 'call_updated',
+                    'call': {'id': int(call_id), 'callback_status': callback_status, 'call_done': int(bool(call_done))},
+                    'previous': {'callback_status': previous['callback_status'], 'call_done': int(previous['call_done'])},
+                }))
+        return True
+
+    @staticmethod
+    def apply_provider_statuses(events, conn=None):
+        # events: [(call_id, provider_status, seq)] from status callbacks, in
+        # any order and possibly repeated. Only the highest sequence number per
+        # call is applied, and only if it is newer than what the row has, so
+        # replays are harmless. One locking read and one multi-row CASE UPDATE
+        # per batch; the daily rollup and dashboard events follow the same
+        # rules as update_call_status. Returns the number of calls changed.
+        latest = {}
+        for call_id, provider_status, seq in events:
+            current = latest.get(call_id)
+            if current is None or seq > current[1]:
+                latest[call_id] = (provider_status, seq)
+        if not latest:
+            return 0
+        call_ids = sorted(latest)
+        placeholders = ', '.join(['%s'] * len(call_ids))
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT id, user_id, call_type, callback_status, call_done, status_seq, DATE(call_timestamp) AS stat_date
+                FROM calls
+                WHERE id IN (''' + placeholders + ''')
+                FOR UPDATE
+            ''', call_ids)
+            changes = []
+            for row in cursor.fetchall():
+                provider_status, seq = latest[row['id']]
+                if seq <= row['status_seq']:
+                    continue
+                callback_status = row['callback_status']
+                call_done = int(row['call_done'])
+                if provider_status in Calls.PROVIDER_TERMINAL:
+                    call_done = 1
+                if provider_status in Calls.PROVIDER_FAILURES:
+                    callback_status = 'callback_needed'
+                changes.append((row, provider_status, seq, callback_status, call_done))
+            if not changes:
+                cursor.close()
+                return 0
+
+            params = []
+            for column in range(4):
+                for change in changes:
+                    params.extend((change[0]['id'], change[column + 1]))
+            params.extend(change[0]['id'] for change in changes)
+            case = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(changes)) + ' END'
+            cursor.execute(
+                'UPDATE calls SET provider_status = ' + case + ', status_seq = ' + case +
+                ', callback_status = ' + case + ', call_done = ' + case +
+                ' WHERE id IN (' + ', '.join(['%s'] * len(changes)) + ')',
+                params
+            )
+            cursor.close()
+            Calls._record_status_changes(
+                [(row, callback_status, call_done) for row, _, _, callback_status, call_done in changes], conn)
+        return len(changes)
+
+    @staticmethod
+    def _record_status_changes(changes, conn):
+        # changes: [(locked row with its previous values, callback_status,
+        # call_done)] already written; keeps the rollup and dashboards in step.
+        deltas = {}
+        published = {}
+        for row, callback_status, call_done in changes:
+            bucket = (row['user_id'], row['stat_date'], row['call_type'])
+            old_key = bucket + (row['callback_status'], int(row['call_done']))
+            new_key = bucket + (callback_status, int(call_done))
+            if old_key != new_key:
+                deltas[old_key] = deltas.get(old_key, 0) - 1
+                deltas[new_key] = deltas.get(new_key, 0) + 1
+                published.setdefault(row['user_id'], []).append({
+                    'type': 'call_updated',
+                    'call': {'id': row['id'], 'callback_status': callback_status, 'call_done': int(call_done)},
+                    'previous': {'callback_status': row['callback_status'], 'call_done': int(row['call_done'])},
+                })
+        CallStats.apply_deltas({key: delta for key, delta in deltas.items() if delta}, conn=conn)
+
+        def publish():
+            for user_id, events in published.items():
+                for event in events:
+                    bus.publish(user_id, event)
+        if published:
+            conn.after_commit(publish)
+
+    @staticmethod
+    def update_call_statuses(user_id, updates, chunk_size=500, conn=None):
+        # updates: [(call_id, callback_status, call_done)]. Each chunk is one
+        # locking read and one CASE UPDATE, both scoped to user_id so another
+        # tenant's ids are reported as not_found. Returns {call_id: result}
+        # with result one of 'updated', 'unchanged' or 'not_found'.
+        wanted = {}
+        for call_id, callback_status, call_done in updates:
+            wanted[int(call_id)] = (callback_status, int(bool(call_done)))
+        results = {}
+        call_ids = sorted(wanted)
+        for start in range(0, len(call_ids), chunk_size):
+            chunk = call_ids[start:start + chunk_size]
+            with transaction(conn) as chunk_conn:
+                cursor = chunk_conn.cursor(dictionary=True)
+                cursor.execute('''
+                    SELECT id, user_id, call_type, callback_status, call_done, DATE(call_timestamp) AS stat_date
+                    FROM calls
+                    WHERE user_id = %s AND id IN (''' + ', '.join(['%s'] * len(chunk)) + ''')
+                    FOR UPDATE
+                ''', [user_id] + chunk)
+                changes = []
+                for row in cursor.fetchall():
+                    callback_status, call_done = wanted[row['id']]
+                    if (row['callback_status'], int(row['call_done'])) == (callback_status, call_done):
+                        results[row['id']] = 'unchanged'
+                    else:
+                        changes.append((row, callback_status, call_done))
+                        results[row['id']] = 'updated'
+                if changes:
+                    params = []
+                    for change in changes:
+                        params.extend((change[0]['id'], change[1]))
+                    for change in changes:
+                        params.extend((change[0]['id'], change[2]))
+                    params.append(user_id)
+                    params.extend(change[0]['id'] for change in changes)
+                    case = 'CASE id ' + ' '.join(['WHEN %s THEN %s'] * len(changes)) + ' END'
+                    cursor.execute(
+                        'UPDATE calls SET callback_status = ' + case + ', call_done = ' + case +
+                        ' WHERE user_id = %s AND id IN (' + ', '.join(['%s'] * len(changes)) + ')',
+                        params
+                    )
+                cursor.close()
+                Calls._record_status_changes(changes, chunk_conn)
+            for call_id in chunk:
+                results.setdefault(call_id, 'not_found')
+        return results
+
+    @staticmethod
+    def update_call_statuses_where(user_id, callback_status, call_done, filter_status=None, call_type=None,
+                                   start_date=None, end_date=None, chunk_size=500, max_rows=None, conn=None):
+        # Predicate form: every call of the tenant matching the filter gets the
+        # new status, chunk by chunk so no transaction locks more than
+        # chunk_size rows. Returns the ids that changed.
+        call_done = int(bool(call_done))
+        query = 'SELECT id, callback_status, call_done FROM calls WHERE user_id = %s AND id > %s'
+        params = [user_id]
+        if filter_status:
+            query += ' AND callback_status = %s'
+            params.append(filter_status)
+        if call_type:
+            query += ' AND call_type = %s'
+            params.append(call_type)
+        if start_date:
+            query += ' AND call_timestamp >= %s'
+            params.append(start_date)
+        if end_date:
+            query += ' AND call_timestamp < %s + INTERVAL 1 DAY'
+            params.append(end_date)
+        query += ' AND NOT (callback_status = %s AND call_done = %s) ORDER BY id LIMIT %s'
+        updated = []
+        last_id = 0
+        while max_rows is None or len(updated) < max_rows:
+            limit = chunk_size if max_rows is None else min(chunk_size, max_rows - len(updated))
+            with transaction(conn) as chunk_conn:
+                cursor = chunk_conn.cursor(dictionary=True)
+                cursor.execute(query, [params[0], last_id] + params[1:] + [callback_status, call_done, limit])
+                rows = cursor.fetchall()
+                cursor.close()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            results = Calls.update_call_statuses(
+                user_id, [(row['id'], callback_status, call_done) for row in rows], chunk_size=chunk_size, conn=conn)
+            updated.extend(call_id for call_id, result in results.items() if result == 'updated')
+            if len(rows) < limit:
+                break
+        return updated
         
     @staticmethod
-    def add_bulk_calls(calls_data):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.executemany('''
-            INSERT INTO calls (user_id, receiver_phone, call_type, conversation_history, ai_transmission_message, callback_status, call_done, receiver_name)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ''', calls_data)
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def add_bulk_calls(calls_data, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            # Each tuple is (user_id, receiver_name, receiver_phone, call_type,
+            # conversation_history, ai_transmission_message, callback_status, call_done);
+            # the connector rewrites executemany into one multi-row INSERT.
+            cursor.executemany('''
+                INSERT INTO calls (user_id, receiver_name, receiver_phone, call_type, conversation_history, ai_transmission_message, callback_status, call_done)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', calls_data)
+            inserted = cursor.rowcount
+            cursor.close()
+            # A campaign shares one ai_transmission_message; have its audio ready before dialing
+            messages = {call[5] for call in calls_data}
+            conn.after_commit(lambda: get_tts().presynthesize_async(messages))
+            deltas = {}
+            for call in calls_data:
+                key = (call[0], None, call[3], call[6], int(bool(call[7])))
+                deltas[key] = deltas.get(key, 0) + 1
+            CallStats.apply_deltas(deltas, conn=conn)
+            added = {}
+            for call in calls_data:
+                summary = added.setdefault(call[0], {'type': 'calls_added', 'counts': {}, 'done': 0})
+                summary['counts'][call[6]] = summary['counts'].get(call[6], 0) + 1
+                summary['done'] += 1 if call[7] else 0
+            conn.after_commit(lambda: [bus.publish(user_id, event) for user_id, event in added.items()])
+        return inserted
+
+    @staticmethod
+    def count_by_status(user_id, conn=None):
+        summary = CallStats.get_summary(user_id, conn=conn)
+        return {'counts': summary['by_status'], 'done': summary['done'], 'total': summary['total']}
         
     @staticmethod
-    def filter_calls(user_id, filter_type):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        if filter_type == 'all':
-            cursor.execute('SELECT * FROM calls WHERE user_id = %s', (user_id,))
-        else:
-            cursor.execute('SELECT * FROM calls WHERE user_id = %s AND callback_status = %s', (user_id, filter_type))
-        filtered_calls = cursor.fetchall()
-        cursor.close()
-        conn.close()
+    def filter_calls(user_id, filter_type, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            if filter_type == 'all':
+                cursor.execute('SELECT * FROM calls WHERE user_id = %s ORDER BY call_timestamp DESC, id DESC', (user_id,))
+            else:
+                cursor.execute('SELECT * FROM calls WHERE user_id = %s AND callback_status = %s ORDER BY call_timestamp DESC, id DESC', (user_id, filter_type))
+            filtered_calls = cursor.fetchall()
+            cursor.close()
         return filtered_calls
-    
-    
-    
-    
+
+
+
+
+class CallTurns:
+    SPEAKERS = ('caller', 'assistant', 'system')
+
+    def __init__(self, call_id, seq, speaker, text, started_at=None, ended_at=None):
+        self.call_id = call_id
+        self.seq = seq
+        self.speaker = speaker
+        self.text = text
+        self.started_at = started_at
+        self.ended_at = ended_at
+
+    @staticmethod
+    def append_turns(call_id, turns, conn=None):
+        # turns: [(seq, speaker, text, started_at, ended_at)]; appends only, the
+        # existing transcript is never rewritten.
+        if not turns:
+            return 0
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO call_turns (call_id, seq, speaker, text, started_at, ended_at)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', [(call_id,) + tuple(turn) for turn in turns])
+            cursor.close()
+        return len(turns)
+
+    @staticmethod
+    def next_seq(call_id, conn=None):
+        # A call that reconnects continues after every turn already stored,
+        # whether still in call_turns or already compacted into the blob.
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(seq) + 1, 0) FROM call_turns WHERE call_id = %s', (call_id,))
+            seq = cursor.fetchone()[0]
+            cursor.execute('SELECT transcript FROM call_transcripts WHERE call_id = %s', (call_id,))
+            existing = cursor.fetchone()
+            cursor.close()
+        if existing:
+            seq = max([seq] + [turn['seq'] + 1 for turn in CallTurns.decode_transcript(existing[0])])
+        return seq
+
+    @staticmethod
+    def compact(call_id, conn=None):
+        # Finished call: one compressed blob replaces the per-turn rows
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT seq, speaker, text, started_at, ended_at
+                FROM call_turns
+                WHERE call_id = %s
+                ORDER BY seq
+                FOR UPDATE
+            ''', (call_id,))
+            turns = cursor.fetchall()
+            if not turns:
+                cursor.close()
+                return 0
+            cursor.execute('SELECT transcript FROM call_transcripts WHERE call_id = %s FOR UPDATE', (call_id,))
+            existing = cursor.fetchone()
+            if existing:
+                turns = CallTurns.decode_transcript(existing['transcript']) + turns
+            cursor.execute('''
+                REPLACE INTO call_transcripts (call_id, turn_count, transcript)
+                VALUES (%s, %s, %s)
+            ''', (call_id, len(turns), CallTurns.encode_transcript(turns)))
+            cursor.execute('DELETE FROM call_turns WHERE call_id = %s', (call_id,))
+            cursor.close()
+        return len(turns)
+
+    @staticmethod
+    def encode_transcript(turns):
+        payload = [
+            [turn['seq'], turn['speaker'], turn['text'],
+             turn['started_at'].isoformat() if turn['started_at'] else None,
+             turn['ended_at'].isoformat() if turn['ended_at'] else None]
+            for turn in turns
+        ]
+        return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 6)
+
+    @staticmethod
+    def decode_transcript(blob):
+        return [
+            {
+                'seq': seq,
+                'speaker': speaker,
+                'text': text,
+                'started_at': datetime.fromisoformat(started_at) if started_at else None,
+                'ended_at': datetime.fromisoformat(ended_at) if ended_at else None,
+            }
+            for seq, speaker, text, started_at, ended_at in json.loads(zlib.decompress(blob))
+        ]
+
+    @staticmethod
+    def get_transcript(call_id, user_id, conn=None):
+        # Assembled only on request: compressed turns, then live turns, then the
+        # legacy conversation_history column for calls recorded before turns existed.
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT conversation_history FROM calls WHERE id = %s AND user_id = %s', (call_id, user_id))
+            call = cursor.fetchone()
+            if not call:
+                cursor.close()
+                return None
+            cursor.execute('SELECT transcript FROM call_transcripts WHERE call_id = %s', (call_id,))
+            compacted = cursor.fetchone()
+            cursor.execute('''
+                SELECT seq, speaker, text, started_at, ended_at
+                FROM call_turns
+                WHERE call_id = %s
+                ORDER BY seq
+            ''', (call_id,))
+            live = cursor.fetchall()
+            cursor.close()
+        turns = (CallTurns.decode_transcript(compacted['transcript']) if compacted else []) + live
+        if not turns and call['conversation_history']:
+            turns = [{'seq': 0, 'speaker': 'system', 'text': call['conversation_history'], 'started_at': None, 'ended_at': None}]
+        return turns
+
+
+class CallStats:
+    # Per-tenant, per-day counters kept in step with the calls table inside the
+    # same transaction as every write, so dashboards never scan calls.
+    def __init__(self, user_id, stat_date, call_type, callback_status, call_done, call_count=0):
+        self.user_id = user_id
+        self.stat_date = stat_date
+        self.call_type = call_type
+        self.callback_status = callback_status
+        self.call_done = call_done
+        self.call_count = call_count
+
+    @staticmethod
+    def apply_deltas(deltas, conn=None):
+        # deltas: {(user_id, stat_date or None for today, call_type, callback_status, call_done): delta}
+        rows = [(key, delta) for key, delta in deltas.items() if delta and key[0] is not None]
+        if not rows:
+            return
+        values = []
+        params = []
+        for (user_id, stat_date, call_type, callback_status, call_done), delta in sorted(rows, key=lambda row: str(row[0])):
+            values.append('(%s, ' + ('%s' if stat_date is not None else 'CURDATE()') + ', %s, %s, %s, %s)')
+            params.append(user_id)
+            if stat_date is not None:
+                params.append(stat_date)
+            params.extend((call_type, callback_status, call_done, delta))
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO call_stats_daily (user_id, stat_date, call_type, callback_status, call_done, call_count)
+                VALUES ''' + ', '.join(values) + '''
+                ON DUPLICATE KEY UPDATE call_count = call_count + VALUES(call_count)
+            ''', params)
+            cursor.close()
+
+    @staticmethod
+    def get_summary(user_id, start_date=None, end_date=None, by_day=False, conn=None):
+        query = '''
+            SELECT stat_date, call_type, callback_status, call_done, call_count
+            FROM call_stats_daily
+            WHERE user_id = %s
+        '''
+        params = [user_id]
+        if start_date:
+            query += ' AND stat_date >= %s'
+            params.append(start_date)
+        if end_date:
+            query += ' AND stat_date <= %s'
+            params.append(end_date)
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            cursor.close()
+
+        summary = {
+            'total': 0,
+            'done': 0,
+            'by_status': {status: 0 for status in Calls.CALLBACK_STATUSES},
+            'by_type': {'1way': 0, '2way': 0},
+        }
+        days = {}
+        for row in rows:
+            count = int(row['call_count'])
+            summary['total'] += count
+            summary['done'] += count if row['call_done'] else 0
+            summary['by_status'][row['callback_status']] += count
+            summary['by_type'][row['call_type']] += count
+            if by_day:
+                day = days.setdefault(row['stat_date'].isoformat(), {'total': 0, 'done': 0, 'by_status': {}, 'by_type': {}})
+                day['total'] += count
+                day['done'] += count if row['call_done'] else 0
+                day['by_status'][row['callback_status']] = day['by_status'].get(row['callback_status'], 0) + count
+                day['by_type'][row['call_type']] = day['by_type'].get(row['call_type'], 0) + count
+        if by_day:
+            summary['by_day'] = days
+        return summary
+
+    @staticmethod
+    def delete_batch(user_id, limit=1000, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM call_stats_daily WHERE user_id = %s LIMIT %s', (user_id, limit))
+            deleted = cursor.rowcount
+            cursor.close()
+        return deleted
+
+    @staticmethod
+    def rebuild(user_id=None, conn=None):
+        # Backfill / repair: recompute the rollup from the calls table
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            if user_id is None:
+                cursor.execute('DELETE FROM call_stats_daily')
+                where = 'WHERE user_id IS NOT NULL'
+                params = ()
+            else:
+                cursor.execute('DELETE FROM call_stats_daily WHERE user_id = %s', (user_id,))
+                where = 'WHERE user_id = %s'
+                params = (user_id,)
+            cursor.execute('''
+                INSERT INTO call_stats_daily (user_id, stat_date, call_type, callback_status, call_done, call_count)
+                SELECT user_id, DATE(call_timestamp), call_type, callback_status, call_done, COUNT(*)
+                FROM calls
+                ''' + where + '''
+                GROUP BY user_id, DATE(call_timestamp), call_type, callback_status, call_done
+            ''', params)
+            rows = cursor.rowcount
+            cursor.close()
+        return rows
+
+
+class CallArchives:
+    def __init__(self, user_id, path, min_ts, max_ts, min_id, max_id, row_count, id=None, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.path = path
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.min_id = min_id
+        self.max_id = max_id
+        self.row_count = row_count
+        self.created_at = created_at
+
+    @staticmethod
+    def add_archive(user_id, path, min_ts, max_ts, min_id, max_id, row_count, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO call_archives (user_id, path, min_ts, max_ts, min_id, max_id, row_count)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ''', (user_id, path, min_ts, max_ts, min_id, max_id, row_count))
+            archive_id = cursor.lastrowid
+            cursor.close()
+        return archive_id
+
+    @staticmethod
+    def list_for_user(user_id, before=None, conn=None):
+        # Newest first; `before` is a (call_timestamp, id) cursor and skips
+        # files whose whole range is at or after it
+        query = 'SELECT * FROM call_archives WHERE user_id = %s'
+        params = [user_id]
+        if before is not None:
+            query += ' AND (min_ts < %s OR (min_ts = %s AND min_id < %s))'
+            params.extend((before[0], before[0], before[1]))
+        query += ' ORDER BY max_ts DESC, id DESC'
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, params)
+            archives = cursor.fetchall()
+            cursor.close()
+        return archives
+
+    @staticmethod
+    def delete_batch(user_id, limit=100, conn=None):
+        # Returns the file paths whose index rows were removed; the caller
+        # deletes the files once this transaction has committed.
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT id, path FROM call_archives WHERE user_id = %s ORDER BY id LIMIT %s FOR UPDATE', (user_id, limit))
+            archives = cursor.fetchall()
+            if archives:
+                placeholders = ', '.join(['%s'] * len(archives))
+                cursor.execute('DELETE FROM call_archives WHERE id IN (%s)' % placeholders, [archive['id'] for archive in archives])
+            cursor.close()
+        return [archive['path'] for archive in archives]
+
+
 class Credits:
     def __init__(self, user_id, credits, id=None):
         self.id = id
@@ -427,90 +1186,432 @@ class Credits:
         self.credits = credits
         
     @staticmethod
-    def create_table():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS credits (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT,
-                credits INT DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-    @staticmethod
-    def add_credits(user_id, credits):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO credits (user_id, credits)
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE credits = credits + %s
-        ''', (user_id, credits, credits))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def add_credits(user_id, credits, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO credits (user_id, credits)
+                VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE credits = credits + %s
+            ''', (user_id, credits, credits))
+            cursor.close()
         
     @staticmethod
-    def get_credits(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT credits FROM credits WHERE user_id = %s', (user_id,))
-        credits = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def get_credits(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('SELECT credits FROM credits WHERE user_id = %s', (user_id,))
+            credits = cursor.fetchone()
+            cursor.close()
         return credits['credits'] if credits else 0
     
     @staticmethod
-    def deduct_credits(user_id, credits):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE credits
-            SET credits = credits - %s
-            WHERE user_id = %s AND credits >= %s
-        ''', (credits, user_id, credits))
-        if cursor.rowcount == 0:
-            raise ValueError("Insufficient credits")
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def deduct_credits(user_id, credits, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE credits
+                SET credits = credits - %s
+                WHERE user_id = %s AND credits >= %s
+            ''', (credits, user_id, credits))
+            updated = cursor.rowcount
+            cursor.close()
+            if updated == 0:
+                raise ValueError("Insufficient credits")
         
     @staticmethod
-    def reset_credits(user_id):
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE credits
-            SET credits = 0
-            WHERE user_id = %s
-        ''', (user_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def reset_credits(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE credits
+                SET credits = 0
+                WHERE user_id = %s
+            ''', (user_id,))
+            cursor.close()
 
     @staticmethod
-    def get_user_data_by_email(email):
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('''
-            SELECT 
-                users.id, 
-                users.user_name, 
-                users.email, 
-                users.whatsapp_number, 
-                user_call_data.twilio_phone_number, 
-                credits.credits
-            FROM users
-            JOIN user_call_data ON users.id = user_call_data.user_id
-            JOIN credits ON users.id = credits.user_id
-            WHERE users.email = %s
-        ''', (email,))
-        user_data = cursor.fetchone()
-        cursor.close()
-        conn.close()
+    def delete_credits(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM credits WHERE user_id = %s', (user_id,))
+            deleted = cursor.rowcount
+            cursor.close()
+        return deleted
+
+    @staticmethod
+    def get_user_data_by_email(email, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute('''
+                SELECT
+                    users.id,
+                    users.user_name,
+                    users.email,
+                    users.whatsapp_number,
+                    user_call_data.twilio_phone_number,
+                    credits.credits
+                FROM users
+                JOIN user_call_data ON users.id = user_call_data.user_id
+                JOIN credits ON users.id = credits.user_id
+                WHERE users.email = %s
+            ''', (email,))
+            user_data = cursor.fetchone()
+            cursor.close()
         return user_data
+
+
+class CreditReservations:
+    def __init__(self, user_id, reserved, owner=None, settled=0, status='open', expires_at=None, id=None, created_at=None, closed_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.owner = owner
+        self.reserved = reserved
+        self.settled = settled
+        self.status = status
+        self.expires_at = expires_at
+        self.created_at = created_at
+        self.closed_at = closed_at
+
+    @staticmethod
+    def reserve(user_id, credits, owner=None, ttl_seconds=900, partial=False, conn=None):
+        # Takes the credits up front with one conditional UPDATE, so two
+        # dispatchers can never overspend. With partial=True whatever is left
+        # (up to `credits`) is granted instead of nothing. Returns
+        # (reservation_id, granted); reservation_id is None when nothing was granted.
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE credits
+                SET credits = credits - %s
+                WHERE user_id = %s AND credits >= %s
+            ''', (credits, user_id, credits))
+            granted = credits if cursor.rowcount else 0
+            if not granted and partial:
+                cursor.execute('SELECT credits FROM credits WHERE user_id = %s FOR UPDATE', (user_id,))
+                row = cursor.fetchone()
+                granted = max(0, min(credits, row[0])) if row else 0
+                if granted:
+                    cursor.execute('UPDATE credits SET credits = credits - %s WHERE user_id = %s', (granted, user_id))
+            if not granted:
+                cursor.close()
+                return None, 0
+            cursor.execute('''
+                INSERT INTO credit_reservations (user_id, owner, reserved, expires_at)
+                VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+            ''', (user_id, owner, granted, ttl_seconds))
+            reservation_id = cursor.lastrowid
+            cursor.close()
+        return reservation_id, granted
+
+    @staticmethod
+    def settle(usage, conn=None):
+        # usage: {reservation_id: credits used since the last flush}. One
+        # statement for the whole batch and the credits rows are not touched,
+        # since the credits were taken when the reservation was made.
+        usage = {reservation_id: used for reservation_id, used in usage.items() if used}
+        if not usage:
+            return 0
+        cases = ' '.join(['WHEN %s THEN %s'] * len(usage))
+        params = [value for item in usage.items() for value in item]
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE credit_reservations SET settled = LEAST(reserved, settled + CASE id ' + cases + ' ELSE 0 END) '
+                "WHERE status = 'open' AND id IN (" + ', '.join(['%s'] * len(usage)) + ')',
+                params + list(usage)
+            )
+            updated = cursor.rowcount
+            cursor.close()
+        return updated
+
+    @staticmethod
+    def release(reservation_ids, conn=None):
+        # Closes the reservations and refunds what was not settled, with one
+        # credits UPDATE per tenant. Returns {user_id: refunded}.
+        if not reservation_ids:
+            return {}
+        placeholders = ', '.join(['%s'] * len(reservation_ids))
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                'SELECT id, user_id, reserved, settled FROM credit_reservations '
+                "WHERE status = 'open' AND id IN (" + placeholders + ') FOR UPDATE',
+                list(reservation_ids)
+            )
+            reservations = cursor.fetchall()
+            if not reservations:
+                cursor.close()
+                return {}
+            cursor.execute(
+                "UPDATE credit_reservations SET status = 'closed', closed_at = NOW() "
+                'WHERE id IN (' + ', '.join(['%s'] * len(reservations)) + ')',
+                [reservation['id'] for reservation in reservations]
+            )
+            refunds = {}
+            for reservation in reservations:
+                refund = reservation['reserved'] - reservation['settled']
+                if refund:
+                    refunds[reservation['user_id']] = refunds.get(reservation['user_id'], 0) + refund
+            for user_id, refund in sorted(refunds.items()):
+                cursor.execute('UPDATE credits SET credits = credits + %s WHERE user_id = %s', (refund, user_id))
+            cursor.close()
+        return refunds
+
+    @staticmethod
+    def release_expired(limit=500, conn=None):
+        # Reservations whose dispatcher died; what they settled stays spent
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id FROM credit_reservations
+                WHERE status = 'open' AND expires_at < NOW()
+                ORDER BY expires_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (limit,))
+            reservation_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+            refunds = CreditReservations.release(reservation_ids, conn=conn)
+        return refunds
+
+    @staticmethod
+    def extend(reservation_ids, ttl_seconds=900, conn=None):
+        if not reservation_ids:
+            return
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE credit_reservations SET expires_at = NOW() + INTERVAL %s SECOND '
+                "WHERE status = 'open' AND id IN (" + ', '.join(['%s'] * len(reservation_ids)) + ')',
+                [ttl_seconds] + list(reservation_ids)
+            )
+            cursor.close()
+
+    @staticmethod
+    def get_reserved(user_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COALESCE(SUM(reserved - settled), 0)
+                FROM credit_reservations
+                WHERE user_id = %s AND status = 'open'
+            ''', (user_id,))
+            reserved = cursor.fetchone()[0]
+            cursor.close()
+        return int(reserved)
+
+    @staticmethod
+    def delete_batch(user_id, limit=1000, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM credit_reservations WHERE user_id = %s LIMIT %s', (user_id, limit))
+            deleted = cursor.rowcount
+            cursor.close()
+        return deleted
+
+
+class DispatchNumbers:
+    # Rate and concurrency limits per caller ID, kept in the database so they
+    # hold across all dispatcher processes rather than per process.
+    @staticmethod
+    def acquire(number, call_id, calls_per_second, concurrency, burst=None, slot_seconds=300, conn=None):
+        # Takes a token and a slot for one call. Returns 0.0 when acquired,
+        # otherwise how many seconds to wait before asking again.
+        burst = burst or max(1.0, calls_per_second)
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'INSERT IGNORE INTO dispatch_numbers (twilio_phone_number, tokens, refilled_at) VALUES (%s, %s, NOW(6))',
+                (number, burst)
+            )
+            # The row lock serializes dispatchers on this number only
+            cursor.execute('''
+                SELECT tokens, TIMESTAMPDIFF(MICROSECOND, refilled_at, NOW(6)) / 1000000
+                FROM dispatch_numbers
+                WHERE twilio_phone_number = %s
+                FOR UPDATE
+            ''', (number,))
+            tokens, elapsed = cursor.fetchone()
+            tokens = min(burst, float(tokens) + max(0.0, float(elapsed)) * calls_per_second)
+            cursor.execute(
+                'SELECT COUNT(*) FROM dispatch_number_slots WHERE twilio_phone_number = %s AND expires_at > NOW(6)',
+                (number,)
+            )
+            in_flight = cursor.fetchone()[0]
+            if tokens < 1 or in_flight >= concurrency:
+                cursor.close()
+                if tokens < 1:
+                    return (1 - tokens) / calls_per_second
+                # Woken by a finishing call at the latest on the next poll
+                return 0.05
+            cursor.execute('''
+                UPDATE dispatch_numbers
+                SET tokens = %s, refilled_at = NOW(6)
+                WHERE twilio_phone_number = %s
+            ''', (tokens - 1, number))
+            cursor.execute('''
+                REPLACE INTO dispatch_number_slots (call_id, twilio_phone_number, expires_at)
+                VALUES (%s, %s, NOW(6) + INTERVAL %s SECOND)
+            ''', (call_id, number, slot_seconds))
+            cursor.close()
+        return 0.0
+
+    @staticmethod
+    def release(call_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM dispatch_number_slots WHERE call_id = %s', (call_id,))
+            cursor.close()
+
+    @staticmethod
+    def purge_expired(limit=1000, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM dispatch_number_slots WHERE expires_at < NOW(6) LIMIT %s', (limit,))
+            purged = cursor.rowcount
+            cursor.close()
+        return purged
+
+
+class Jobs:
+    MAX_ERRORS = 100
+
+    def __init__(self, job_type, user_id=None, status='queued', processed_rows=0, succeeded_rows=0, failed_rows=0, errors=None, state=None, message=None, id=None):
+        self.id = id
+        self.job_type = job_type
+        self.user_id = user_id
+        self.status = status
+        self.processed_rows = processed_rows
+        self.succeeded_rows = succeeded_rows
+        self.failed_rows = failed_rows
+        self.errors = errors or []
+        self.state = state or {}
+        self.message = message
+
+    @staticmethod
+    def _decode(job):
+        if job:
+            job['errors'] = json.loads(job['errors']) if job['errors'] else []
+            job['state'] = json.loads(job['state']) if job['state'] else {}
+        return job
+
+    @staticmethod
+    def create_job(job_type, user_id=None, state=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO jobs (job_type, user_id, state)
+                VALUES (%s, %s, %s)
+            ''', (job_type, user_id, json.dumps(state or {})))
+            job_id = cursor.lastrowid
+            cursor.close()
+        return job_id
+
+    @staticmethod
+    def get_job(job_id, user_id=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            if user_id is None:
+                cursor.execute('SELECT * FROM jobs WHERE id = %s', (job_id,))
+            else:
+                cursor.execute('SELECT * FROM jobs WHERE id = %s AND user_id = %s', (job_id, user_id))
+            job = cursor.fetchone()
+            cursor.close()
+        return Jobs._decode(job)
+
+    @staticmethod
+    def find_active(job_type, user_id, statuses=('queued', 'running'), conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ', '.join(['%s'] * len(statuses))
+            cursor.execute('''
+                SELECT * FROM jobs
+                WHERE job_type = %%s AND user_id = %%s AND status IN (%s)
+                ORDER BY id DESC
+                LIMIT 1
+            ''' % placeholders, (job_type, user_id) + tuple(statuses))
+            job = cursor.fetchone()
+            cursor.close()
+        return Jobs._decode(job)
+
+    @staticmethod
+    def claim_stalled(job_type, stale_seconds=300, statuses=('queued', 'running'), conn=None):
+        # Jobs in one of statuses with no progress for stale_seconds lost their
+        # worker (or failed and may be retried). Touching updated_at hands each
+        # one to exactly one resumer; it goes back to queued so the run that
+        # picks it up still has to win claim_job.
+        with transaction(conn) as conn:
+            cursor = conn.cursor(dictionary=True)
+            placeholders = ', '.join(['%s'] * len(statuses))
+            cursor.execute('''
+                SELECT * FROM jobs
+                WHERE job_type = %%s AND status IN (%s)
+                AND updated_at < NOW() - INTERVAL %%s SECOND
+                FOR UPDATE SKIP LOCKED
+            ''' % placeholders, (job_type,) + tuple(statuses) + (stale_seconds,))
+            stalled = cursor.fetchall()
+            if stalled:
+                placeholders = ', '.join(['%s'] * len(stalled))
+                cursor.execute(
+                    "UPDATE jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP WHERE id IN (%s)" % placeholders,
+                    [job['id'] for job in stalled]
+                )
+            cursor.close()
+        return [Jobs._decode(job) for job in stalled]
+
+    @staticmethod
+    def claim_job(job_id, conn=None):
+        # Moves a queued job to running; only one caller gets True, so a job
+        # submitted twice (by its creator and by a resumer) runs once.
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs
+                SET status = 'running'
+                WHERE id = %s AND status = 'queued'
+            ''', (job_id,))
+            claimed = cursor.rowcount == 1
+            cursor.close()
+        return claimed
+
+    @staticmethod
+    def requeue_job(job_id, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs
+                SET status = 'queued', message = NULL
+                WHERE id = %s AND status = 'failed'
+            ''', (job_id,))
+            requeued = cursor.rowcount == 1
+            cursor.close()
+        return requeued
+
+    @staticmethod
+    def update_progress(job_id, processed_rows, succeeded_rows, failed_rows, errors=None, state=None, status='running', conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs
+                SET status = %s, processed_rows = %s, succeeded_rows = %s, failed_rows = %s,
+                    errors = %s, state = COALESCE(%s, state)
+                WHERE id = %s
+            ''', (
+                status, processed_rows, succeeded_rows, failed_rows,
+                json.dumps((errors or [])[:Jobs.MAX_ERRORS]),
+                json.dumps(state) if state is not None else None,
+                job_id
+            ))
+            cursor.close()
+
+    @staticmethod
+    def finish_job(job_id, status, message=None, conn=None):
+        with transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs
+                SET status = %s, message = %s
+                WHERE id = %s
+            ''', (status, message[:255] if message else None, job_id))
+            cursor.close()
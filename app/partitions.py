@@ -0,0 +1,84 @@
+from datetime import date
+
+from app.db import transaction
+
+# calls is RANGE-partitioned by month on TO_DAYS(call_timestamp); p_future
+# catches everything beyond the newest monthly partition.
+FUTURE_PARTITION = 'p_future'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'p%04d%02d' % (month.year, month.month)
+
+
+def partition_clause(month):
+    # Partition pYYYYMM holds rows strictly before the first day of the next month
+    return "PARTITION %s VALUES LESS THAN (TO_DAYS('%s'))" % (partition_name(month), add_months(month, 1).isoformat())
+
+
+def existing_partitions(cursor, table='calls'):
+    cursor.execute('''
+        SELECT partition_name FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+    ''', (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_partitions(months_ahead=3, today=None, conn=None):
+    # Split p_future so monthly partitions exist through `months_ahead`
+    today = today or date.today()
+    with transaction(conn) as conn:
+        cursor = conn.cursor()
+        existing = existing_partitions(cursor)
+        if FUTURE_PARTITION not in existing:
+            cursor.close()
+            return []
+        monthly = sorted(name for name in existing if name != FUTURE_PARTITION)
+        if monthly:
+            last = monthly[-1]
+            start = add_months(date(int(last[1:5]), int(last[5:7]), 1), 1)
+        else:
+            start = month_start(today)
+        end = add_months(month_start(today), months_ahead)
+        months = []
+        month = start
+        while month <= end:
+            months.append(month)
+            month = add_months(month, 1)
+        if months:
+            cursor.execute(
+                'ALTER TABLE calls REORGANIZE PARTITION %s INTO (%s, PARTITION %s VALUES LESS THAN MAXVALUE)' % (
+                    FUTURE_PARTITION,
+                    ', '.join(partition_clause(month) for month in months),
+                    FUTURE_PARTITION,
+                )
+            )
+        cursor.close()
+    return [partition_name(month) for month in months]
+
+
+def drop_empty_partitions(before, conn=None):
+    # Archived months leave empty partitions behind; dropping them is instant
+    cutoff = partition_name(month_start(before))
+    dropped = []
+    with transaction(conn) as conn:
+        cursor = conn.cursor()
+        for name in existing_partitions(cursor):
+            if name == FUTURE_PARTITION or name >= cutoff:
+                continue
+            cursor.execute('SELECT 1 FROM calls PARTITION (%s) LIMIT 1' % name)
+            if cursor.fetchone() is None:
+                cursor.execute('ALTER TABLE calls DROP PARTITION %s' % name)
+                dropped.append(name)
+        cursor.close()
+    return dropped
@@ -0,0 +1,73 @@
+import json
+import os
+import time
+
+from app.events import bus
+from app.models import Calls
+
+HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+# Counters are rebuilt from the database this often, which also folds in
+# changes made by other processes (e.g. the dispatcher worker).
+RESYNC_SECONDS = float(os.getenv('SSE_RESYNC_SECONDS', 60))
+RECENT_LIMIT = 50
+
+
+def format_event(name, data):
+    return 'event: %s\ndata: %s\n\n' % (name, json.dumps(data, separators=(',', ':')))
+
+
+def apply_event(snapshot, event):
+    counts = snapshot['counts']
+    if event['type'] == 'call_updated':
+        previous = event['previous']
+        call = event['call']
+        counts[previous['callback_status']] = counts.get(previous['callback_status'], 0) - 1
+        counts[call['callback_status']] = counts.get(call['callback_status'], 0) + 1
+        snapshot['done'] += call['call_done'] - previous['call_done']
+        return [call]
+    if event['type'] == 'calls_added':
+        for status, count in event['counts'].items():
+            counts[status] = counts.get(status, 0) + count
+            snapshot['total'] += count
+        snapshot['done'] += event['done']
+    return []
+
+
+def campaign_stream(user_id):
+    # Subscribe before reading the initial counts so no change slips between
+    # them. Events stamped at or before the sequence taken just before the
+    # read are already in the counts and are skipped rather than applied twice.
+    subscription = bus.subscribe(user_id)
+    try:
+        yield 'retry: 3000\n\n'
+        seen = bus.sequence()
+        snapshot = Calls.count_by_status(user_id)
+        synced_at = time.monotonic()
+        yield format_event('snapshot', snapshot)
+        while True:
+            event = subscription.get(timeout=HEARTBEAT_SECONDS)
+            if subscription.overflowed or time.monotonic() - synced_at >= RESYNC_SECONDS:
+                subscription.overflowed = False
+                subscription.drain(bus.maxsize)
+                seen = bus.sequence()
+                snapshot = Calls.count_by_status(user_id)
+                synced_at = time.monotonic()
+                yield format_event('snapshot', snapshot)
+                continue
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            # Coalesce a burst of changes into one counters frame
+            changed = []
+            applied = False
+            for pending in [event] + subscription.drain(RECENT_LIMIT * 4):
+                if pending['seq'] <= seen:
+                    continue
+                applied = True
+                changed.extend(apply_event(snapshot, pending))
+            if changed:
+                yield format_event('calls', {'calls': changed[-RECENT_LIMIT:]})
+            if applied:
+                yield format_event('counters', snapshot)
+    finally:
+        subscription.close()
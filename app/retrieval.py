@@ -0,0 +1,215 @@
+import hashlib
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+CHUNK_CHARS = int(os.getenv('RETRIEVAL_CHUNK_CHARS', 800))
+TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 4))
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+STOPWORDS = frozenset('''
+a an and are as at be but by can do does for from how i if in is it its me my of on or our so
+that the their then there these this to was we what when where which who why will with you your
+'''.split())
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _split_paragraph(paragraph, chunk_chars):
+    # Packs an oversized paragraph's sentences (then raw slices for run-on
+    # text) into chunks of about chunk_chars.
+    pieces = []
+    for sentence in SENTENCE_SPLIT.split(paragraph):
+        while len(sentence) > chunk_chars:
+            pieces.append(sentence[:chunk_chars])
+            sentence = sentence[chunk_chars:]
+        if sentence:
+            pieces.append(sentence)
+
+    chunks = []
+    current = []
+    size = 0
+    for piece in pieces:
+        if current and size + len(piece) + 1 > chunk_chars:
+            chunks.append(' '.join(current))
+            current = []
+            size = 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+def chunk_text(text, chunk_chars=CHUNK_CHARS):
+    # One passage per paragraph; only a paragraph longer than chunk_chars is
+    # split, and only within itself. Boundaries therefore never depend on
+    # neighbouring paragraphs, so editing one paragraph changes only its own
+    # chunks and DatasetIndex.update keeps every other chunk's hash.
+    chunks = []
+    for paragraph in PARAGRAPH_SPLIT.split(text or ''):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_chars:
+            chunks.append(paragraph)
+        else:
+            chunks.extend(_split_paragraph(paragraph, chunk_chars))
+    return chunks
+
+
+def dataset_version(text):
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+
+
+class _Chunk:
+    __slots__ = ('text', 'term_counts', 'length')
+
+    def __init__(self, text):
+        self.text = text
+        tokens = tokenize(text)
+        self.term_counts = Counter(tokens)
+        self.length = len(tokens)
+
+
+class DatasetIndex:
+    # BM25 over an inverted index. Chunks are keyed by content hash so an
+    # update only tokenizes chunks that actually changed.
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.version = dataset_version('')
+        # Version of the stored dataset this index was loaded for, as reported
+        # by the call config; maintained by IndexRegistry.
+        self.source = None
+        self.chunks = {}
+        self.order = []
+        self.postings = {}
+        self.total_length = 0
+
+    def _add(self, key, chunk):
+        self.chunks[key] = chunk
+        self.total_length += chunk.length
+        for term, count in chunk.term_counts.items():
+            self.postings.setdefault(term, {})[key] = count
+
+    def _remove(self, key):
+        chunk = self.chunks.pop(key)
+        self.total_length -= chunk.length
+        for term in chunk.term_counts:
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+
+    def update(self, text):
+        version = dataset_version(text)
+        if version == self.version:
+            return {'added': 0, 'removed': 0, 'kept': len(self.chunks)}
+        texts = chunk_text(text)
+        keys = [hashlib.sha1(chunk.encode('utf-8')).hexdigest() for chunk in texts]
+        wanted = dict(zip(keys, texts))
+        removed = [key for key in self.chunks if key not in wanted]
+        for key in removed:
+            self._remove(key)
+        added = 0
+        for key, chunk in wanted.items():
+            if key not in self.chunks:
+                self._add(key, _Chunk(chunk))
+                added += 1
+        self.order = list(dict.fromkeys(keys))
+        self.version = version
+        return {'added': added, 'removed': len(removed), 'kept': len(self.chunks) - added}
+
+    def search(self, query, k=TOP_K):
+        terms = set(tokenize(query))
+        if not terms or not self.chunks:
+            return []
+        count = len(self.chunks)
+        average_length = self.total_length / count or 1.0
+        scores = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                length = self.chunks[key].length
+                norm = frequency + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / norm
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.chunks[key].text, score) for key, score in best]
+
+
+class IndexRegistry:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    def _entry(self, user_id):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = DatasetIndex()
+                self._indexes[user_id] = index
+                self._build_locks[user_id] = threading.Lock()
+                while len(self._indexes) > self.maxsize:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._build_locks.pop(evicted, None)
+            self._indexes.move_to_end(user_id)
+            return index, self._build_locks[user_id]
+
+    def refresh(self, user_id, dataset):
+        index, build_lock = self._entry(user_id)
+        with build_lock:
+            changes = index.update(dataset or '')
+            index.source = dataset_version(dataset)
+            return changes
+
+    def get(self, user_id, source, load):
+        # `source` is the dataset version from the call-config cache; the text
+        # is only loaded (and diffed) when it differs from the indexed one.
+        index, build_lock = self._entry(user_id)
+        if index.source != source:
+            with build_lock:
+                if index.source != source:
+                    index.update(load() or '')
+                    index.source = source
+        return index
+
+    def forget(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+            self._build_locks.pop(user_id, None)
+
+
+registry = IndexRegistry(maxsize=int(os.getenv('RETRIEVAL_MAX_TENANTS', 256)))
+
+
+def get_index(user_id):
+    from app.models import UserCallData
+    config = UserCallData.get_call_config(user_id) or {}
+    return registry.get(int(user_id), config.get('dataset_version'), lambda: UserCallData.get_user_dataset(user_id))
+
+
+def retrieve(user_id, query, k=TOP_K):
+    return get_index(user_id).search(query, k)
+
+
+def build_context(user_id, query, k=TOP_K):
+    # Only the top-k passages go into the prompt instead of the whole dataset
+    return '\n\n'.join(text for text, _ in retrieve(user_id, query, k))
+
+
+def refresh_async(user_id, dataset):
+    from app import jobs
+    return jobs.submit(registry.refresh, int(user_id), dataset)
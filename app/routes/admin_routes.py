@@ -1,4 +1,8 @@
-from app.models import Admin, Users, UserCallData, Calls
+from app.models import Admin, Users, UserCallData, Calls, Jobs
+from app.tenant_deletion import JOB_TYPE as DELETE_JOB_TYPE, start_deletion
+from app import answers
+from app.cache import cache_stats
+from app.db import pool_stats, transaction
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, session, make_response
 from functools import wraps
@@ -107,12 +111,13 @@ def delete_admin():
     if not admin_id:
         return jsonify(message='Admin ID is required'), 400
     
-    admin = Admin.get_by_id(admin_id)
-    
-    if not admin:
-        return jsonify(message='Admin not found'), 404
-    
-    Admin.delete_admin(admin_id)
+    with transaction() as conn:
+        admin = Admin.get_by_id(admin_id, conn=conn)
+        
+        if not admin:
+            return jsonify(message='Admin not found'), 404
+        
+        Admin.delete_admin(admin_id, conn=conn)
     
     return jsonify(message='Admin deleted successfully'), 200
 
@@ -135,31 +140,28 @@ def add_user():
     
     hashed_password = generate_password_hash(password)
     
-    Users.add_user(
-        user_name=user_name,
-        email=email,
-        password=hashed_password,
-        company_name=company_name,
-        whatsapp_number=whatsapp_number
-    )
-    
-    # new_user.add_user()
-    
-    new_user = Users.get_user_by_email(email)
-    if not new_user:
-        return jsonify(message='User creation failed'), 500
     try:
-        UserCallData.add_user_call_data(
-        user_id=new_user['id'],
-        twilio_phone_number=twilio_phone_number,
-        dataset='',
-        greeting_message='Hello! This is an AI Assistant. How may I help you?'
-        )
-        return jsonify(message='User added successfully'), 201
-    # user_call_data.add_user_call_data()
-    # if not user_call_data:
-    except:
-        return jsonify(message='User call data creation failed'), 500    
+        # User row and its call data are created on one connection and committed together
+        with transaction() as conn:
+            user_id = Users.add_user(
+                user_name=user_name,
+                email=email,
+                password=hashed_password,
+                company_name=company_name,
+                whatsapp_number=whatsapp_number,
+                conn=conn
+            )
+            UserCallData.add_user_call_data(
+                user_id=user_id,
+                twilio_phone_number=twilio_phone_number,
+                dataset='',
+                greeting_message='Hello! This is an AI Assistant. How may I help you?',
+                conn=conn
+            )
+    except Exception:
+        return jsonify(message='User creation failed'), 500
+    
+    return jsonify(message='User added successfully', user_id=user_id), 201
 
 @bp.route('/api/admin/getUsers', methods=['GET', 'OPTIONS'])
 @admin_required
@@ -183,14 +185,62 @@ def delete_user():
     if not user_id:
         return jsonify(message='User ID is required'), 400
     
-    user = Users.get_by_id(user_id)
+    # No credits join: a deletion that failed past the credits phase must
+    # still find the user to be retried.
+    user = Users.get_user_info(user_id)
     
     if not user:
         return jsonify(message='User not found'), 404
     
-    Users.delete_user(user_id=user_id)
+    job_id = start_deletion(user_id)
+    
+    return jsonify(message='User deletion started', job_id=job_id), 202
+
+@bp.route('/api/admin/updateDispatchLimits', methods=['POST', 'OPTIONS'])
+@admin_required
+def update_dispatch_limits():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    call_weight = data.get('call_weight', 1)
+    max_concurrent_calls = data.get('max_concurrent_calls')
+
+    if not user_id:
+        return jsonify(message='User ID is required'), 400
+    if not isinstance(call_weight, int) or call_weight < 1:
+        return jsonify(message='call_weight must be a positive integer'), 400
+    if max_concurrent_calls is not None and (not isinstance(max_concurrent_calls, int) or max_concurrent_calls < 1):
+        return jsonify(message='max_concurrent_calls must be a positive integer or null'), 400
+
+    UserCallData.update_dispatch_limits(user_id, call_weight, max_concurrent_calls)
+    return jsonify(message='Dispatch limits updated successfully'), 200
+
+@bp.route('/api/admin/deleteUserStatus', methods=['GET', 'OPTIONS'])
+@admin_required
+@no_cache
+def delete_user_status():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+    job_id = request.args.get('job_id')
+    
+    if not job_id:
+        return jsonify(message='Job ID is required'), 400
+    
+    job = Jobs.get_job(job_id)
+    
+    if not job or job['job_type'] != DELETE_JOB_TYPE:
+        return jsonify(message='Job not found'), 404
     
-    return jsonify(message='User deleted successfully'), 200
+    return jsonify(
+        job_id=job['id'],
+        user_id=job['user_id'],
+        status=job['status'],
+        phase=job['state'].get('phase'),
+        deleted=job['state'].get('deleted', {}),
+        deleted_rows=job['processed_rows'],
+        message=job['message']
+    ), 200
 
 # @bp.route('/api/admin/updateUserInfo', methods=['POST', 'OPTIONS'])
 # def update_user_info():
@@ -258,3 +308,33 @@ def get_user_info():
     
     return jsonify(user=user), 200
 
+
+@bp.route('/api/admin/dbPoolStats', methods=['GET', 'OPTIONS'])
+@admin_required
+@no_cache
+def db_pool_stats():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    return jsonify(pool=pool_stats()), 200
+
+
+@bp.route('/api/admin/cacheStats', methods=['GET', 'OPTIONS'])
+@admin_required
+@no_cache
+def get_cache_stats():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    return jsonify(caches=cache_stats()), 200
+
+
+@bp.route('/api/admin/answerCacheStats', methods=['GET', 'OPTIONS'])
+@admin_required
+@no_cache
+def get_answer_cache_stats():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    user_id = request.args.get('user_id', type=int)
+    return jsonify(enabled=answers.enabled(), tenants=answers.cache.tenant_stats(user_id)), 200
@@ -1,4 +1,4 @@
-from app.models import Users, UserCallData, Calls, Credits
+from app.models import Users, UserCallData, Calls, Credits, CreditReservations
 from flask import Blueprint, request, jsonify, session, make_response
 from functools import wraps
 from app.routes.user_routes import user_required
@@ -40,7 +40,8 @@ def get_credits():
     
     try:
         credits = Credits.get_credits(user_id)
-        return jsonify(credits=credits), 200
+        reserved = CreditReservations.get_reserved(user_id)
+        return jsonify(credits=credits, reserved=reserved), 200
     except Exception as e:
         return jsonify(message=str(e)), 500
     
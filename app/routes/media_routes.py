@@ -0,0 +1,20 @@
+import re
+from flask import Blueprint, abort, send_file
+from app.tts import MIMETYPES, get_tts
+
+bp = Blueprint('media_routes', __name__)
+
+AUDIO_KEY = re.compile(r'^[0-9a-f]{64}$')
+
+
+@bp.route('/media/tts/<key>.<extension>', methods=['GET'])
+def tts_audio(key, extension):
+    # Fetched by Twilio <Play>; only content-addressed cache entries are served
+    if not AUDIO_KEY.match(key) or extension not in MIMETYPES:
+        abort(404)
+    path = get_tts().cache.get(key, extension)
+    if not path:
+        abort(404)
+    response = send_file(path, mimetype=MIMETYPES[extension])
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,15 @@
+import hmac
+import os
+from flask import Blueprint, Response, request, abort
+from app.metrics import registry
+
+bp = Blueprint('metrics_routes', __name__)
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Scraped by Prometheus; set METRICS_TOKEN to require a bearer token
+    token = os.getenv('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        abort(401)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,63 @@
+import os
+from flask import Blueprint, request, jsonify
+from app.models import Calls
+from app.webhooks import BufferFull, get_status_buffer
+
+bp = Blueprint('telephony_routes', __name__)
+
+STATUS_RANK = {status: rank for rank, status in enumerate(('queued', 'initiated', 'ringing', 'in-progress'))}
+WAIT_TIMEOUT = float(os.getenv('WEBHOOK_WAIT_TIMEOUT', 2.0))
+
+_validator = None
+
+
+def signature_valid():
+    # Twilio signs every callback with the account's auth token
+    # Fails closed: without a token nothing is accepted unless validation was
+    # explicitly turned off (local runs with the fake telephony backend).
+    global _validator
+    if os.getenv('TWILIO_VALIDATE_WEBHOOKS', '1') == '0':
+        return True
+    token = os.getenv('TWILIO_AUTH_TOKEN')
+    if not token:
+        return False
+    if _validator is None:
+        from twilio.request_validator import RequestValidator
+        _validator = RequestValidator(token)
+    url = request.url
+    base_url = os.getenv('PUBLIC_BASE_URL')
+    if base_url:
+        url = base_url.rstrip('/') + request.full_path.rstrip('?')
+    return _validator.validate(url, request.form, request.headers.get('X-Twilio-Signature', ''))
+
+
+def unavailable(message):
+    response = jsonify(message=message)
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@bp.route('/api/telephony/statusCallback', methods=['POST'])
+def status_callback():
+    call_id = request.args.get('call_id', type=int)
+    provider_status = request.form.get('CallStatus')
+    if not call_id or provider_status not in Calls.PROVIDER_STATUSES:
+        return jsonify(message='call_id and a known CallStatus are required'), 400
+    if not signature_valid():
+        return jsonify(message='Invalid signature'), 403
+
+    sequence = request.form.get('SequenceNumber')
+    if sequence is not None and sequence.isdigit():
+        seq = int(sequence)
+    else:
+        # Without a sequence number, order by how far the call progressed
+        seq = STATUS_RANK.get(provider_status, len(STATUS_RANK))
+
+    try:
+        batch = get_status_buffer().submit((call_id, provider_status, seq))
+    except BufferFull:
+        return unavailable('Status buffer is full')
+    # Acknowledged only once committed; otherwise the provider retries
+    if not batch.done.wait(WAIT_TIMEOUT) or batch.error is not None:
+        return unavailable('Status could not be recorded')
+    return '', 204
@@ -1,6 +1,13 @@
-from app.models import Users, UserCallData, Calls
+from app.models import Users, UserCallData, Calls, CallStats, CallTurns, Jobs
+from app import jobs
+from app.ingest import JOB_TYPE as UPLOAD_JOB_TYPE, detect_format, run_upload_job, spool_upload
+from app.export import FORMATS, stream_rows
+from app.realtime import campaign_stream
+from app.scheduler import WINDOW_TIME, valid_timezone
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, parse_flag, parse_limit
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, session, make_response
+from datetime import date
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, session, make_response, Response, stream_with_context
 from functools import wraps
 
 
@@ -41,7 +48,7 @@ def user_login():
     
     user = Users.get_by_username(username)
     
-    if not user or not check_password_hash(user['user_password'], password):
+    if not user or not check_password_hash(user['password'], password):
         return jsonify(message='Invalid credentials'), 401
     
     session['user_id'] = user['id']
@@ -113,6 +120,58 @@ def update_dataset():
     UserCallData.update_dataset(user_id, dataset)
     return jsonify(message='Dataset updated successfully'), 200
 
+@bp.route('/api/user/updateCallingHours', methods=['POST', 'OPTIONS'])
+@user_required
+@no_cache
+def update_calling_hours():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    data = request.get_json() or {}
+    user_id = session.get('user_id')
+    window_start = data.get('call_window_start') or None
+    window_end = data.get('call_window_end') or None
+    timezone = data.get('timezone') or 'UTC'
+
+    if not user_id:
+        return jsonify(message='User ID is required'), 400
+    # Both ends or neither; no window means calls may go out at any hour
+    if (window_start is None) != (window_end is None):
+        return jsonify(message='call_window_start and call_window_end must be given together'), 400
+    if window_start is not None and not (WINDOW_TIME.match(str(window_start)) and WINDOW_TIME.match(str(window_end))):
+        return jsonify(message='Calling hours must be HH:MM'), 400
+    if not valid_timezone(timezone):
+        return jsonify(message='Unknown timezone'), 400
+
+    UserCallData.update_calling_hours(user_id, window_start, window_end, timezone)
+    return jsonify(message='Calling hours updated successfully'), 200
+
+def calls_page(user_id, filter_type, cursor, limit, include_text, include_archived=False, key='calls', empty_message='No calls found'):
+    if filter_type != 'all' and filter_type not in Calls.CALLBACK_STATUSES:
+        return jsonify(message='Invalid filter type'), 400
+    try:
+        after = decode_cursor(cursor)
+    except InvalidCursor:
+        return jsonify(message='Invalid cursor; restart from the first page'), 400
+    try:
+        limit = parse_limit(limit)
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    
+    calls, next_after = Calls.get_calls_page(
+        user_id,
+        filter_type=filter_type,
+        after=after,
+        limit=limit,
+        include_text=parse_flag(include_text),
+        include_archived=parse_flag(include_archived)
+    )
+    if not calls and after is None:
+        return jsonify(message=empty_message), 404
+    
+    next_cursor = encode_cursor(*next_after) if next_after else None
+    return jsonify(**{key: calls, 'next_cursor': next_cursor}), 200
+
 @bp.route('/api/user/viewCallHistory', methods=['GET', 'OPTIONS'])
 @user_required
 @no_cache
@@ -125,11 +184,15 @@ def view_call_history():
     if not user_id:
         return jsonify(message='User ID is required'), 400
     
-    calls = Calls.get_by_user_id(user_id,"all")
-    if not calls:
-        return jsonify(message='No call history found for this user'), 404
-    
-    return jsonify(calls=[call.to_dict() for call in calls]), 200
+    return calls_page(
+        user_id,
+        'all',
+        request.args.get('cursor'),
+        request.args.get('limit'),
+        request.args.get('include_text', False),
+        request.args.get('include_archived', False),
+        empty_message='No call history found for this user'
+    )
 
 @bp.route('/api/user/getCallsByFilter', methods=['POST', 'OPTIONS'])
 @user_required
@@ -145,10 +208,66 @@ def get_calls_by_filter():
     # filter_type = request.args.get('filter_type')
     if not user_id or not filter_type:
         return jsonify(message='User ID and filter type are required'), 400
-    calls = Calls.filter_calls(user_id, filter_type)
-    if not calls:
-        return jsonify(message='No calls found for this user with the specified filter'), 404
-    return jsonify(calls=[call.to_dict() for call in calls]), 200
+    return calls_page(
+        user_id,
+        filter_type,
+        data.get('cursor'),
+        data.get('limit'),
+        data.get('include_text', False),
+        data.get('include_archived', False),
+        empty_message='No calls found for this user with the specified filter'
+    )
+
+
+@bp.route('/api/user/exportCalls', methods=['GET', 'OPTIONS'])
+@user_required
+@no_cache
+def export_calls():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+    
+    user_id = session.get('user_id')
+    export_format = request.args.get('format', 'ndjson')
+    filter_type = request.args.get('filter_type', 'all')
+    compress = parse_flag(request.args.get('gzip', False))
+    include_text = parse_flag(request.args.get('include_text', True))
+    if not user_id:
+        return jsonify(message='User ID is required'), 400
+    if export_format not in FORMATS:
+        return jsonify(message='Format must be ndjson or csv'), 400
+    if filter_type != 'all' and filter_type not in Calls.CALLBACK_STATUSES:
+        return jsonify(message='Invalid filter type'), 400
+    
+    columns = Calls.LIST_COLUMNS + (Calls.TEXT_COLUMNS if include_text else ())
+    rows = Calls.iter_calls(user_id, filter_type=filter_type, include_text=include_text)
+    mimetype, extension = FORMATS[export_format]
+    filename = 'calls.' + extension
+    if compress:
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(
+        stream_with_context(stream_rows(rows, export_format, columns, compress=compress)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': 'attachment; filename=' + filename}
+    )
+
+
+@bp.route('/api/user/getCallTranscript', methods=['GET', 'OPTIONS'])
+@user_required
+@no_cache
+def get_call_transcript():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+    
+    user_id = session.get('user_id')
+    call_id = request.args.get('call_id', type=int)
+    if not user_id or not call_id:
+        return jsonify(message='User ID and call ID are required'), 400
+    
+    turns = CallTurns.get_transcript(call_id, user_id)
+    if turns is None:
+        return jsonify(message='Call not found'), 404
+    return jsonify(call_id=call_id, turns=turns), 200
 
 
 @bp.route('/api/user/uploadClientData', methods=['POST', 'OPTIONS'])
@@ -169,6 +288,9 @@ def upload_client_data():
     if not user_id or not client_data:
         return jsonify(message='User ID and client data are required'), 400
 
+    if call_type not in ('1way', '2way'):
+        return jsonify(message='Call type must be 1way or 2way'), 400
+
     if not isinstance(client_data, list):
         return jsonify(message='Client data must be a list of dictionaries'), 400
 
@@ -182,7 +304,7 @@ def upload_client_data():
             user_id,                   # user_id
             client['name'],          # receiver_name
             client['phone'],           # receiver_phone
-            '1way',                # call_type (default value or change as needed)
+            call_type,                 # call_type
             '',                        # conversation_history (empty initially)
             ai_transmission_message,   # ai_transmission_message (empty initially)
             'no',                 # callback_status (default)
@@ -197,6 +319,168 @@ def upload_client_data():
         return jsonify(message='Failed to upload client data', error=str(e)), 500
     
     
+@bp.route('/api/user/uploadClientFile', methods=['POST', 'OPTIONS'])
+@user_required
+@no_cache
+def upload_client_file():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    user_id = session.get('user_id')
+    upload = request.files.get('file')
+    call_type = request.form.get('call_type', '1way')
+    ai_transmission_message = request.form.get('ai_transmission_message', '')
+
+    if not user_id or not upload:
+        return jsonify(message='User ID and a CSV or NDJSON file are required'), 400
+
+    upload_format = detect_format(upload.filename, request.form.get('format'))
+    if not upload_format:
+        return jsonify(message='File format must be csv or ndjson'), 400
+    if call_type not in ('1way', '2way'):
+        return jsonify(message='Call type must be 1way or 2way'), 400
+
+    state = {
+        'file': spool_upload(upload),
+        'format': upload_format,
+        'call_type': call_type,
+        'ai_transmission_message': ai_transmission_message
+    }
+    job_id = Jobs.create_job(UPLOAD_JOB_TYPE, user_id=user_id, state=state)
+    jobs.submit(run_upload_job, job_id, user_id, state)
+    return jsonify(message='Upload accepted', job_id=job_id), 202
+
+
+@bp.route('/api/user/uploadJobStatus', methods=['GET', 'OPTIONS'])
+@user_required
+@no_cache
+def upload_job_status():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    user_id = session.get('user_id')
+    job_id = request.args.get('job_id')
+    if not user_id or not job_id:
+        return jsonify(message='User ID and job ID are required'), 400
+
+    job = Jobs.get_job(job_id, user_id=user_id)
+    if not job:
+        return jsonify(message='Job not found'), 404
+    job.pop('state', None)
+    return jsonify(job=job), 200
+
+
+@bp.route('/api/user/realtimeStream', methods=['GET', 'OPTIONS'])
+@user_required
+def realtime_stream():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    # Server-Sent Events; each open stream parks a greenlet, so run the web
+    # tier with gevent workers (gunicorn -k gevent).
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify(message='User ID is required'), 400
+
+    return Response(
+        stream_with_context(campaign_stream(user_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@bp.route('/api/user/callStats', methods=['GET', 'OPTIONS'])
+@user_required
+@no_cache
+def call_stats():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify(message='User ID is required'), 400
+    try:
+        start_date = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end_date = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify(message='Dates must be YYYY-MM-DD'), 400
+
+    stats = CallStats.get_summary(
+        user_id,
+        start_date=start_date,
+        end_date=end_date,
+        by_day=parse_flag(request.args.get('by_day', False))
+    )
+    return jsonify(stats=stats), 200
+
+
+BULK_UPDATE_LIMIT = 5000
+
+
+@bp.route('/api/user/bulkUpdateCallStatus', methods=['POST', 'OPTIONS'])
+@user_required
+@no_cache
+def bulk_update_call_status():
+    if request.method == 'OPTIONS':
+        return jsonify(message='CORS preflight response'), 200
+
+    user_id = session.get('user_id')
+    data = request.get_json() or {}
+    if not user_id:
+        return jsonify(message='User ID is required'), 400
+
+    # Either explicit updates: {"updates": [{"call_id", "callback_status", "call_done"}]}
+    # or a predicate: {"filter": {"callback_status", "call_type", "from", "to"}, "callback_status", "call_done"}
+    updates = data.get('updates')
+    if updates is not None:
+        if not isinstance(updates, list) or not updates:
+            return jsonify(message='Updates must be a non-empty list'), 400
+        if len(updates) > BULK_UPDATE_LIMIT:
+            return jsonify(message='At most %d updates per request' % BULK_UPDATE_LIMIT), 400
+        results = {}
+        valid = []
+        for update in updates:
+            call_id = update.get('call_id') if isinstance(update, dict) else None
+            if not isinstance(call_id, int) or isinstance(call_id, bool):
+                return jsonify(message='Each update needs an integer call_id'), 400
+            if update.get('callback_status') not in Calls.CALLBACK_STATUSES or update.get('call_done') not in (0, 1, True, False):
+                results[call_id] = 'invalid'
+                continue
+            valid.append((call_id, update['callback_status'], update['call_done']))
+        results.update(Calls.update_call_statuses(user_id, valid))
+        updated = sum(1 for result in results.values() if result == 'updated')
+        return jsonify(updated=updated, results={str(call_id): result for call_id, result in results.items()}), 200
+
+    predicate = data.get('filter')
+    callback_status = data.get('callback_status')
+    call_done = data.get('call_done')
+    if not isinstance(predicate, dict):
+        return jsonify(message='Either updates or filter is required'), 400
+    if callback_status not in Calls.CALLBACK_STATUSES or call_done not in (0, 1, True, False):
+        return jsonify(message='A valid callback_status and call_done are required'), 400
+    filter_status = predicate.get('callback_status')
+    call_type = predicate.get('call_type')
+    if filter_status is not None and filter_status not in Calls.CALLBACK_STATUSES:
+        return jsonify(message='Invalid filter callback_status'), 400
+    if call_type is not None and call_type not in ('1way', '2way'):
+        return jsonify(message='Invalid filter call_type'), 400
+    try:
+        start_date = date.fromisoformat(predicate['from']) if predicate.get('from') else None
+        end_date = date.fromisoformat(predicate['to']) if predicate.get('to') else None
+    except (TypeError, ValueError):
+        return jsonify(message='Dates must be YYYY-MM-DD'), 400
+
+    call_ids = Calls.update_call_statuses_where(
+        user_id, callback_status, call_done,
+        filter_status=filter_status,
+        call_type=call_type,
+        start_date=start_date,
+        end_date=end_date,
+        max_rows=BULK_UPDATE_LIMIT
+    )
+    return jsonify(updated=len(call_ids), call_ids=call_ids, truncated=len(call_ids) >= BULK_UPDATE_LIMIT), 200
+
+
 @bp.route('/api/user/viewRealtimeSnapshot', methods=['POST', 'OPTIONS'])
 @user_required
 @no_cache
@@ -207,13 +491,17 @@ def view_realtime_snapshot():
     # user_id = request.args.get('user_id')
     user_id = session.get('user_id')
     data = request.get_json()
-    filter_type = data.get('filter_type') 
+    filter_type = data.get('filter_type') or 'all'
     # filter_type = request.args.get('filter_type', 'all')
     if not user_id:
         return jsonify(message='User ID is required'), 400
     
-    snapshot = Calls.filter_calls(user_id)
-    if not snapshot:
-        return jsonify(message='No realtime snapshot found for this user'), 404
-    
-    return jsonify(snapshot=snapshot), 200
+    return calls_page(
+        user_id,
+        filter_type,
+        data.get('cursor'),
+        data.get('limit'),
+        data.get('include_text', False),
+        key='snapshot',
+        empty_message='No realtime snapshot found for this user'
+    )
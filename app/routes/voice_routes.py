@@ -0,0 +1,54 @@
+import base64
+import json
+import logging
+from flask import Blueprint
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+from app.models import Calls
+from app.voice import TwilioMediaTransport, create_engine, verify_stream_token
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('voice_routes', __name__)
+sock = Sock()
+
+
+def start_engine(message, ws):
+    start = message.get('start') or {}
+    parameters = start.get('customParameters') or {}
+    call_id = parameters.get('call_id')
+    if not call_id or not str(call_id).isdigit() or not verify_stream_token(call_id, parameters.get('token')):
+        return None
+    call = Calls.get_call(int(call_id))
+    if call is None or call['call_type'] != '2way':
+        return None
+    engine = create_engine(call, TwilioMediaTransport(ws, start.get('streamSid') or message.get('streamSid')))
+    engine.start()
+    return engine
+
+
+@sock.route('/media/stream', bp=bp)
+def media_stream(ws):
+    # Twilio Media Streams: 8 kHz mu-law frames in, synthesized replies out
+    engine = None
+    try:
+        while True:
+            message = json.loads(ws.receive())
+            event = message.get('event')
+            if event == 'start':
+                engine = start_engine(message, ws)
+                if engine is None:
+                    logger.warning('Rejected media stream %s', message.get('streamSid'))
+                    return
+            elif event == 'media' and engine is not None:
+                if message['media'].get('track', 'inbound') == 'inbound':
+                    engine.feed(base64.b64decode(message['media']['payload']))
+            elif event == 'mark' and engine is not None:
+                engine.on_mark(message['mark']['name'])
+            elif event == 'stop':
+                return
+    except ConnectionClosed:
+        pass
+    finally:
+        if engine is not None:
+            engine.stop()
@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+WINDOW_TIME = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+# Where a tenant sits while it is not in the run queue
+IDLE, ACTIVE, WAITING, BLOCKED = 'idle', 'active', 'waiting', 'blocked'
+
+_zones = {}
+
+
+def get_zone(name):
+    zone = _zones.get(name)
+    if zone is None:
+        try:
+            zone = ZoneInfo(name) if name else dt_timezone.utc
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning('Unknown timezone %r; using UTC', name)
+            zone = dt_timezone.utc
+        _zones[name] = zone
+    return zone
+
+
+def valid_timezone(name):
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def minute_of_day(value):
+    # MySQL TIME columns come back as timedelta; "HH:MM" strings are accepted too
+    if value is None or value == '':
+        return None
+    if isinstance(value, timedelta):
+        return int(value.total_seconds() // 60) % MINUTES_PER_DAY
+    if hasattr(value, 'hour'):
+        return value.hour * 60 + value.minute
+    hours, _, minutes = str(value).partition(':')
+    return (int(hours) * 60 + int(minutes[:2] or 0)) % MINUTES_PER_DAY
+
+
+def seconds_until_open(window_start, window_end, zone, now):
+    # 0 when inside the window [start, end) in the tenant's local time,
+    # otherwise seconds until it next opens. A window with start > end spans
+    # midnight; no window means calls are allowed at any time.
+    if window_start is None or window_end is None or window_start == window_end:
+        return 0.0
+    local = datetime.fromtimestamp(now, zone)
+    minute = local.hour * 60 + local.minute
+    if window_start < window_end:
+        inside = window_start <= minute < window_end
+    else:
+        inside = minute >= window_start or minute < window_end
+    if inside:
+        return 0.0
+    wait_minutes = (window_start - minute) % MINUTES_PER_DAY
+    return max(1.0, wait_minutes * 60 - local.second)
+
+
+class Tenant:
+    __slots__ = ('user_id', 'weight', 'concurrency', 'window_start', 'window_end', 'zone',
+                 'pending', 'in_flight', 'credits', 'last_finish', 'state', 'entry')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.weight = 1.0
+        self.concurrency = None
+        self.window_start = None
+        self.window_end = None
+        self.zone = dt_timezone.utc
+        self.pending = 0
+        self.in_flight = 0
+        self.credits = 0
+        self.last_finish = 0.0
+        self.state = IDLE
+        # Identity of this tenant's live heap entry; older entries are skipped
+        self.entry = None
+
+
+class FairScheduler:
+    # Weighted fair queuing across tenants (start-time fair queuing: virtual
+    # time is the start tag of the call last granted). Each granted call advances the tenant's tag by
+    # 1 / weight, so backlogged tenants get calls in proportion to their weight
+    # however many rows they have pending. Tenants outside their calling
+    # window wait in a heap keyed by when it opens; tenants at their
+    # concurrency limit or out of credit are parked until a release or
+    # refresh. Every decision is a constant number of heap operations.
+    def __init__(self, credits_per_call=1, default_concurrency=None, clock=time.time):
+        self.credits_per_call = credits_per_call
+        self.default_concurrency = default_concurrency
+        self.clock = clock
+        self.virtual_time = 0.0
+        self.tenants = {}
+        self._active = []
+        self._waiting = []
+        self._entries = itertools.count()
+        self.stats = {'granted': 0, 'window_waits': 0, 'concurrency_blocks': 0, 'credit_blocks': 0}
+
+    def _push_active(self, tenant):
+        start = max(self.virtual_time, tenant.last_finish)
+        tenant.entry = next(self._entries)
+        tenant.state = ACTIVE
+        heapq.heappush(self._active, (start + 1.0 / tenant.weight, tenant.entry, tenant.user_id))
+
+    def _push_waiting(self, tenant, wake_at):
+        tenant.entry = next(self._entries)
+        tenant.state = WAITING
+        heapq.heappush(self._waiting, (wake_at, tenant.entry, tenant.user_id))
+        self.stats['window_waits'] += 1
+
+    def _blocked_reason(self, tenant):
+        limit = tenant.concurrency if tenant.concurrency is not None else self.default_concurrency
+        if limit is not None and tenant.in_flight >= limit:
+            return 'concurrency_blocks'
+        if self.credits_per_call and tenant.credits < self.credits_per_call:
+            return 'credit_blocks'
+        return None
+
+    def _place(self, tenant, now):
+        # Puts a tenant that is in neither heap where it belongs
+        if tenant.pending <= 0:
+            tenant.state = IDLE
+            tenant.entry = None
+            return
+        reason = self._blocked_reason(tenant)
+        if reason is not None:
+            tenant.state = BLOCKED
+            tenant.entry = None
+            self.stats[reason] += 1
+            return
+        wait = seconds_until_open(tenant.window_start, tenant.window_end, tenant.zone, now)
+        if wait:
+            self._push_waiting(tenant, now + wait)
+        else:
+            self._push_active(tenant)
+
+    def update(self, user_id, pending, in_flight=0, credits=0, weight=1, concurrency=None,
+               window_start=None, window_end=None, timezone='UTC', now=None):
+        tenant = self.tenants.get(user_id)
+        if tenant is None:
+            tenant = self.tenants[user_id] = Tenant(user_id)
+        tenant.pending = pending
+        tenant.in_flight = in_flight
+        tenant.credits = credits
+        tenant.weight = float(weight) if weight and weight > 0 else 1.0
+        tenant.concurrency = concurrency
+        tenant.window_start = minute_of_day(window_start)
+        tenant.window_end = minute_of_day(window_end)
+        tenant.zone = get_zone(timezone or 'UTC')
+        # Re-file the tenant; any entry it already had goes stale
+        tenant.entry = None
+        self._place(tenant, self.clock() if now is None else now)
+
+    def refresh(self, rows, now=None):
+        # Replaces the whole picture with a fresh backlog snapshot; tenants
+        # without pending work are forgotten.
+        now = self.clock() if now is None else now
+        seen = set()
+        for row in rows:
+            seen.add(row['user_id'])
+            self.update(
+                row['user_id'], row['pending'], in_flight=row['in_flight'], credits=row['credits'],
+                weight=row['call_weight'], concurrency=row['max_concurrent_calls'],
+                window_start=row['call_window_start'], window_end=row['call_window_end'],
+                timezone=row['timezone'], now=now
+            )
+        for user_id in [user_id for user_id in self.tenants if user_id not in seen]:
+            tenant = self.tenants.pop(user_id)
+            tenant.entry = None
+        if len(self._active) > 2 * len(self.tenants) + 64:
+            self._compact()
+
+    def _compact(self):
+        # Drops stale heap entries left behind by updates
+        self._active = [item for item in self._active if self._live(item)]
+        heapq.heapify(self._active)
+        self._waiting = [item for item in self._waiting if self._live(item)]
+        heapq.heapify(self._waiting)
+
+    def _live(self, item):
+        tenant = self.tenants.get(item[2])
+        return tenant is not None and tenant.entry == item[1]
+
+    def _wake(self, now):
+        while self._waiting and self._waiting[0][0] <= now:
+            item = heapq.heappop(self._waiting)
+            if self._live(item):
+                tenant = self.tenants[item[2]]
+                tenant.entry = None
+                self._place(tenant, now)
+
+    def next_batch(self, limit, now=None):
+        # Returns {user_id: calls to claim}, at most `limit` calls in total
+        now = self.clock() if now is None else now
+        self._wake(now)
+        plan = {}
+        granted = 0
+        while granted < limit and self._active:
+            item = heapq.heappop(self._active)
+            if not self._live(item):
+                continue
+            finish, _, user_id = item
+            tenant = self.tenants[user_id]
+            tenant.entry = None
+            # Window may have closed while the tenant sat in the run queue
+            wait = seconds_until_open(tenant.window_start, tenant.window_end, tenant.zone, now)
+            if wait:
+                self._push_waiting(tenant, now + wait)
+                continue
+            self.virtual_time = max(self.virtual_time, finish - 1.0 / tenant.weight)
+            tenant.last_finish = finish
+            tenant.pending -= 1
+            tenant.in_flight += 1
+            tenant.credits -= self.credits_per_call
+            plan[user_id] = plan.get(user_id, 0) + 1
+            granted += 1
+            self._place(tenant, now)
+        self.stats['granted'] += granted
+        return plan
+
+    def release(self, user_id, count=1, refund=False):
+        # A call left the tenant's in-flight set (finished, deferred or
+        # returned unclaimed); refund gives back the credit it was planned with.
+        tenant = self.tenants.get(user_id)
+        if tenant is None:
+            return
+        tenant.in_flight = max(0, tenant.in_flight - count)
+        if refund:
+            tenant.credits += count * self.credits_per_call
+        if tenant.state == BLOCKED:
+            self._place(tenant, self.clock())
+
+    def shortfall(self, user_id, count):
+        # Fewer rows were claimable than planned: the backlog estimate was
+        # stale, so the tenant sits out until the next refresh.
+        tenant = self.tenants.get(user_id)
+        if tenant is None:
+            return
+        tenant.in_flight = max(0, tenant.in_flight - count)
+        tenant.credits += count * self.credits_per_call
+        tenant.pending = 0
+        self._replace(tenant)
+
+    def exhaust_credits(self, user_id):
+        tenant = self.tenants.get(user_id)
+        if tenant is None:
+            return
+        tenant.credits = 0
+        self._replace(tenant)
+
+    def _replace(self, tenant):
+        # Drops whatever entry the tenant has in either heap and files it again
+        tenant.entry = None
+        self._place(tenant, self.clock())
+
+    def snapshot(self):
+        states = {}
+        for tenant in self.tenants.values():
+            states[tenant.state] = states.get(tenant.state, 0) + 1
+        data = dict(self.stats)
+        data.update(tenants=len(self.tenants), states=states, virtual_time=round(self.virtual_time, 3))
+        return data
@@ -0,0 +1,93 @@
+import os
+import time
+
+# Twilio media streams carry 8 kHz mu-law audio in 20 ms frames
+SAMPLE_RATE = 8000
+FRAME_BYTES = 160
+
+
+class RecognitionResult:
+    __slots__ = ('text', 'is_final', 'stability', 'received_at')
+
+    def __init__(self, text, is_final, stability=0.0, received_at=None):
+        self.text = text
+        self.is_final = is_final
+        self.stability = stability
+        self.received_at = received_at or time.monotonic()
+
+
+class Recognizer:
+    def stream(self, frames):
+        # frames: iterator of raw audio frames, exhausted when the call ends.
+        # Yields interim and final RecognitionResults.
+        raise NotImplementedError
+
+
+class GoogleStreamingRecognizer(Recognizer):
+    # Google caps one streaming request at about five minutes, so the stream
+    # is reopened for as long as the call keeps sending audio.
+    def __init__(self, language_code='en-US', model='phone_call'):
+        from google.cloud import speech
+        self.speech = speech
+        self.client = speech.SpeechClient()
+        self.config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.MULAW,
+                sample_rate_hertz=SAMPLE_RATE,
+                language_code=language_code,
+                model=model,
+                use_enhanced=True,
+            ),
+            interim_results=True,
+        )
+
+    def stream(self, frames):
+        frames = iter(frames)
+        state = {'ended': False}
+
+        def requests():
+            for frame in frames:
+                yield self.speech.StreamingRecognizeRequest(audio_content=frame)
+            state['ended'] = True
+
+        while not state['ended']:
+            try:
+                for response in self.client.streaming_recognize(self.config, requests()):
+                    for result in response.results:
+                        if result.alternatives:
+                            yield RecognitionResult(result.alternatives[0].transcript, result.is_final, result.stability)
+            except Exception as e:
+                if 'OutOfRange' not in type(e).__name__ and 'exceeded' not in str(e).lower():
+                    raise
+
+
+class ScriptedRecognizer(Recognizer):
+    # Local stand-in driven by recorded audio: emits the scripted
+    # (frame_index, text, is_final, stability) results as the frames go by,
+    # so timing follows the audio exactly as a real recognizer would.
+    def __init__(self, script):
+        self.script = sorted(script, key=lambda item: item[0])
+
+    def stream(self, frames):
+        position = 0
+        for index, _ in enumerate(frames, 1):
+            while position < len(self.script) and self.script[position][0] <= index:
+                _, text, is_final, stability = self.script[position]
+                position += 1
+                yield RecognitionResult(text, is_final, stability)
+
+
+def read_frames(path, frame_bytes=FRAME_BYTES):
+    # Recorded mu-law audio, e.g. a media stream captured from a test call
+    with open(path, 'rb') as handle:
+        while True:
+            frame = handle.read(frame_bytes)
+            if not frame:
+                break
+            yield frame
+
+
+def get_recognizer():
+    if os.getenv('SPEECH_BACKEND', 'google') == 'stub':
+        return ScriptedRecognizer([])
+    return GoogleStreamingRecognizer(language_code=os.getenv('SPEECH_LANGUAGE', 'en-US'))
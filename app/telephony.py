@@ -0,0 +1,103 @@
+import os
+import random
+import threading
+import time
+import uuid
+from xml.sax.saxutils import escape
+
+
+class TelephonyError(Exception):
+    pass
+
+
+class TransientTelephonyError(TelephonyError):
+    # Rate limited / provider unavailable: the call should be retried later
+    pass
+
+
+class TelephonyClient:
+    def place_call(self, call):
+        raise NotImplementedError
+
+
+class TwilioTelephonyClient(TelephonyClient):
+    def __init__(self, account_sid, auth_token):
+        from twilio.rest import Client
+        self.client = Client(account_sid, auth_token)
+
+    def twiml_for(self, call):
+        # Play pre-synthesized audio when it is cached and reachable; fall back
+        # to Twilio's own <Say> otherwise.
+        message = call.get('ai_transmission_message') or ''
+        base_url = os.getenv('PUBLIC_BASE_URL')
+        if base_url and call.get('call_type') == '2way':
+            # Two-way calls are bridged to the streaming conversation engine
+            from app.voice import stream_token
+            stream_url = 'wss://%s/media/stream' % base_url.split('://', 1)[-1].rstrip('/')
+            return (
+                '<Response><Connect><Stream url="%s">'
+                '<Parameter name="call_id" value="%d"/><Parameter name="token" value="%s"/>'
+                '</Stream></Connect></Response>'
+            ) % (escape(stream_url), call['id'], stream_token(call['id']))
+        if base_url and message.strip():
+            from app.tts import get_tts
+            key, extension, path = get_tts().lookup(message)
+            if path:
+                return '<Response><Play>%s/media/tts/%s.%s</Play></Response>' % (
+                    escape(base_url.rstrip('/')), key, extension)
+        return '<Response><Say>%s</Say></Response>' % escape(message)
+
+    def place_call(self, call):
+        from twilio.base.exceptions import TwilioRestException
+        try:
+            options = {}
+            base_url = os.getenv('PUBLIC_BASE_URL')
+            if base_url:
+                # Progress is reported to the buffered status webhook
+                options['status_callback'] = '%s/api/telephony/statusCallback?call_id=%d' % (base_url.rstrip('/'), call['id'])
+                options['status_callback_event'] = ['initiated', 'ringing', 'answered', 'completed']
+                options['status_callback_method'] = 'POST'
+            created = self.client.calls.create(
+                to=call['receiver_phone'],
+                from_=call['twilio_phone_number'],
+                twiml=self.twiml_for(call),
+                **options
+            )
+        except TwilioRestException as e:
+            if e.status == 429 or e.status >= 500:
+                raise TransientTelephonyError(str(e))
+            raise TelephonyError(str(e))
+        return {'sid': created.sid, 'status': created.status}
+
+
+class FakeTelephonyClient(TelephonyClient):
+    # Local stand-in for tests and load runs: sleeps for a provider-like latency
+    # and fails a configurable fraction of calls.
+    def __init__(self, latency=0.05, failure_rate=0.0, transient_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.transient_rate = transient_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.placed = []
+
+    def place_call(self, call):
+        time.sleep(self.latency)
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.transient_rate:
+                raise TransientTelephonyError('Simulated rate limit')
+            if roll < self.transient_rate + self.failure_rate:
+                raise TelephonyError('Simulated failure')
+            self.placed.append((time.monotonic(), call['twilio_phone_number'], call['id']))
+        return {'sid': 'FAKE' + uuid.uuid4().hex, 'status': 'queued'}
+
+
+def get_telephony_client():
+    backend = os.getenv('TELEPHONY_BACKEND', 'twilio')
+    if backend == 'fake':
+        return FakeTelephonyClient(
+            latency=float(os.getenv('FAKE_TELEPHONY_LATENCY', 0.05)),
+            failure_rate=float(os.getenv('FAKE_TELEPHONY_FAILURE_RATE', 0))
+        )
+    return TwilioTelephonyClient(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
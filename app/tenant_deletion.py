@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+
+from app import jobs
+from app.archive import archive_root
+from app.models import CallArchives, Calls, CallStats, CreditReservations, Credits, Jobs, UserCallData, Users
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE = 'delete_user'
+BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 1000))
+# Sleep this multiple of each batch's duration so deletion uses at most
+# 1 / (1 + ratio) of a connection's time and other tenants' writes interleave.
+THROTTLE_RATIO = float(os.getenv('DELETE_THROTTLE_RATIO', 1.0))
+STALE_SECONDS = int(os.getenv('DELETE_STALE_SECONDS', 300))
+
+# user_call_data goes first so the dispatcher stops claiming the tenant's
+# calls; the users row goes last so the job can be retried until it is done.
+PHASES = ('call_data', 'calls', 'archives', 'stats', 'reservations', 'credits', 'user')
+
+
+def _remove_archive_files(paths):
+    root = archive_root()
+    for path in paths:
+        try:
+            os.remove(os.path.join(root, path))
+        except OSError:
+            pass
+    return len(paths)
+
+
+def _delete_step(phase, user_id, batch_size):
+    # Returns the number of rows removed; 0 means the phase is finished
+    if phase == 'call_data':
+        UserCallData.delete_user_call_data(user_id)
+        return 0
+    if phase == 'calls':
+        return Calls.delete_batch(user_id, limit=batch_size)
+    if phase == 'archives':
+        return _remove_archive_files(CallArchives.delete_batch(user_id, limit=max(1, batch_size // 10)))
+    if phase == 'stats':
+        return CallStats.delete_batch(user_id, limit=batch_size)
+    if phase == 'reservations':
+        return CreditReservations.delete_batch(user_id, limit=batch_size)
+    if phase == 'credits':
+        Credits.delete_credits(user_id)
+        return 0
+    Users.delete_user(user_id)
+    return 0
+
+
+def run_deletion(job_id, user_id, state=None, processed=0, batch_size=BATCH_SIZE, throttle_ratio=THROTTLE_RATIO):
+    # Every step is idempotent and the current phase is saved after each
+    # batch, so a job resumed after a crash continues where it stopped.
+    if not Jobs.claim_job(job_id):
+        return
+    state = dict(state or {})
+    deleted = dict(state.get('deleted') or {})
+    try:
+        start = PHASES.index(state.get('phase', PHASES[0]))
+        for phase in PHASES[start:]:
+            state['phase'] = phase
+            while True:
+                started = time.monotonic()
+                removed = _delete_step(phase, user_id, batch_size)
+                processed += removed
+                deleted[phase] = deleted.get(phase, 0) + removed
+                state['deleted'] = deleted
+                Jobs.update_progress(job_id, processed, processed, 0, state=state)
+                if not removed:
+                    break
+                if throttle_ratio:
+                    time.sleep((time.monotonic() - started) * throttle_ratio)
+        Jobs.update_progress(job_id, processed, processed, 0, state=state, status='done')
+    except Exception as e:
+        logger.exception('Deletion of user %s failed in phase %s', user_id, state.get('phase'))
+        Jobs.update_progress(job_id, processed, processed, 0, state=state, status='failed')
+        Jobs.finish_job(job_id, 'failed', str(e))
+
+
+def start_deletion(user_id):
+    # Returns the job id; asking twice for the same tenant reuses the running
+    # job, and asking after a failure retries it from the phase it reached.
+    job = Jobs.find_active(JOB_TYPE, user_id, statuses=('queued', 'running', 'failed'))
+    if job:
+        if job['status'] == 'failed' and Jobs.requeue_job(job['id']):
+            jobs.submit(run_deletion, job['id'], user_id, job['state'], job['processed_rows'] or 0)
+        return job['id']
+    job_id = Jobs.create_job(JOB_TYPE, user_id=user_id, state={'phase': PHASES[0]})
+    jobs.submit(run_deletion, job_id, user_id)
+    return job_id
+
+
+def resume_stalled(stale_seconds=STALE_SECONDS, wait=False):
+    resumed = []
+    # Failed jobs are retried too: every step is idempotent, and a tenant left
+    # half deleted (e.g. without credits) cannot be deleted again from the API.
+    for job in Jobs.claim_stalled(JOB_TYPE, stale_seconds, statuses=('queued', 'running', 'failed')):
+        logger.info('Resuming deletion job %s for user %s', job['id'], job['user_id'])
+        args = (job['id'], job['user_id'], job['state'], job['processed_rows'] or 0)
+        if wait:
+            run_deletion(*args)
+        else:
+            jobs.submit(run_deletion, *args)
+        resumed.append(job['id'])
+    return resumed
+
+
+def start_resumer(interval=60.0, stop_event=None):
+    return jobs.run_periodically(resume_stalled, interval, 'deletion-resumer', stop_event)
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'MP3': 'mp3', 'LINEAR16': 'wav', 'MULAW': 'ulaw', 'OGG_OPUS': 'ogg'}
+MIMETYPES = {'mp3': 'audio/mpeg', 'wav': 'audio/wav', 'ulaw': 'audio/basic', 'ogg': 'audio/ogg'}
+
+
+class Synthesizer:
+    def synthesize(self, text, voice, encoding, sample_rate):
+        raise NotImplementedError
+
+
+class GoogleSynthesizer(Synthesizer):
+    def __init__(self, language_code='en-US'):
+        from google.cloud import texttospeech
+        self.texttospeech = texttospeech
+        self.client = texttospeech.TextToSpeechClient()
+        self.language_code = language_code
+
+    def synthesize(self, text, voice, encoding, sample_rate):
+        tts = self.texttospeech
+        response = self.client.synthesize_speech(
+            input=tts.SynthesisInput(text=text),
+            voice=tts.VoiceSelectionParams(language_code=self.language_code, name=voice or None),
+            audio_config=tts.AudioConfig(
+                audio_encoding=getattr(tts.AudioEncoding, encoding),
+                sample_rate_hertz=sample_rate or None
+            )
+        )
+        return response.audio_content
+
+
+class StubSynthesizer(Synthesizer):
+    # Deterministic offline stand-in: 8 kHz mu-law silence, ~60 ms per character
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def synthesize(self, text, voice, encoding, sample_rate):
+        if self.delay:
+            threading.Event().wait(self.delay)
+        self.calls += 1
+        return b'\xff' * (480 * max(1, len(text)))
+
+
+class AudioCache:
+    # Content-addressed files under root/<2-char prefix>/<sha256>.<ext>. File
+    # mtime doubles as the LRU clock; eviction trims to 90% of max_bytes.
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @staticmethod
+    def key_for(text, voice, encoding, sample_rate):
+        material = json.dumps([text, voice, encoding, sample_rate], ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def path_for(self, key, extension):
+        return os.path.join(self.root, key[:2], key + '.' + extension)
+
+    def _scan(self):
+        entries = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def get(self, key, extension):
+        path = self.path_for(key, extension)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        return path
+
+    def put(self, key, extension, data):
+        path = self.path_for(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(handle, 'wb') as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stats['writes'] += 1
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+        return path
+
+    def evict(self):
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._size = total
+            self.stats['evictions'] += evicted
+
+
+class TTSService:
+    def __init__(self, synthesizer, cache, voice='', encoding='MP3', sample_rate=0):
+        self.synthesizer = synthesizer
+        self.cache = cache
+        self.voice = voice
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _options(self, voice, encoding, sample_rate):
+        return (
+            self.voice if voice is None else voice,
+            encoding or self.encoding,
+            self.sample_rate if sample_rate is None else sample_rate,
+        )
+
+    def lookup(self, text, voice=None, encoding=None, sample_rate=None):
+        voice, encoding, sample_rate = self._options(voice, encoding, sample_rate)
+        key = AudioCache.key_for(text, voice, encoding, sample_rate)
+        extension = EXTENSIONS[encoding]
+        return key, extension, self.cache.get(key, extension)
+
+    def get_audio(self, text, voice=None, encoding=None, sample_rate=None):
+        # Returns (key, path); synthesizes at most once per key per process even
+        # when several calls ask for the same uncached text concurrently.
+        voice, encoding, sample_rate = self._options(voice, encoding, sample_rate)
+        key, extension, path = self.lookup(text, voice, encoding, sample_rate)
+        if path:
+            return key, path
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait()
+            return key, self.cache.get(key, extension)
+        try:
+            audio = self.synthesizer.synthesize(text, voice, encoding, sample_rate)
+            return key, self.cache.put(key, extension, audio)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def presynthesize(self, text, **options):
+        if not text or not text.strip():
+            return None
+        try:
+            return self.get_audio(text, **options)
+        except Exception:
+            logger.exception('Pre-synthesis failed')
+            return None
+
+    def presynthesize_async(self, texts):
+        from app import jobs
+        for text in set(texts):
+            if text and text.strip():
+                jobs.submit(self.presynthesize, text)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def cache_dir():
+    return os.getenv('TTS_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'telecalling-tts')
+
+
+def get_synthesizer():
+    if os.getenv('TTS_BACKEND', 'google') == 'stub':
+        return StubSynthesizer()
+    return GoogleSynthesizer(language_code=os.getenv('TTS_LANGUAGE', 'en-US'))
+
+
+def get_tts():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = TTSService(
+                    get_synthesizer(),
+                    AudioCache(cache_dir(), max_bytes=int(os.getenv('TTS_CACHE_MAX_BYTES', 512 * 1024 * 1024))),
+                    voice=os.getenv('TTS_VOICE', ''),
+                    encoding=os.getenv('TTS_ENCODING', 'MP3'),
+                )
+    return _service
@@ -0,0 +1,435 @@
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from app import metrics
+from app.llm import build_prompt
+from app.speech import FRAME_BYTES, SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+VOICE_TURN_SECONDS = metrics.registry.histogram(
+    'voice_turn_seconds', 'Per-turn latency of two-way calls by stage.', ('stage',))
+VOICE_EVENTS = metrics.registry.counter(
+    'voice_events_total', 'Speculation and barge-in outcomes on two-way calls.', ('event',))
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+NON_WORD = re.compile(r'[^a-z0-9 ]+')
+
+
+def normalize(text):
+    return ' '.join(NON_WORD.sub(' ', (text or '').lower()).split())
+
+
+def iter_sentences(chunks, min_chars=12):
+    # Re-cuts streamed LLM text at sentence boundaries so TTS can start on the
+    # first sentence while the model is still writing the rest.
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            match = SENTENCE_END.search(buffer, min_chars)
+            if not match:
+                break
+            yield buffer[:match.start()].strip()
+            buffer = buffer[match.end():]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def strip_wav_header(audio):
+    if audio[:4] == b'RIFF':
+        data = audio.find(b'data', 12)
+        if data != -1:
+            return audio[data + 8:]
+    return audio
+
+
+def stream_token(call_id):
+    # Passed to the media stream as a parameter so only calls we placed can open one
+    secret = os.getenv('SECRET_KEY', 'default_secret_key').encode()
+    return hmac.new(secret, b'stream:%d' % int(call_id), hashlib.sha256).hexdigest()[:32]
+
+
+def verify_stream_token(call_id, token):
+    return hmac.compare_digest(stream_token(call_id), token or '')
+
+
+class Transport:
+    def send_audio(self, audio):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def mark(self, name):
+        raise NotImplementedError
+
+
+class TwilioMediaTransport(Transport):
+    # Twilio buffers outbound audio and plays it in order; `clear` drops what
+    # has not been played and `mark` is echoed back once playback reaches it.
+    def __init__(self, ws, stream_sid, chunk_bytes=SAMPLE_RATE):
+        self.ws = ws
+        self.stream_sid = stream_sid
+        self.chunk_bytes = chunk_bytes
+        self._lock = threading.Lock()
+
+    def _send(self, message):
+        with self._lock:
+            self.ws.send(json.dumps(message))
+
+    def send_audio(self, audio):
+        for offset in range(0, len(audio), self.chunk_bytes):
+            payload = base64.b64encode(audio[offset:offset + self.chunk_bytes]).decode('ascii')
+            self._send({'event': 'media', 'streamSid': self.stream_sid, 'media': {'payload': payload}})
+
+    def clear(self):
+        self._send({'event': 'clear', 'streamSid': self.stream_sid})
+
+    def mark(self, name):
+        self._send({'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': name}})
+
+
+class Response:
+    # One assistant reply. A speculative reply (started from an interim
+    # transcript) generates and synthesizes into `held` until the final
+    # transcript confirms it; a mismatch cancels it.
+    def __init__(self, engine, question, key, committed_at=None, text=None):
+        self.engine = engine
+        self.id = next(engine._response_ids)
+        self.question = question
+        self.key = key
+        self.fixed_text = text
+        # Taken under the engine lock before the caller's question is added,
+        # so the prompt never carries the question twice and a speculative
+        # reply sees the same history as a non-speculative one.
+        self.history = list(engine.history[-engine.history_turns:])
+        self.speculative = committed_at is None
+        self.cancelled = threading.Event()
+        self.committed_at = committed_at
+        self.started_at = engine.clock()
+        self.finished = False
+        self.held = []
+        self.spoken = []
+        self.first_sentence_at = None
+        self.first_audio_ready_at = None
+        self.first_audio_sent_at = None
+        self.cached = False
+        self.answer_version = None
+
+    @property
+    def committed(self):
+        return self.committed_at is not None
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='voice-response-%d' % self.id, daemon=True)
+        thread.start()
+        return thread
+
+    def sentences(self):
+        if self.fixed_text is not None:
+            return iter_sentences([self.fixed_text])
+        engine = self.engine
+        if engine.answers is not None:
+            answer, self.answer_version = engine.answers.get(self.question)
+            if answer is not None:
+                # A repeated question is answered without the LLM
+                self.cached = True
+                return iter_sentences([answer])
+        context = engine.context(self.question) if engine.context else ''
+        prompt = build_prompt(self.question, context, self.history)
+        return iter_sentences(self.generate(prompt))
+
+    def generate(self, prompt):
+        parts = []
+        for chunk in self.engine.llm.stream(prompt):
+            parts.append(chunk)
+            yield chunk
+        # Only an answer that no earlier caller turn shaped is reusable by
+        # other calls; the greeting is the same on every call.
+        standalone = not any(speaker == 'caller' for speaker, _ in self.history)
+        if self.engine.answers is not None and standalone and not self.cancelled.is_set():
+            self.engine.answers.put(self.question, ''.join(parts), self.answer_version)
+
+    def run(self):
+        try:
+            for sentence in self.sentences():
+                if self.cancelled.is_set():
+                    return
+                if self.first_sentence_at is None:
+                    self.first_sentence_at = self.engine.clock()
+                audio = self.engine.synthesize(sentence)
+                if self.cancelled.is_set():
+                    return
+                if self.first_audio_ready_at is None:
+                    self.first_audio_ready_at = self.engine.clock()
+                self.engine.deliver(self, sentence, audio)
+        except Exception:
+            logger.exception('Response %d on call %s failed', self.id, self.engine.call_id)
+        finally:
+            self.engine.finish(self)
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class ConversationEngine:
+    # Live two-way call: inbound audio frames -> streaming recognizer ->
+    # (speculative) LLM -> sentence-by-sentence TTS -> outbound audio.
+    # Every stage is injected so tests can drive it with recorded audio and
+    # stub engines.
+    def __init__(self, call_id, recognizer, llm, synthesize, transport, context=None, recorder=None,
+                 answers=None, greeting=None, speculate=True, min_speculation_words=3, stability_threshold=0.8,
+                 barge_in_min_words=2, history_turns=6, clock=time.monotonic):
+        self.call_id = call_id
+        self.recognizer = recognizer
+        self.llm = llm
+        self.synthesize = synthesize
+        self.transport = transport
+        self.context = context
+        self.recorder = recorder
+        self.answers = answers
+        self.greeting = greeting
+        self.speculate = speculate
+        self.min_speculation_words = min_speculation_words
+        self.stability_threshold = stability_threshold
+        self.barge_in_min_words = barge_in_min_words
+        self.history_turns = history_turns
+        self.clock = clock
+        self.history = []
+        self.turns = []
+        self.response = None
+        self._frames = queue.Queue()
+        self._lock = threading.RLock()
+        self._marks = set()
+        self._response_ids = itertools.count(1)
+        self._thread = None
+        self.stats = {'turns': 0, 'speculations': 0, 'speculation_hits': 0, 'speculation_misses': 0, 'barge_ins': 0}
+
+    def start(self):
+        if self.greeting:
+            with self._lock:
+                self._start_response(self.greeting, None, self.clock(), text=self.greeting)
+        self._thread = threading.Thread(target=self._recognize, name='voice-recognizer-%s' % self.call_id, daemon=True)
+        self._thread.start()
+
+    def feed(self, frame):
+        self._frames.put(frame)
+
+    def _incoming(self):
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                return
+            yield frame
+
+    def _recognize(self):
+        try:
+            for result in self.recognizer.stream(self._incoming()):
+                self.on_result(result)
+        except Exception:
+            logger.exception('Recognition failed on call %s', self.call_id)
+
+    def _count(self, key):
+        self.stats[key] += 1
+        VOICE_EVENTS.inc((key,))
+
+    def _record(self, speaker, text):
+        # Runs under the engine lock, so it only buffers; _flush_turns writes
+        if self.recorder is not None and text:
+            try:
+                self.recorder.append(speaker, text)
+            except Exception:
+                logger.exception('Could not record a turn on call %s', self.call_id)
+
+    def _flush_turns(self):
+        # Called with the engine lock released: the write is a database
+        # round-trip that must not stall audio delivery or barge-in.
+        if self.recorder is not None:
+            try:
+                self.recorder.maybe_flush()
+            except Exception:
+                logger.exception('Could not record turns on call %s', self.call_id)
+
+    def _start_response(self, question, key, committed_at, text=None):
+        response = Response(self, question, key, committed_at, text)
+        self.response = response
+        if response.speculative:
+            self._count('speculations')
+        response.start()
+        return response
+
+    def speaking(self):
+        response = self.response
+        return bool(self._marks) or (response is not None and response.committed and not response.finished)
+
+    def on_result(self, result):
+        key = normalize(result.text)
+        if not key:
+            return
+        with self._lock:
+            if self.speaking() and len(key.split()) >= self.barge_in_min_words:
+                self.barge_in()
+            response = self.response
+            if result.is_final:
+                self.stats['turns'] += 1
+                question = result.text.strip()
+                hit = response is not None and not response.committed and response.key == key
+                if not hit:
+                    if response is not None and not response.committed:
+                        self._count('speculation_misses')
+                    if response is not None:
+                        response.cancel()
+                    response = self._start_response(question, key, result.received_at)
+                self.history.append(('caller', question))
+                self._record('caller', question)
+                if hit:
+                    self._count('speculation_hits')
+                    self.commit(response, result.received_at)
+            elif self.speculate and result.stability >= self.stability_threshold \
+                    and len(key.split()) >= self.min_speculation_words:
+                if response is not None and not response.committed and response.key == key:
+                    return
+                if response is not None and not response.committed:
+                    response.cancel()
+                if response is None or not response.committed:
+                    self._start_response(result.text.strip(), key, None)
+        self._flush_turns()
+
+    def commit(self, response, at):
+        with self._lock:
+            response.committed_at = at
+            held, response.held = response.held, []
+            for sentence, audio in held:
+                self._play(response, sentence, audio)
+            if response.finished:
+                self._report(response)
+                self.response = None
+
+    def deliver(self, response, sentence, audio):
+        with self._lock:
+            if response.cancelled.is_set() or response is not self.response:
+                return
+            if not response.committed:
+                response.held.append((sentence, audio))
+                return
+            self._play(response, sentence, audio)
+
+    def _play(self, response, sentence, audio):
+        self.transport.send_audio(strip_wav_header(audio))
+        name = 'r%ds%d' % (response.id, len(response.spoken))
+        self.transport.mark(name)
+        self._marks.add(name)
+        response.spoken.append(sentence)
+        if response.first_audio_sent_at is None:
+            response.first_audio_sent_at = self.clock()
+
+    def on_mark(self, name):
+        with self._lock:
+            self._marks.discard(name)
+
+    def barge_in(self):
+        # Caller talked over the assistant: drop queued audio and the reply
+        response = self.response
+        self.transport.clear()
+        self._marks.clear()
+        if response is not None and response.committed:
+            response.cancel()
+            if response.spoken:
+                text = ' '.join(response.spoken)
+                self.history.append(('assistant', text))
+                self._record('assistant', text + ' [interrupted]')
+            self.response = None
+        self._count('barge_ins')
+
+    def finish(self, response):
+        with self._lock:
+            response.finished = True
+            if response.cancelled.is_set() or response is not self.response:
+                return
+            if response.committed:
+                self._report(response)
+                self.response = None
+        self._flush_turns()
+
+    def _report(self, response):
+        text = ' '.join(response.spoken)
+        if text:
+            self.history.append(('assistant', text))
+            self._record('assistant', text)
+        if response.fixed_text is not None or response.first_audio_sent_at is None:
+            return
+        turn = {
+            'response_id': response.id,
+            'question': response.question,
+            'speculative': response.speculative,
+            'cached': response.cached,
+            # What the caller hears: end of their speech to the first audio sent
+            'first_audio_ms': round(max(0.0, response.first_audio_sent_at - response.committed_at) * 1000, 1),
+            'llm_first_sentence_ms': round((response.first_sentence_at - response.started_at) * 1000, 1),
+            'tts_first_sentence_ms': round((response.first_audio_ready_at - response.first_sentence_at) * 1000, 1),
+            'sentences': len(response.spoken),
+        }
+        self.turns.append(turn)
+        VOICE_TURN_SECONDS.observe(turn['first_audio_ms'] / 1000.0, ('first_audio',))
+        VOICE_TURN_SECONDS.observe(turn['llm_first_sentence_ms'] / 1000.0, ('llm_first_sentence',))
+        VOICE_TURN_SECONDS.observe(turn['tts_first_sentence_ms'] / 1000.0, ('tts_first_sentence',))
+
+    def stop(self, timeout=2.0):
+        self._frames.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            if self.response is not None:
+                self.response.cancel()
+        if self.recorder is not None:
+            try:
+                self.recorder.close()
+            except Exception:
+                logger.exception('Could not store the transcript of call %s', self.call_id)
+
+
+def create_engine(call, transport):
+    # Production wiring for a call row: Google recognizer, Gemini, cached TTS,
+    # retrieval context from the tenant's dataset and the turn recorder.
+    from app import answers, retrieval
+    from app.conversation import TurnRecorder
+    from app.llm import get_llm
+    from app.models import UserCallData
+    from app.speech import get_recognizer
+    from app.tts import get_tts
+
+    tts = get_tts()
+
+    def synthesize(text):
+        _, path = tts.get_audio(text, encoding='MULAW', sample_rate=SAMPLE_RATE)
+        with open(path, 'rb') as handle:
+            return handle.read()
+
+    config = UserCallData.get_call_config(call['user_id']) or {}
+    return ConversationEngine(
+        call['id'],
+        get_recognizer(),
+        get_llm(),
+        synthesize,
+        transport,
+        context=lambda question: retrieval.build_context(call['user_id'], question),
+        recorder=TurnRecorder(call['id']),
+        answers=answers.for_tenant(call['user_id']),
+        greeting=config.get('greeting_message'),
+        speculate=os.getenv('VOICE_SPECULATE', '1') != '0',
+        stability_threshold=float(os.getenv('VOICE_STABILITY_THRESHOLD', 0.8)),
+    )
+
+
+__all__ = ['ConversationEngine', 'Transport', 'TwilioMediaTransport', 'create_engine', 'iter_sentences',
+           'stream_token', 'verify_stream_token', 'FRAME_BYTES']
@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_EVENTS = metrics.registry.counter(
+    'webhook_events_total', 'Status callbacks by outcome.', ('outcome',))
+WEBHOOK_FLUSH_SECONDS = metrics.registry.histogram(
+    'webhook_flush_seconds', 'Time to commit one batch of status callbacks.')
+WEBHOOK_BATCH_SIZE = metrics.registry.histogram(
+    'webhook_batch_size', 'Status callbacks per group commit.', buckets=(1, 5, 10, 50, 100, 250, 500, 1000, 2500))
+
+
+class BufferFull(Exception):
+    pass
+
+
+class _Batch:
+    __slots__ = ('events', 'done', 'error')
+
+    def __init__(self):
+        self.events = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class StatusBuffer:
+    # Group commit for status callbacks. Handlers append to the open batch
+    # and wait on it; one flusher thread commits a batch when it reaches
+    # flush_size or flush_interval after its first event. A handler
+    # acknowledges only after its batch committed, so a crash loses nothing
+    # that was acknowledged and the provider retries everything else.
+    def __init__(self, apply, max_pending=10000, flush_size=500, flush_interval=0.005):
+        self.apply = apply
+        self.max_pending = max_pending
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._batch = _Batch()
+        self._first_at = None
+        self._in_flight = 0
+        self._thread = None
+        self._pid = None
+        self.stats = {'accepted': 0, 'rejected': 0, 'flushes': 0, 'flushed_events': 0, 'failed_flushes': 0, 'max_batch': 0}
+
+    def _ensure_flusher(self):
+        # Started lazily and again in a forked worker, which inherits no threads
+        if self._pid != os.getpid():
+            with self._cond:
+                if self._pid != os.getpid():
+                    self._batch = _Batch()
+                    self._first_at = None
+                    self._in_flight = 0
+                    self._thread = threading.Thread(target=self._run, name='webhook-flusher', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def submit(self, event):
+        self._ensure_flusher()
+        with self._cond:
+            if len(self._batch.events) + self._in_flight >= self.max_pending:
+                self.stats['rejected'] += 1
+                WEBHOOK_EVENTS.inc(('rejected',))
+                raise BufferFull('Status buffer is full')
+            batch = self._batch
+            batch.events.append(event)
+            self.stats['accepted'] += 1
+            if len(batch.events) == 1:
+                self._first_at = time.monotonic()
+                self._cond.notify()
+            elif len(batch.events) >= self.flush_size:
+                self._cond.notify()
+        return batch
+
+    def _take(self):
+        with self._cond:
+            while not self._batch.events:
+                self._cond.wait()
+            deadline = self._first_at + self.flush_interval
+            while len(self._batch.events) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._batch
+            self._batch = _Batch()
+            self._in_flight = len(batch.events)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            started = time.perf_counter()
+            try:
+                self.apply(batch.events)
+                outcome = 'committed'
+            except Exception as e:
+                logger.exception('Flushing %d status callbacks failed', len(batch.events))
+                batch.error = e
+                outcome = 'failed'
+            WEBHOOK_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            WEBHOOK_BATCH_SIZE.observe(len(batch.events))
+            WEBHOOK_EVENTS.inc((outcome,), len(batch.events))
+            with self._cond:
+                self._in_flight = 0
+                self.stats['flushes'] += 1
+                self.stats['flushed_events'] += len(batch.events)
+                self.stats['max_batch'] = max(self.stats['max_batch'], len(batch.events))
+                if batch.error is not None:
+                    self.stats['failed_flushes'] += 1
+            batch.done.set()
+
+    def snapshot(self):
+        with self._cond:
+            data = dict(self.stats)
+            data.update(pending=len(self._batch.events), in_flight=self._in_flight, max_pending=self.max_pending)
+        return data
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_status_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from app.models import Calls
+                _buffer = StatusBuffer(
+                    Calls.apply_provider_statuses,
+                    max_pending=int(os.getenv('WEBHOOK_MAX_PENDING', 10000)),
+                    flush_size=int(os.getenv('WEBHOOK_FLUSH_SIZE', 500)),
+                    flush_interval=float(os.getenv('WEBHOOK_FLUSH_INTERVAL', 0.005)),
+                )
+    return _buffer
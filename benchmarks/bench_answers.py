@@ -0,0 +1,72 @@
+import argparse
+import random
+import time
+
+from app.answers import AnswerCache
+from benchmarks.common import write_report
+
+# Each topic is asked in several wordings, as callers do
+TOPICS = (
+    ('What are your opening hours?', 'what are the opening hours', 'Opening hours?', 'your opening hours please'),
+    ('How much does it cost?', 'how much does this cost', 'What does it cost', 'cost?'),
+    ('Where is your office located?', 'where is the office located', 'office location', 'Where is your office'),
+    ('Do you deliver on weekends?', 'do you deliver on the weekend', 'weekend delivery?', 'Do you do weekend deliveries'),
+    ('Can I cancel my subscription?', 'how can I cancel my subscription', 'cancel subscription', 'can i cancel the subscription'),
+    ('Is there parking nearby?', 'is there any parking nearby', 'parking nearby?', 'where can I park'),
+)
+
+
+def run(tenants, questions, max_entries, threshold, long_tail, seed=7):
+    cache = AnswerCache(max_tenants=tenants, max_entries=max_entries, threshold=threshold)
+    rng = random.Random(seed)
+    llm_calls = 0
+    started = time.perf_counter()
+    for n in range(questions):
+        user_id = rng.randrange(tenants)
+        if rng.random() < long_tail:
+            question = 'question number %d about order %d' % (n, rng.randrange(10 ** 6))
+        else:
+            question = rng.choice(rng.choice(TOPICS))
+        if cache.lookup(user_id, 'v1', question) is None:
+            llm_calls += 1
+            cache.store(user_id, 'v1', question, 'Answer to: %s' % question)
+    elapsed = time.perf_counter() - started
+    stats = cache.tenant_stats()
+    hits = sum(tenant['hits'] for tenant in stats.values())
+    near_hits = sum(tenant['near_hits'] for tenant in stats.values())
+    return {
+        'threshold': threshold,
+        'questions': questions,
+        'llm_calls': llm_calls,
+        'hit_rate': round((hits + near_hits) / float(questions), 4),
+        'exact_hits': hits,
+        'near_hits': near_hits,
+        'us_per_question': round(elapsed / questions * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hit rate and cost of the per-tenant answer cache')
+    parser.add_argument('--tenants', type=int, default=100)
+    parser.add_argument('--questions', type=int, default=100000)
+    parser.add_argument('--max-entries', type=int, default=256)
+    parser.add_argument('--thresholds', default='1.0,0.8,0.6', help='Jaccard thresholds to compare; 1.0 is exact-only')
+    parser.add_argument('--long-tail', type=float, default=0.2, help='Share of one-off questions')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    results = [
+        run(args.tenants, args.questions, args.max_entries, float(threshold), args.long_tail)
+        for threshold in args.thresholds.split(',')
+    ]
+    print('%10s %10s %10s %9s %11s %10s %8s' % (
+        'threshold', 'questions', 'llm calls', 'hit rate', 'exact hits', 'near hits', 'us/q'))
+    for result in results:
+        print('%10.2f %10d %10d %9.4f %11d %10d %8.2f' % (
+            result['threshold'], result['questions'], result['llm_calls'], result['hit_rate'],
+            result['exact_hits'], result['near_hits'], result['us_per_question']))
+    write_report(args.output, {'args': vars(args), 'results': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import multiprocessing
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.common import disposable_database, seed_tenants, write_report
+
+
+def seed_pending(conn, user_ids, rows):
+    cursor = conn.cursor()
+    batch = []
+    for n in range(rows):
+        batch.append((user_ids[n % len(user_ids)], 'Contact %d' % n, '+1%010d' % n, '1way', '', 'Hello', 'no', 0))
+        if len(batch) == 5000:
+            cursor.executemany(
+                'INSERT INTO calls (user_id, receiver_name, receiver_phone, call_type, conversation_history, '
+                'ai_transmission_message, callback_status, call_done) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+                batch
+            )
+            conn.commit()
+            batch = []
+    if batch:
+        cursor.executemany(
+            'INSERT INTO calls (user_id, receiver_name, receiver_phone, call_type, conversation_history, '
+            'ai_transmission_message, callback_status, call_done) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+            batch
+        )
+        conn.commit()
+    cursor.close()
+
+
+def worker(database, latency, batch_size, threads, rate, shared_limits, results):
+    import os
+    os.environ['DATABASE'] = database
+    from app.dispatcher import Dispatcher
+    from app.telephony import FakeTelephonyClient
+
+    client = FakeTelephonyClient(latency=latency)
+    dispatcher = Dispatcher(
+        client,
+        calls_per_second=rate,
+        concurrency_per_number=threads,
+        max_workers=threads,
+        batch_size=batch_size,
+        poll_interval=0.05,
+        shared_limits=shared_limits,
+    )
+    dispatcher.run(until_idle=True)
+    results.put(client.placed)
+
+
+def peak_number_rate(placed, window=1.0):
+    # Most calls any one caller ID placed within `window` seconds, over all
+    # processes (time.monotonic is system-wide on Linux).
+    by_number = defaultdict(list)
+    for at, number, _ in placed:
+        by_number[number].append(at)
+    peak = 0
+    for times in by_number.values():
+        times.sort()
+        start = 0
+        for end, at in enumerate(times):
+            while at - times[start] >= window:
+                start += 1
+            peak = max(peak, end - start + 1)
+    return peak
+
+
+def run_round(database, workers, args):
+    from app.db import get_db_connection
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE calls SET call_done = 0, dispatch_status = 'pending', lease_owner = NULL, lease_expires_at = NULL")
+    cursor.execute('DELETE FROM dispatch_numbers')
+    cursor.execute('DELETE FROM dispatch_number_slots')
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(
+            database, args.latency, args.batch_size, args.threads, args.rate, not args.local_limits, results
+        ))
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    placed = []
+    for _ in processes:
+        placed.extend(results.get())
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    duplicates = sum(count - 1 for count in Counter(call_id for _, _, call_id in placed).values() if count > 1)
+    # A bucket of `rate` tokens per second with a burst of max(1, rate)
+    allowed = int(args.rate + max(1.0, args.rate))
+    peak = peak_number_rate(placed)
+    return {
+        'workers': workers,
+        'calls': len(placed),
+        'duplicates': duplicates,
+        'seconds': round(elapsed, 2),
+        'calls_per_second': round(len(placed) / elapsed, 1),
+        'peak_number_rate': peak,
+        'number_rate_exceeded': peak > allowed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drain pending calls with N competing dispatcher processes')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--numbers', type=int, default=200, help='Distinct tenants / caller IDs')
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--threads', type=int, default=8, help='Dispatch threads per process')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02, help='Fake telephony latency in seconds')
+    parser.add_argument('--rate', type=float, default=10000, help='Calls per second allowed per caller ID')
+    parser.add_argument('--local-limits', action='store_true',
+                        help='Per-process limits only (no DISPATCH_SHARED_LIMITS), to compare')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    with disposable_database() as database:
+        from app.db import get_db_connection
+        from app.migrations import migrate
+
+        migrate()
+        conn = get_db_connection()
+        user_ids = seed_tenants(conn, args.numbers)
+        seed_pending(conn, user_ids, args.rows)
+        conn.close()
+
+        rounds = [run_round(database, int(workers), args) for workers in args.workers.split(',')]
+
+    base = rounds[0]['calls_per_second']
+    print('%8s %10s %10s %12s %10s %12s' % ('workers', 'calls', 'dupes', 'calls/s', 'scaling', 'peak/number'))
+    for result in rounds:
+        result['scaling'] = round(result['calls_per_second'] / base, 2) if base else 0
+        print('%8d %10d %10d %12.1f %10.2f %11d%s' % (
+            result['workers'], result['calls'], result['duplicates'], result['calls_per_second'], result['scaling'],
+            result['peak_number_rate'], '!' if result['number_rate_exceeded'] else ' '
+        ))
+    write_report(args.output, {'args': vars(args), 'rounds': rounds})
+
+
+if __name__ == '__main__':
+    main()
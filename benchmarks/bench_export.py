@@ -0,0 +1,71 @@
+import argparse
+import resource
+import time
+
+from benchmarks.common import disposable_database, seed_tenants, seed_calls, write_report
+
+
+def current_rss_kb():
+    with open('/proc/self/statm') as handle:
+        pages = int(handle.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure RSS while streaming a large call export')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--format', default='ndjson', choices=('ndjson', 'csv'))
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--sample-every', type=int, default=50000, help='Sample RSS every N rows')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    with disposable_database():
+        from app.db import get_db_connection
+        from app.export import stream_rows
+        from app.migrations import migrate
+        from app.models import Calls
+
+        migrate()
+        conn = get_db_connection()
+        user_ids = seed_tenants(conn, 1)
+        seed_calls(conn, user_ids, args.rows)
+        conn.close()
+
+        counted = []
+
+        def counting(rows):
+            for n, row in enumerate(rows, 1):
+                if n % args.sample_every == 0:
+                    counted.append((n, current_rss_kb()))
+                yield row
+
+        columns = Calls.LIST_COLUMNS + Calls.TEXT_COLUMNS
+        rss_before = current_rss_kb()
+        started = time.perf_counter()
+        total_bytes = 0
+        rows = counting(Calls.iter_calls(user_ids[0]))
+        for chunk in stream_rows(rows, args.format, columns, compress=args.gzip):
+            total_bytes += len(chunk)
+        elapsed = time.perf_counter() - started
+
+    samples = [rss for _, rss in counted]
+    report = {
+        'rows': args.rows,
+        'format': args.format,
+        'gzip': args.gzip,
+        'bytes': total_bytes,
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(args.rows / elapsed),
+        'rss_before_kb': rss_before,
+        'rss_min_kb': min(samples) if samples else rss_before,
+        'rss_max_kb': max(samples) if samples else rss_before,
+        'samples': counted,
+    }
+    print('exported %(rows)d rows (%(bytes)d bytes) in %(seconds)ss, %(rows_per_second)d rows/s' % report)
+    print('RSS before %(rss_before_kb)d KB, during export min %(rss_min_kb)d KB / max %(rss_max_kb)d KB' % report)
+    write_report(args.output, report)
+
+
+if __name__ == '__main__':
+    main()
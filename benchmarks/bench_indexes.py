@@ -0,0 +1,99 @@
+import argparse
+
+from benchmarks.common import disposable_database, seed_tenants, seed_calls, time_call, write_report
+
+QUERIES = {
+    'calls_by_status_page': (
+        'SELECT id, callback_status, call_timestamp FROM calls '
+        'WHERE user_id = %s AND callback_status = %s ORDER BY call_timestamp DESC, id DESC LIMIT 50',
+        lambda user_id: (user_id, 'callback_needed')
+    ),
+    'calls_recent_page': (
+        'SELECT id, callback_status, call_timestamp FROM calls '
+        'WHERE user_id = %s ORDER BY call_timestamp DESC, id DESC LIMIT 50',
+        lambda user_id: (user_id,)
+    ),
+    'calls_status_count': (
+        'SELECT COUNT(*) FROM calls WHERE user_id = %s AND callback_status = %s',
+        lambda user_id: (user_id, 'yes')
+    ),
+    'user_call_data_lookup': (
+        'SELECT greeting_message FROM user_call_data WHERE user_id = %s',
+        lambda user_id: (user_id,)
+    ),
+    'credits_lookup': (
+        'SELECT credits FROM credits WHERE user_id = %s',
+        lambda user_id: (user_id,)
+    ),
+}
+
+
+def analyze(conn):
+    cursor = conn.cursor()
+    cursor.execute('ANALYZE TABLE calls')
+    cursor.fetchall()
+    cursor.close()
+
+
+def measure(conn, user_id, repeat):
+    results = {}
+    cursor = conn.cursor(dictionary=True)
+    for name, (sql, params) in QUERIES.items():
+        cursor.execute('EXPLAIN ' + sql, params(user_id))
+        plan = [
+            {key: row.get(key) for key in ('table', 'type', 'key', 'rows', 'Extra')}
+            for row in cursor.fetchall()
+        ]
+
+        def run():
+            cursor.execute(sql, params(user_id))
+            cursor.fetchall()
+
+        results[name] = {'plan': plan, 'latency': time_call(run, repeat)}
+    cursor.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed synthetic calls and compare plans before/after 0002_call_indexes')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    with disposable_database():
+        from app.db import get_db_connection
+        from app.migrations import migrate
+
+        migrate(target='0001')
+        conn = get_db_connection()
+        user_ids = seed_tenants(conn, args.tenants)
+        seed_calls(conn, user_ids, args.rows)
+        analyze(conn)
+        target_user = user_ids[0]
+
+        report = {'rows': args.rows, 'tenants': args.tenants}
+        report['before'] = measure(conn, target_user, args.repeat)
+        conn.close()
+
+        migrate(target='0002')
+        conn = get_db_connection()
+        analyze(conn)
+        report['after'] = measure(conn, target_user, args.repeat)
+        conn.close()
+
+    print('%-24s %-10s %-28s %10s   %-10s %-28s %10s' % ('query', 'type', 'key (before)', 'p50 ms', 'type', 'key (after)', 'p50 ms'))
+    for name in QUERIES:
+        before = report['before'][name]
+        after = report['after'][name]
+        print('%-24s %-10s %-28s %10.3f   %-10s %-28s %10.3f' % (
+            name,
+            before['plan'][0]['type'], before['plan'][0]['key'], before['latency']['p50_ms'],
+            after['plan'][0]['type'], after['plan'][0]['key'], after['latency']['p50_ms'],
+        ))
+    write_report(args.output, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import time
+
+from app import metrics
+from benchmarks.common import write_report
+
+
+class FakeModel:
+    @staticmethod
+    def get_rows(n):
+        return [None] * n
+
+    @staticmethod
+    def iter_rows(n):
+        for i in range(n):
+            yield i
+
+
+def per_call_ns(fn, iterations):
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+def bench_model_wrapper(iterations):
+    raw = FakeModel.get_rows
+    wrapped = metrics.timed_method('FakeModel.get_rows', raw)
+    baseline = per_call_ns(lambda: raw(10), iterations)
+    instrumented = per_call_ns(lambda: wrapped(10), iterations)
+    raw_iter = FakeModel.iter_rows
+    wrapped_iter = metrics.timed_method('FakeModel.iter_rows', raw_iter)
+    iter_baseline = per_call_ns(lambda: sum(raw_iter(100)), iterations // 10)
+    iter_instrumented = per_call_ns(lambda: sum(wrapped_iter(100)), iterations // 10)
+    return {
+        'call_ns': round(baseline, 1),
+        'instrumented_call_ns': round(instrumented, 1),
+        'overhead_ns': round(instrumented - baseline, 1),
+        'generator_100_rows_ns': round(iter_baseline, 1),
+        'instrumented_generator_100_rows_ns': round(iter_instrumented, 1),
+        'generator_overhead_ns_per_row': round((iter_instrumented - iter_baseline) / 100, 1),
+    }
+
+
+def bench_histogram(iterations, series):
+    histogram = metrics.Histogram('bench_seconds', 'bench', ('route', 'status'))
+    labels = [('/api/route/%d' % i, '200') for i in range(series)]
+    values = [0.0001 * (i % 5000) for i in range(1024)]
+    started = time.perf_counter_ns()
+    for i in range(iterations):
+        histogram.observe(values[i & 1023], labels[i % series])
+    observe_ns = (time.perf_counter_ns() - started) / iterations
+
+    registry = metrics.Registry()
+    registry.register(histogram)
+    started = time.perf_counter()
+    body = registry.render()
+    render_ms = (time.perf_counter() - started) * 1000
+    return {'observe_ns': round(observe_ns, 1), 'series': series, 'render_ms': round(render_ms, 2), 'render_bytes': len(body)}
+
+
+def bench_flask(iterations):
+    try:
+        from flask import Blueprint, Flask
+    except ImportError:
+        return None
+
+    def build(instrument):
+        app = Flask('bench')
+        bp = Blueprint('bench_routes', 'bench')
+
+        @bp.route('/ping')
+        def ping():
+            return 'ok'
+
+        if instrument:
+            metrics.instrument_blueprint(bp)
+        app.register_blueprint(bp)
+        return app.test_client()
+
+    results = {}
+    for label, client in (('plain', build(False)), ('instrumented', build(True))):
+        client.get('/ping')
+        results[label + '_request_us'] = round(per_call_ns(lambda: client.get('/ping'), iterations) / 1000, 2)
+    results['overhead_us'] = round(results['instrumented_request_us'] - results['plain_request_us'], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overhead of the metrics layer per model call, observation and request')
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--series', type=int, default=200, help='Distinct label sets in the histogram')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    report = {
+        'model_wrapper': bench_model_wrapper(args.iterations),
+        'histogram': bench_histogram(args.iterations, args.series),
+        'flask': bench_flask(args.requests),
+    }
+    wrapper = report['model_wrapper']
+    print('model method: %.0f ns -> %.0f ns (+%.0f ns per call, %.3f%% of a 1 ms query)' % (
+        wrapper['call_ns'], wrapper['instrumented_call_ns'], wrapper['overhead_ns'], wrapper['overhead_ns'] / 10000))
+    print('streaming method: +%.0f ns per row' % wrapper['generator_overhead_ns_per_row'])
+    histogram = report['histogram']
+    print('histogram observe: %.0f ns across %d series; render %.2f ms (%d bytes)' % (
+        histogram['observe_ns'], histogram['series'], histogram['render_ms'], histogram['render_bytes']))
+    if report['flask']:
+        flask_report = report['flask']
+        print('flask request: %.1f us -> %.1f us (+%.1f us)' % (
+            flask_report['plain_request_us'], flask_report['instrumented_request_us'], flask_report['overhead_us']))
+    else:
+        print('flask request: skipped (Flask not installed)')
+    write_report(args.output, {'args': vars(args), 'results': report})
+
+
+if __name__ == '__main__':
+    main()
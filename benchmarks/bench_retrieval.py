@@ -0,0 +1,107 @@
+import argparse
+import random
+import time
+
+from app.retrieval import DatasetIndex, TOP_K
+from benchmarks.common import percentile, write_report
+
+TOPICS = {
+    'pricing': 'The {plan} plan costs {price} dollars per month and includes {count} minutes of calling.',
+    'hours': 'Our {site} office is open from {open}am to {close}pm from Monday to {day}.',
+    'address': 'The {site} branch is located at {count} {street} Street, suite {price}.',
+    'refund': 'Refunds for the {plan} plan are processed within {count} business days of the request.',
+    'support': 'Support for {site} customers is available by phone and WhatsApp until {close}pm.',
+}
+WORDS = {
+    'plan': ['basic', 'standard', 'premium', 'enterprise', 'starter'],
+    'site': ['Delhi', 'Mumbai', 'Pune', 'Jaipur', 'Chennai', 'Noida'],
+    'street': ['Park', 'Mall', 'Station', 'Lake', 'Temple'],
+    'day': ['Friday', 'Saturday'],
+}
+QUESTIONS = [
+    'how much does the premium plan cost',
+    'what time does the Pune office open',
+    'where is the Jaipur branch',
+    'how long do refunds take for the basic plan',
+    'until when is support available for Chennai customers',
+]
+
+
+def synthetic_dataset(size, rng):
+    paragraphs = []
+    total = 0
+    while total < size:
+        sentences = []
+        for _ in range(rng.randint(2, 6)):
+            template = TOPICS[rng.choice(list(TOPICS))]
+            sentences.append(template.format(
+                plan=rng.choice(WORDS['plan']), site=rng.choice(WORDS['site']),
+                street=rng.choice(WORDS['street']), day=rng.choice(WORDS['day']),
+                price=rng.randint(5, 500), count=rng.randint(1, 999),
+                open=rng.randint(7, 10), close=rng.randint(5, 9),
+            ))
+        paragraph = ' '.join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return paragraphs
+
+
+def run(size, queries, rng):
+    paragraphs = synthetic_dataset(size, rng)
+    text = '\n\n'.join(paragraphs)
+
+    index = DatasetIndex()
+    started = time.perf_counter()
+    index.update(text)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    edited = list(paragraphs)
+    for position in rng.sample(range(len(edited)), max(1, len(edited) // 100)):
+        edited[position] = synthetic_dataset(len(edited[position]), rng)[0]
+    started = time.perf_counter()
+    delta = index.update('\n\n'.join(edited))
+    update_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    prompt_chars = []
+    for n in range(queries):
+        question = QUESTIONS[n % len(QUESTIONS)]
+        started = time.perf_counter()
+        hits = index.search(question, TOP_K)
+        latencies.append((time.perf_counter() - started) * 1000)
+        prompt_chars.append(sum(len(chunk) for chunk, _ in hits))
+
+    return {
+        'dataset_bytes': len(text),
+        'chunks': len(index.chunks),
+        'build_ms': round(build_ms, 1),
+        'incremental_update_ms': round(update_ms, 1),
+        'incremental_delta': delta,
+        'query_p50_ms': round(percentile(latencies, 50), 3),
+        'query_p95_ms': round(percentile(latencies, 95), 3),
+        'full_prompt_chars': len(text),
+        'topk_prompt_chars': round(sum(prompt_chars) / len(prompt_chars)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prompt size and BM25 retrieval latency vs dataset size')
+    parser.add_argument('--sizes', default='10000,100000,1000000,5000000', help='Dataset sizes in bytes')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [run(int(size), args.queries, rng) for size in args.sizes.split(',')]
+    print('%12s %8s %10s %12s %10s %10s %14s %12s' % (
+        'bytes', 'chunks', 'build ms', 'update ms', 'p50 ms', 'p95 ms', 'full prompt', 'top-k prompt'))
+    for result in results:
+        print('%12d %8d %10.1f %12.1f %10.3f %10.3f %14d %12d' % (
+            result['dataset_bytes'], result['chunks'], result['build_ms'], result['incremental_update_ms'],
+            result['query_p50_ms'], result['query_p95_ms'], result['full_prompt_chars'], result['topk_prompt_chars']))
+    write_report(args.output, {'args': vars(args), 'results': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from app.scheduler import FairScheduler
+from benchmarks.common import write_report
+
+ZONES = ('UTC', 'America/New_York', 'Europe/Berlin', 'Asia/Kolkata', 'Australia/Sydney')
+
+
+def backlog(tenants, big_pending, seed=7):
+    # Tenant 1 has just uploaded a huge list and no restrictions; everyone
+    # else has a few hundred calls, a weight of 1-3, and a third have an
+    # 09:00-18:00 local window.
+    rng = random.Random(seed)
+    rows = []
+    for user_id in range(1, tenants + 1):
+        windowed = rng.random() < 0.33 and user_id != 1
+        rows.append({
+            'user_id': user_id,
+            'pending': big_pending if user_id == 1 else rng.randint(50, 500),
+            'in_flight': 0,
+            'credits': 10 ** 9,
+            'call_weight': rng.choice((1, 1, 2, 3)),
+            'max_concurrent_calls': None if user_id == 1 else rng.choice((None, 5, 20)),
+            'call_window_start': timedelta(hours=9) if windowed else None,
+            'call_window_end': timedelta(hours=18) if windowed else None,
+            'timezone': rng.choice(ZONES),
+        })
+    return rows
+
+
+def fifo_share(rows, calls):
+    # Global id order: the big upload was inserted first, so it is served first
+    big = rows[0]['pending']
+    return min(big, calls) / float(calls)
+
+
+def run(tenants, rounds, batch_size, big_pending):
+    rows = backlog(tenants, big_pending)
+    scheduler = FairScheduler(credits_per_call=1)
+    started = time.perf_counter()
+    scheduler.refresh(rows)
+    refresh_ms = (time.perf_counter() - started) * 1000
+
+    served = {}
+    decision_time = 0.0
+    granted = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        plan = scheduler.next_batch(batch_size)
+        decision_time += time.perf_counter() - started
+        for user_id, count in plan.items():
+            served[user_id] = served.get(user_id, 0) + count
+            granted += count
+            # Calls complete before the next claim
+            scheduler.release(user_id, count)
+
+    weights = {row['user_id']: row['call_weight'] for row in rows}
+    # Jain's index over weight-normalised service of the tenants that stayed
+    # backlogged throughout: 1.0 means each got exactly its weighted share.
+    normalised = [
+        count / float(weights[user_id]) for user_id, count in served.items()
+        if scheduler.tenants.get(user_id) is not None and scheduler.tenants[user_id].pending > 0
+    ]
+    jain = sum(normalised) ** 2 / (len(normalised) * sum(value * value for value in normalised)) if normalised else 0.0
+    return {
+        'tenants': tenants,
+        'granted': granted,
+        'tenants_served': len(served),
+        'big_tenant_share': round(served.get(1, 0) / float(granted), 4) if granted else 0.0,
+        'fifo_big_tenant_share': round(fifo_share(rows, granted), 4) if granted else 0.0,
+        'jain_index': round(jain, 4),
+        'refresh_ms': round(refresh_ms, 1),
+        'us_per_decision': round(decision_time / granted * 1e6, 2) if granted else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost and fairness of the weighted fair dispatch scheduler')
+    parser.add_argument('--tenants', default='100,1000,10000,100000', help='Tenant counts to compare')
+    parser.add_argument('--rounds', type=int, default=500, help='Claim rounds per run')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--big-pending', type=int, default=500000, help='Backlog of the one large tenant')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    results = [run(int(tenants), args.rounds, args.batch_size, args.big_pending) for tenants in args.tenants.split(',')]
+    print('%9s %9s %8s %10s %10s %7s %11s %8s' % (
+        'tenants', 'granted', 'served', 'big share', 'fifo share', 'jain', 'refresh ms', 'us/call'))
+    for result in results:
+        print('%9d %9d %8d %10.4f %10.4f %7.4f %11.1f %8.2f' % (
+            result['tenants'], result['granted'], result['tenants_served'], result['big_tenant_share'],
+            result['fifo_big_tenant_share'], result['jain_index'], result['refresh_ms'], result['us_per_decision']))
+    write_report(args.output, {'args': vars(args), 'results': results})
+
+
+if __name__ == '__main__':
+    main()
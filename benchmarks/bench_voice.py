@@ -0,0 +1,140 @@
+import argparse
+import threading
+import time
+
+from app.llm import StubLanguageModel
+from app.speech import FRAME_BYTES, SAMPLE_RATE, ScriptedRecognizer
+from app.voice import ConversationEngine, Transport
+from benchmarks.common import percentile, write_report
+
+QUESTIONS = (
+    'what are your opening hours on sunday',
+    'do you deliver to the north side of town',
+    'how much does the premium plan cost per month',
+    'can i reschedule my appointment to friday',
+    'is there parking near the main office',
+    'who do i talk to about a refund',
+)
+
+
+class PlaybackTransport(Transport):
+    # Plays audio in real time: marks are acknowledged once everything sent
+    # before them would have finished playing, as Twilio does.
+    def __init__(self):
+        self.engine = None
+        self.sent = []
+        self.cleared = 0
+        self._lock = threading.Lock()
+        self._playing_until = time.monotonic()
+        self._timers = []
+
+    def send_audio(self, audio):
+        with self._lock:
+            now = time.monotonic()
+            self._playing_until = max(self._playing_until, now) + len(audio) / float(SAMPLE_RATE)
+            self.sent.append((now, len(audio)))
+
+    def clear(self):
+        with self._lock:
+            self._playing_until = time.monotonic()
+            self.cleared += 1
+
+    def mark(self, name):
+        with self._lock:
+            delay = max(0.0, self._playing_until - time.monotonic())
+        timer = threading.Timer(delay, self.engine.on_mark, (name,))
+        timer.daemon = True
+        timer.start()
+        self._timers.append(timer)
+
+
+def build_script(turns, words_per_second, endpoint_frames, gap_frames, revise_every, frame_ms):
+    # Interim results grow word by word at low stability; the complete
+    # utterance turns stable at the end of speech and the final follows after
+    # the recognizer's endpointing delay. Every revise_every-th turn the final
+    # differs from the stable interim, which forces a speculation miss.
+    frames_per_word = max(1, int(1000.0 / words_per_second / frame_ms))
+    script = []
+    frame = gap_frames // 2
+    for turn in range(turns):
+        words = QUESTIONS[turn % len(QUESTIONS)].split()
+        for count in range(1, len(words) + 1):
+            frame += frames_per_word
+            script.append((frame, ' '.join(words[:count]), False, 0.9 if count == len(words) else 0.4))
+        final = ' '.join(words)
+        if revise_every and (turn + 1) % revise_every == 0:
+            final += ' please'
+        frame += endpoint_frames
+        script.append((frame, final, True, 1.0))
+        frame += gap_frames
+    return script, frame
+
+
+def run(speculate, args):
+    script, total_frames = build_script(
+        args.turns, args.words_per_second, args.endpoint_frames, args.gap_frames, args.revise_every, args.frame_ms)
+    llm = StubLanguageModel(first_token_delay=args.llm_ms / 1000.0, chunk_delay=args.chunk_ms / 1000.0)
+
+    def synthesize(text):
+        time.sleep(args.tts_ms / 1000.0)
+        return b'\xff' * (len(text) * SAMPLE_RATE // 100)
+
+    transport = PlaybackTransport()
+    engine = ConversationEngine(
+        1, ScriptedRecognizer(script), llm, synthesize, transport, speculate=speculate,
+        stability_threshold=0.8
+    )
+    transport.engine = engine
+    engine.start()
+    frame = b'\xff' * FRAME_BYTES
+    next_at = time.monotonic()
+    for _ in range(total_frames):
+        engine.feed(frame)
+        next_at += args.frame_ms / 1000.0
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(1.0)
+    engine.stop()
+    samples = [turn['first_audio_ms'] for turn in engine.turns]
+    return {
+        'speculate': speculate,
+        'turns': len(engine.turns),
+        'llm_calls': llm.calls,
+        'speculation_hits': engine.stats['speculation_hits'],
+        'speculation_misses': engine.stats['speculation_misses'],
+        'barge_ins': engine.stats['barge_ins'],
+        'p50_first_audio_ms': round(percentile(samples, 50), 1),
+        'p95_first_audio_ms': round(percentile(samples, 95), 1),
+        'max_first_audio_ms': round(max(samples), 1) if samples else 0.0,
+        'per_turn': engine.turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-of-speech to first-audio latency of the voice pipeline')
+    parser.add_argument('--turns', type=int, default=6)
+    parser.add_argument('--frame-ms', type=float, default=20.0, help='Real-time pacing of the inbound frames')
+    parser.add_argument('--words-per-second', type=float, default=3.0)
+    parser.add_argument('--endpoint-frames', type=int, default=25, help='Frames between the last word and the final result')
+    parser.add_argument('--gap-frames', type=int, default=150, help='Silence while the answer plays')
+    parser.add_argument('--revise-every', type=int, default=3, help='Every Nth final differs from its stable interim')
+    parser.add_argument('--llm-ms', type=float, default=350.0, help='Time to first token')
+    parser.add_argument('--chunk-ms', type=float, default=30.0, help='Delay between streamed chunks')
+    parser.add_argument('--tts-ms', type=float, default=120.0, help='Synthesis time per sentence')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    results = [run(False, args), run(True, args)]
+    print('%10s %6s %9s %6s %7s %9s %10s %10s %10s' % (
+        'speculate', 'turns', 'llm calls', 'hits', 'misses', 'barge-ins', 'p50 ms', 'p95 ms', 'max ms'))
+    for result in results:
+        print('%10s %6d %9d %6d %7d %9d %10.1f %10.1f %10.1f' % (
+            result['speculate'], result['turns'], result['llm_calls'], result['speculation_hits'],
+            result['speculation_misses'], result['barge_ins'], result['p50_first_audio_ms'], result['p95_first_audio_ms'],
+            result['max_first_audio_ms']))
+    write_report(args.output, {'args': vars(args), 'results': results})
+
+
+if __name__ == '__main__':
+    main()
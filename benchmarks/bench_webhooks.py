@@ -0,0 +1,86 @@
+import argparse
+import threading
+import time
+
+from app.webhooks import BufferFull, StatusBuffer
+from benchmarks.common import percentile, write_report
+
+
+def run(rate, producers, seconds, flush_size, flush_interval, commit_ms, per_event_us):
+    # The apply function stands in for one group commit: a fixed commit cost
+    # plus a small per-row cost, like the CASE UPDATE on an indexed table.
+    def apply(events):
+        time.sleep(commit_ms / 1000.0 + len(events) * per_event_us / 1e6)
+
+    buffer = StatusBuffer(apply, max_pending=20000, flush_size=flush_size, flush_interval=flush_interval)
+    latencies = [[] for _ in range(producers)]
+    rejected = [0] * producers
+    interval = producers / float(rate)
+    deadline = time.monotonic() + seconds
+
+    def producer(n):
+        next_at = time.monotonic() + n * interval / producers
+        seq = 0
+        while next_at < deadline:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            started = time.perf_counter()
+            try:
+                batch = buffer.submit((n * 1000000 + seq, 'ringing', seq))
+                batch.done.wait(5)
+                latencies[n].append((time.perf_counter() - started) * 1000)
+            except BufferFull:
+                rejected[n] += 1
+            seq += 1
+            next_at += interval
+
+    threads = [threading.Thread(target=producer, args=(n,)) for n in range(producers)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    samples = [value for values in latencies for value in values]
+    stats = buffer.snapshot()
+    return {
+        'target_rate': rate,
+        'events': len(samples),
+        'events_per_second': round(len(samples) / elapsed, 1),
+        'rejected': sum(rejected),
+        'flushes': stats['flushes'],
+        'mean_batch': round(stats['flushed_events'] / stats['flushes'], 1) if stats['flushes'] else 0,
+        'p50_ms': round(percentile(samples, 50), 2),
+        'p95_ms': round(percentile(samples, 95), 2),
+        'p99_ms': round(percentile(samples, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Acknowledgement latency of the group-commit status buffer')
+    parser.add_argument('--rates', default='500,2000,5000', help='Events per second to offer')
+    parser.add_argument('--producers', type=int, default=64, help='Concurrent webhook handlers')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--flush-size', type=int, default=500)
+    parser.add_argument('--flush-interval', type=float, default=0.005)
+    parser.add_argument('--commit-ms', type=float, default=2.0, help='Fixed cost of one commit')
+    parser.add_argument('--per-event-us', type=float, default=20.0, help='Extra cost per event in a commit')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    results = [
+        run(int(rate), args.producers, args.seconds, args.flush_size, args.flush_interval, args.commit_ms, args.per_event_us)
+        for rate in args.rates.split(',')
+    ]
+    print('%8s %10s %10s %9s %8s %10s %8s %8s %8s' % (
+        'rate', 'events', 'events/s', 'rejected', 'flushes', 'batch', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for result in results:
+        print('%8d %10d %10.1f %9d %8d %10.1f %8.2f %8.2f %8.2f' % (
+            result['target_rate'], result['events'], result['events_per_second'], result['rejected'],
+            result['flushes'], result['mean_batch'], result['p50_ms'], result['p95_ms'], result['p99_ms']))
+    write_report(args.output, {'args': vars(args), 'results': results})
+
+
+if __name__ == '__main__':
+    main()
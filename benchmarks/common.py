@@ -0,0 +1,127 @@
+import json
+import os
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CALLBACK_STATUSES = ('yes', 'no', 'callback_done', 'callback_needed')
+
+
+@contextmanager
+def disposable_database(name=None, keep=False):
+    # Benchmarks run against a throwaway schema on the server configured in
+    # .env; the app's pool is pointed at it by overriding DATABASE.
+    name = name or os.getenv('BENCH_DATABASE', 'telecalling_bench')
+    server = {
+        'host': os.getenv('HOST'),
+        'user': os.getenv('USER'),
+        'password': os.getenv('PASSWORD'),
+    }
+    conn = mysql.connector.connect(**server)
+    cursor = conn.cursor()
+    cursor.execute('DROP DATABASE IF EXISTS `%s`' % name)
+    cursor.execute('CREATE DATABASE `%s`' % name)
+    previous = os.environ.get('DATABASE')
+    os.environ['DATABASE'] = name
+    try:
+        yield name
+    finally:
+        if previous is None:
+            os.environ.pop('DATABASE', None)
+        else:
+            os.environ['DATABASE'] = previous
+        if not keep:
+            cursor.execute('DROP DATABASE IF EXISTS `%s`' % name)
+        cursor.close()
+        conn.close()
+
+
+def seed_tenants(conn, tenants, credits=1000):
+    cursor = conn.cursor()
+    user_ids = []
+    for n in range(tenants):
+        cursor.execute(
+            'INSERT INTO users (user_name, email, password) VALUES (%s, %s, %s)',
+            ('tenant%d' % n, 'tenant%d@example.com' % n, 'x')
+        )
+        user_id = cursor.lastrowid
+        cursor.execute(
+            'INSERT INTO user_call_data (user_id, twilio_phone_number, dataset) VALUES (%s, %s, %s)',
+            (user_id, '+1555%07d' % n, 'Opening hours are 9am to 5pm. ' * 50)
+        )
+        cursor.execute('INSERT INTO credits (user_id, credits) VALUES (%s, %s)', (user_id, credits))
+        user_ids.append(user_id)
+    conn.commit()
+    cursor.close()
+    return user_ids
+
+
+def seed_calls(conn, user_ids, rows, batch_size=5000, done_ratio=0.8, history_chars=400, seed=7):
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    start = datetime(2024, 1, 1)
+    span = 365 * 24 * 3600
+    history = 'caller: hello assistant: hi ' * (history_chars // 28 + 1)
+    inserted = 0
+    while inserted < rows:
+        count = min(batch_size, rows - inserted)
+        values = []
+        params = []
+        for n in range(count):
+            values.append('(%s, %s, %s, %s, %s, %s, %s, %s, %s)')
+            params.extend((
+                rng.choice(user_ids),
+                'Contact %d' % (inserted + n),
+                '+1%010d' % rng.randrange(10 ** 10),
+                rng.choice(('1way', '2way')),
+                history[:history_chars],
+                'Reminder about your appointment',
+                rng.choice(CALLBACK_STATUSES),
+                1 if rng.random() < done_ratio else 0,
+                start + timedelta(seconds=rng.randrange(span)),
+            ))
+        cursor.execute(
+            'INSERT INTO calls (user_id, receiver_name, receiver_phone, call_type, conversation_history, '
+            'ai_transmission_message, callback_status, call_done, call_timestamp) VALUES ' + ', '.join(values),
+            params
+        )
+        conn.commit()
+        inserted += count
+    cursor.close()
+    return inserted
+
+
+def time_call(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[max(0, int(len(samples) * 0.95) - 1)], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def write_report(path, report):
+    if not path:
+        return
+    with open(path, 'w') as handle:
+        json.dump(report, handle, indent=2, default=str)
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import disposable_database, seed_calls, write_report
+from benchmarks.loadtest.stats import Recorder, compare, print_comparison, print_summary
+
+PASSWORD = 'loadtest-password'
+
+
+def configure_environment(workdir):
+    # Local stand-ins: fake telephony and stub TTS, scratch dirs for files
+    os.environ['TELEPHONY_BACKEND'] = 'fake'
+    os.environ['TTS_BACKEND'] = 'stub'
+    os.environ['TTS_CACHE_DIR'] = os.path.join(workdir, 'tts')
+    os.environ['UPLOAD_DIR'] = os.path.join(workdir, 'uploads')
+    os.environ['ARCHIVE_DIR'] = os.path.join(workdir, 'archive')
+    os.environ.setdefault('SECRET_KEY', 'loadtest')
+
+
+def seed(tenants, calls):
+    from werkzeug.security import generate_password_hash
+    from app.db import get_db_connection, transaction
+    from app.models import CallStats, Credits, UserCallData, Users
+
+    hashed = generate_password_hash(PASSWORD)
+    usernames = []
+    user_ids = []
+    for n in range(tenants):
+        username = 'loadtest%d' % n
+        with transaction() as conn:
+            user_id = Users.add_user(username, '%s@example.com' % username, hashed, conn=conn)
+            UserCallData.add_user_call_data(user_id, '+1555%07d' % n, 'Opening hours are 9am to 5pm. ' * 50, conn=conn)
+            Credits.add_credits(user_id, 1000000, conn=conn)
+        usernames.append(username)
+        user_ids.append(user_id)
+    conn = get_db_connection()
+    seed_calls(conn, user_ids, calls)
+    cursor = conn.cursor()
+    cursor.execute('SELECT MIN(id), MAX(id) FROM calls')
+    id_range = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    CallStats.rebuild()
+    return usernames, id_range
+
+
+def run_load(args, usernames, id_range):
+    from app import app
+    from app.dispatcher import Dispatcher
+    from app.telephony import FakeTelephonyClient
+    from benchmarks.loadtest.traffic import VirtualUser, bulk_upload, start_thread, status_churn
+
+    app.config['TESTING'] = True
+    recorder = Recorder()
+    stop = threading.Event()
+    background = []
+
+    dispatcher = None
+    if args.dispatch_rate:
+        client = FakeTelephonyClient(latency=args.telephony_latency, failure_rate=0.05, transient_rate=0.02, seed=5)
+        dispatcher = Dispatcher(client, calls_per_second=args.dispatch_rate, concurrency_per_number=4,
+                                max_workers=16, poll_interval=0.5)
+        background.append(start_thread(dispatcher.run, name='dispatcher'))
+    if args.churn_rate and id_range[0] is not None:
+        background.append(start_thread(status_churn, recorder, id_range, args.churn_rate, stop, name='churn'))
+
+    upload_result = {}
+    if args.upload_rows:
+        def upload():
+            upload_result.update(bulk_upload(app, recorder, usernames[0], PASSWORD, args.upload_rows))
+        background.append(start_thread(upload, name='bulk-upload'))
+
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [
+        VirtualUser(app, recorder, usernames[n % len(usernames)], PASSWORD, seed=n, think_time=args.think_time)
+        for n in range(args.users)
+    ]
+    threads = [start_thread(user.run, deadline, name='vu-%d' % n) for n, user in enumerate(users)]
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    stop.set()
+    if dispatcher is not None:
+        dispatcher.stop()
+    for thread in background:
+        thread.join(timeout=max(5.0, args.upload_timeout))
+
+    return {
+        'elapsed_seconds': round(elapsed, 2),
+        'endpoints': recorder.summary(elapsed),
+        'bulk_upload': upload_result or None,
+        'dispatcher': dict(dispatcher.stats) if dispatcher is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay dashboard, upload, export and status-churn traffic against the app')
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--calls', type=int, default=200000, help='Historical calls seeded before the run')
+    parser.add_argument('--users', type=int, default=16, help='Concurrent virtual dashboard users')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds of mixed traffic')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between a user\'s requests')
+    parser.add_argument('--upload-rows', type=int, default=100000, help='Contacts in the bulk CSV upload (0 to skip)')
+    parser.add_argument('--upload-timeout', type=float, default=600.0)
+    parser.add_argument('--churn-rate', type=float, default=50.0, help='Call status updates per second (0 to skip)')
+    parser.add_argument('--dispatch-rate', type=float, default=20.0, help='Fake calls placed per second per number (0 to skip)')
+    parser.add_argument('--telephony-latency', type=float, default=0.05)
+    parser.add_argument('--baseline', help='Compare against a report saved by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative p95/p99/throughput change')
+    parser.add_argument('--save-baseline', help='Write this run\'s report as the new baseline')
+    parser.add_argument('--output', help='Write the JSON report here')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='telecalling-loadtest-')
+    configure_environment(workdir)
+    with disposable_database('telecalling_loadtest'):
+        from app.migrations import migrate
+
+        migrate()
+        usernames, id_range = seed(args.tenants, args.calls)
+        result = run_load(args, usernames, id_range)
+
+    print_summary(result['endpoints'])
+    if result['bulk_upload']:
+        print('bulk upload: %s' % json.dumps(result['bulk_upload']))
+    if result['dispatcher']:
+        print('dispatcher: %s' % json.dumps(result['dispatcher']))
+
+    report = {'args': vars(args), 'results': result}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)['results']['endpoints']
+        rows = compare(result['endpoints'], baseline, args.tolerance)
+        print()
+        print_comparison(rows)
+        report['comparison'] = rows
+        regressions = [row['endpoint'] for row in rows if row['status'] == 'regression']
+    write_report(args.output, report)
+    write_report(args.save_baseline, report)
+    if regressions:
+        print('Regressed: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import threading
+from collections import Counter
+
+from benchmarks.common import percentile
+
+
+class Recorder:
+    # Latency samples and status counts per endpoint label, shared by all
+    # virtual users and background drivers.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._statuses = {}
+
+    def record(self, label, seconds, status):
+        with self._lock:
+            self._samples.setdefault(label, []).append(seconds * 1000)
+            self._statuses.setdefault(label, Counter())[str(status)] += 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            labels = sorted(self._samples)
+            samples = {label: list(self._samples[label]) for label in labels}
+            statuses = {label: dict(self._statuses[label]) for label in labels}
+        endpoints = {}
+        for label in labels:
+            values = samples[label]
+            errors = sum(count for status, count in statuses[label].items() if not status.isdigit() or int(status) >= 500)
+            endpoints[label] = {
+                'requests': len(values),
+                'errors': errors,
+                'throughput_rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+                'p50_ms': round(percentile(values, 50), 2),
+                'p95_ms': round(percentile(values, 95), 2),
+                'p99_ms': round(percentile(values, 99), 2),
+                'max_ms': round(max(values), 2),
+                'statuses': statuses[label],
+            }
+        return endpoints
+
+
+def compare(current, baseline, tolerance=0.2):
+    # An endpoint regresses when its p95 or p99 grows, or its throughput
+    # shrinks, by more than `tolerance` relative to the baseline run.
+    rows = []
+    for label, result in sorted(current.items()):
+        previous = baseline.get(label)
+        if not previous:
+            rows.append({'endpoint': label, 'status': 'new'})
+            continue
+        row = {'endpoint': label, 'status': 'ok'}
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            before = previous.get(key) or 0.0
+            row[key] = (before, result[key], round((result[key] - before) / before * 100, 1) if before else None)
+        worse_latency = any(
+            previous.get(key) and result[key] > previous[key] * (1 + tolerance)
+            for key in ('p95_ms', 'p99_ms')
+        )
+        worse_throughput = previous.get('throughput_rps') and result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance)
+        if worse_latency or worse_throughput or result['errors'] > previous.get('errors', 0):
+            row['status'] = 'regression'
+        rows.append(row)
+    for label in sorted(set(baseline) - set(current)):
+        rows.append({'endpoint': label, 'status': 'missing'})
+    return rows
+
+
+def print_summary(endpoints):
+    print('%-32s %8s %7s %9s %9s %9s %9s' % ('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for label, result in endpoints.items():
+        print('%-32s %8d %7d %9.1f %9.2f %9.2f %9.2f' % (
+            label, result['requests'], result['errors'], result['throughput_rps'],
+            result['p50_ms'], result['p95_ms'], result['p99_ms']))
+
+
+def print_comparison(rows):
+    print('%-32s %-10s %20s %20s %20s' % ('endpoint', 'status', 'p95 ms (delta)', 'p99 ms (delta)', 'req/s (delta)'))
+    for row in rows:
+        if 'p95_ms' not in row:
+            print('%-32s %-10s' % (row['endpoint'], row['status']))
+            continue
+        cells = []
+        for key in ('p95_ms', 'p99_ms', 'throughput_rps'):
+            _, after, delta = row[key]
+            cells.append('%.1f (%s)' % (after, '%+.1f%%' % delta if delta is not None else 'n/a'))
+        print('%-32s %-10s %20s %20s %20s' % (row['endpoint'], row['status'], cells[0], cells[1], cells[2]))
@@ -0,0 +1,151 @@
+import io
+import random
+import threading
+import time
+
+from app.models import Calls
+
+TRAFFIC_MIX = (
+    ('history', 20),
+    ('stats', 20),
+    ('snapshot', 10),
+    ('filter', 10),
+    ('credits', 5),
+    ('upload_small', 2),
+    ('login', 2),
+    ('export', 1),
+)
+
+
+def contacts_csv(rows, seed=0):
+    rng = random.Random(seed)
+    buffer = io.StringIO()
+    buffer.write('name,phone\n')
+    for n in range(rows):
+        buffer.write('Contact %d,+91%010d\n' % (n, rng.randrange(10 ** 10)))
+    return io.BytesIO(buffer.getvalue().encode('utf-8'))
+
+
+class VirtualUser:
+    # One dashboard user with its own cookie jar, replaying a weighted mix of
+    # the tenant-facing endpoints against the in-process app.
+    def __init__(self, app, recorder, username, password, seed, think_time=0.0):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.username = username
+        self.password = password
+        self.rng = random.Random(seed)
+        self.think_time = think_time
+        self.actions = [name for name, _ in TRAFFIC_MIX]
+        self.weights = [weight for _, weight in TRAFFIC_MIX]
+
+    def request(self, label, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.open(path, method=method, **kwargs)
+            # Streamed bodies (exports) only count once fully read
+            response.get_data()
+            status = response.status_code
+        except Exception as e:
+            response = None
+            status = type(e).__name__
+        self.recorder.record(label, time.perf_counter() - started, status)
+        return response
+
+    def login(self):
+        return self.request('POST /api/userLogin', 'POST', '/api/userLogin',
+                            json={'username': self.username, 'password': self.password})
+
+    def history(self):
+        cursor = None
+        for _ in range(self.rng.randint(1, 3)):
+            query = {'limit': 50}
+            if cursor:
+                query['cursor'] = cursor
+            response = self.request('GET /api/user/viewCallHistory', 'GET', '/api/user/viewCallHistory', query_string=query)
+            cursor = response.get_json().get('next_cursor') if response is not None and response.status_code == 200 else None
+            if not cursor:
+                break
+
+    def stats(self):
+        self.request('GET /api/user/callStats', 'GET', '/api/user/callStats', query_string={'by_day': '1'})
+
+    def snapshot(self):
+        self.request('POST /api/user/viewRealtimeSnapshot', 'POST', '/api/user/viewRealtimeSnapshot', json={'limit': 100})
+
+    def filter(self):
+        status = self.rng.choice(Calls.CALLBACK_STATUSES)
+        self.request('POST /api/user/getCallsByFilter', 'POST', '/api/user/getCallsByFilter',
+                     json={'filter_type': status, 'limit': 50})
+
+    def credits(self):
+        self.request('POST /api/user/getCredits', 'POST', '/api/user/getCredits', json={})
+
+    def upload_small(self):
+        clients = [{'name': 'Walk-in %d' % n, 'phone': '+91%010d' % self.rng.randrange(10 ** 10)} for n in range(50)]
+        self.request('POST /api/user/uploadClientData', 'POST', '/api/user/uploadClientData',
+                     json={'client_data': clients, 'call_type': '1way', 'ai_transmission_message': 'Your order has shipped'})
+
+    def export(self):
+        self.request('GET /api/user/exportCalls', 'GET', '/api/user/exportCalls',
+                     query_string={'format': 'ndjson', 'gzip': '1', 'include_text': '0'})
+
+    def run(self, deadline):
+        self.login()
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(self.actions, self.weights)[0])()
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1.0 / self.think_time))
+
+
+def bulk_upload(app, recorder, username, password, rows, poll_interval=0.5):
+    # Uploads `rows` contacts as one CSV and waits for the background job;
+    # returns rows per second end to end.
+    user = VirtualUser(app, recorder, username, password, seed=rows)
+    user.login()
+    started = time.monotonic()
+    response = user.request('POST /api/user/uploadClientFile', 'POST', '/api/user/uploadClientFile',
+                            data={'file': (contacts_csv(rows), 'contacts.csv'), 'call_type': '1way'},
+                            content_type='multipart/form-data')
+    if response is None or response.status_code != 202:
+        return {'rows': rows, 'status': 'rejected'}
+    job_id = response.get_json()['job_id']
+    while True:
+        time.sleep(poll_interval)
+        status = user.request('GET /api/user/uploadJobStatus', 'GET', '/api/user/uploadJobStatus', query_string={'job_id': job_id})
+        job = status.get_json()['job'] if status is not None and status.status_code == 200 else None
+        if job and job['status'] in ('done', 'failed'):
+            break
+    elapsed = time.monotonic() - started
+    return {
+        'rows': rows,
+        'status': job['status'],
+        'succeeded_rows': job['succeeded_rows'],
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(job['succeeded_rows'] / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def status_churn(recorder, call_id_range, rate, stop, seed=3):
+    # Stands in for provider status callbacks flipping finished calls' outcomes
+    rng = random.Random(seed)
+    low, high = call_id_range
+    interval = 1.0 / rate
+    next_at = time.monotonic()
+    while not stop.is_set():
+        call_id = rng.randint(low, high)
+        started = time.perf_counter()
+        try:
+            Calls.update_call_status(call_id, rng.choice(Calls.CALLBACK_STATUSES), 1)
+            status = 200
+        except Exception as e:
+            status = type(e).__name__
+        recorder.record('model Calls.update_call_status', time.perf_counter() - started, status)
+        next_at += interval
+        stop.wait(max(0.0, next_at - time.monotonic()))
+
+
+def start_thread(target, *args, name=None):
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,81 @@
+import argparse
+import os
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables from .env
+
+
+def run_migrate(args):
+    from app.migrations import migrate, status
+    if args.list:
+        for version, name, applied in status():
+            print('[%s] %s_%s' % ('x' if applied else ' ', version, name))
+        return
+    applied = migrate(target=args.target)
+    for migration in applied:
+        print('Applied %s' % migration)
+    if not applied:
+        print('Schema is up to date')
+
+
+def run_rebuild_stats(args):
+    from app.models import CallStats
+    rows = CallStats.rebuild(user_id=args.user_id)
+    print('Rebuilt %d call_stats_daily rows' % rows)
+
+
+def run_partitions(args):
+    from app.partitions import ensure_partitions
+    added = ensure_partitions(months_ahead=args.months_ahead)
+    print('Added partitions: %s' % (', '.join(added) if added else 'none'))
+
+
+def run_archive(args):
+    from app.archive import run_archive as archive_calls
+    result = archive_calls(older_than_days=args.older_than_days, batch_size=args.batch_size, user_id=args.user_id)
+    for user_id, count in sorted(result['archived'].items()):
+        print('Archived %d calls for user %s' % (count, user_id))
+    print('Archived %d calls older than %s' % (sum(result['archived'].values()), result['cutoff'].isoformat(' ', 'seconds')))
+    if result['dropped_partitions']:
+        print('Dropped empty partitions: %s' % ', '.join(result['dropped_partitions']))
+
+
+def run_resume_deletions(args):
+    from app.tenant_deletion import resume_stalled
+    resumed = resume_stalled(stale_seconds=args.stale_seconds, wait=True)
+    print('Resumed %d deletion jobs' % len(resumed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintenance commands for the telecalling backend')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help='Apply pending schema migrations')
+    migrate_parser.add_argument('--target', help='Stop after this migration version, e.g. 0001')
+    migrate_parser.add_argument('--list', action='store_true', help='Show applied and pending migrations')
+    migrate_parser.set_defaults(func=run_migrate)
+
+    stats_parser = subparsers.add_parser('rebuild-stats', help='Recompute call_stats_daily from the calls table')
+    stats_parser.add_argument('--user-id', type=int, help='Only rebuild this tenant')
+    stats_parser.set_defaults(func=run_rebuild_stats)
+
+    partitions_parser = subparsers.add_parser('partitions', help='Create monthly calls partitions ahead of time')
+    partitions_parser.add_argument('--months-ahead', type=int, default=3, help='Months past the current one to cover')
+    partitions_parser.set_defaults(func=run_partitions)
+
+    archive_parser = subparsers.add_parser('archive', help='Move old finished calls to compressed archive files')
+    archive_parser.add_argument('--older-than-days', type=int, default=int(os.getenv('ARCHIVE_AFTER_DAYS', 180)))
+    archive_parser.add_argument('--batch-size', type=int, default=int(os.getenv('ARCHIVE_BATCH_SIZE', 50000)))
+    archive_parser.add_argument('--user-id', type=int, help='Only archive this tenant')
+    archive_parser.set_defaults(func=run_archive)
+
+    deletions_parser = subparsers.add_parser('resume-deletions', help='Finish tenant deletions whose worker died')
+    deletions_parser.add_argument('--stale-seconds', type=int, default=int(os.getenv('DELETE_STALE_SECONDS', 300)))
+    deletions_parser.set_defaults(func=run_resume_deletions)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
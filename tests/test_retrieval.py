@@ -0,0 +1,44 @@
+import unittest
+
+from app.retrieval import DatasetIndex, chunk_text
+
+
+def paragraph(number):
+    return 'Branch %d is open from 9am to 6pm. It offers plan %d at %d dollars.' % (number, number, number * 10)
+
+
+class ChunkTextTest(unittest.TestCase):
+    def test_long_paragraph_split_within_limit(self):
+        text = ' '.join('Sentence number %d ends here.' % number for number in range(100))
+        chunks = chunk_text(text, chunk_chars=200)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 200 for chunk in chunks))
+        self.assertEqual(' '.join(chunks), text)
+
+    def test_boundaries_independent_of_neighbours(self):
+        paragraphs = [paragraph(number) for number in range(40)]
+        before = chunk_text('\n\n'.join(paragraphs), chunk_chars=200)
+        paragraphs.insert(20, 'A new paragraph about weekend opening hours.')
+        after = chunk_text('\n\n'.join(paragraphs), chunk_chars=200)
+        self.assertEqual(set(after) - set(before), {'A new paragraph about weekend opening hours.'})
+
+
+class DatasetIndexUpdateTest(unittest.TestCase):
+    def test_middle_edit_retokenizes_one_passage(self):
+        paragraphs = [paragraph(number) for number in range(200)]
+        index = DatasetIndex()
+        index.update('\n\n'.join(paragraphs))
+        paragraphs[100] = paragraphs[100].replace('9am', '10am')
+        self.assertEqual(index.update('\n\n'.join(paragraphs)), {'added': 1, 'removed': 1, 'kept': 199})
+        self.assertIn('10am', index.search('branch 100 open')[0][0])
+
+    def test_middle_insert_retokenizes_one_passage(self):
+        paragraphs = [paragraph(number) for number in range(200)]
+        index = DatasetIndex()
+        index.update('\n\n'.join(paragraphs))
+        paragraphs.insert(100, 'Refunds are processed within five business days.')
+        self.assertEqual(index.update('\n\n'.join(paragraphs)), {'added': 1, 'removed': 0, 'kept': 200})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from datetime import datetime, timezone
+
+from app.scheduler import FairScheduler
+
+NOW = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+class FairSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = FairScheduler(clock=lambda: NOW)
+
+    def test_weighted_shares(self):
+        self.scheduler.update(1, 1000, credits=1000, weight=3)
+        self.scheduler.update(2, 1000, credits=1000, weight=1)
+        self.assertEqual(self.scheduler.next_batch(400), {1: 300, 2: 100})
+
+    def test_shortfall_parks_tenant(self):
+        self.scheduler.update(1, 10, credits=10)
+        self.assertEqual(self.scheduler.next_batch(1), {1: 1})
+        self.scheduler.shortfall(1, 1)
+        tenant = self.scheduler.tenants[1]
+        self.assertEqual(self.scheduler.next_batch(5), {})
+        self.assertEqual((tenant.pending, tenant.in_flight, tenant.credits), (0, 0, 10))
+
+    def test_exhaust_credits_blocks_tenant(self):
+        self.scheduler.update(1, 10, credits=10)
+        self.scheduler.update(2, 10, credits=10)
+        self.scheduler.next_batch(2)
+        self.scheduler.exhaust_credits(1)
+        self.assertEqual(self.scheduler.next_batch(4), {2: 4})
+        self.assertEqual(self.scheduler.tenants[1].credits, 0)
+
+    def test_concurrency_release(self):
+        self.scheduler.update(1, 10, credits=10, concurrency=2)
+        self.assertEqual(self.scheduler.next_batch(5), {1: 2})
+        self.scheduler.release(1)
+        self.assertEqual(self.scheduler.next_batch(5), {1: 1})
+
+    def test_calling_window(self):
+        self.scheduler.update(1, 10, credits=10, window_start='20:00', window_end='06:00')
+        self.assertEqual(self.scheduler.next_batch(5), {})
+        self.assertEqual(self.scheduler.next_batch(5, now=NOW + 8 * 3600), {1: 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
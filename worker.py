@@ -1 +1,23 @@
+import logging
+import signal
+from dotenv import load_dotenv
 
+load_dotenv()  # Load environment variables from .env
+
+from app.dispatcher import Dispatcher
+from app import ingest, tenant_deletion
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    dispatcher = Dispatcher.from_env()
+    resumers = [tenant_deletion.start_resumer(), ingest.start_resumer()]
+    signal.signal(signal.SIGTERM, lambda signum, frame: dispatcher.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: dispatcher.stop())
+    dispatcher.run()
+    for resumer in resumers:
+        resumer.set()
+
+
+if __name__ == '__main__':
+    main()